@@ -2,6 +2,8 @@
 
 from pathlib import Path
 import os
+import sys
+import tempfile
 from django.utils import timezone 
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -34,12 +36,19 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'shop.log.RequestIdMiddleware',
+    'shop.slowlog.SlowQueryLogMiddleware',
+    # 💡 บีบอัด br/gzip (ต้องอยู่ก่อน middleware อื่นที่อ่าน/แก้ body ของ response)
+    'shop.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'shop.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'shop.cart.GuestCartMiddleware',
+    'shop.admission.AdmissionControlMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -49,12 +58,19 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'], 
-        'APP_DIRS': True,
         'OPTIONS': {
+            # 💡 ย่อ HTML ครั้งเดียวตอนโหลด template (ดู shop/minify.py) แทน APP_DIRS
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'shop.minify.FilesystemLoader',
+                    'shop.minify.AppDirectoriesLoader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'shop.cart.cart_context',
             ],
         },
     },
@@ -70,10 +86,85 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # 💡 test DB เป็นไฟล์ (ไม่ใช่ in-memory shared cache ที่ล็อกระดับตารางแล้ว error ทันที)
+        # เพื่อให้ test ที่ยิง request พร้อมกันหลาย thread รอ lock ได้เหมือน DB จริง
+        # ชื่อไฟล์มี pid ต่อท้าย → รัน test พร้อมกันหลายชุดบนเครื่องเดียวกันได้โดยไม่ชนกัน
+        'TEST': {'NAME': os.environ.get('TEST_DB_NAME', os.path.join(tempfile.gettempdir(), f'arttoy-test-{os.getpid()}.sqlite3'))},
     }
 }
 
 
+# Cache
+# 💡 local-memory cache (ต่อ process) ใช้เก็บ state ของ admission control ฯลฯ
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'arttoy-default',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
+    # 💡 cache ที่ทุก gunicorn worker เห็นร่วมกัน (เช่น version ของ catalog)
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('SHARED_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'arttoy-shared-cache')),
+    },
+}
+
+# Catalog snapshot ต่อ worker (ดู shop/catalog.py)
+CATALOG_CACHE_ALIAS = 'shared'
+CATALOG_VERSION_CHECK_INTERVAL = float(os.environ.get('CATALOG_VERSION_CHECK_INTERVAL', 1.0))
+
+# สต็อกสดสำหรับหน้า catalog ที่ cache HTML ไว้ (ดู shop/stock_status.py)
+LIVE_STOCK = {
+    'TTL': int(os.environ.get('LIVE_STOCK_TTL', 2)),
+    'FRAGMENT_TIMEOUT': int(os.environ.get('CATALOG_FRAGMENT_TIMEOUT', 300)),
+}
+
+# Admission control สำหรับ cart/checkout ช่วง drop (ดู shop/admission.py สำหรับค่าทั้งหมด)
+ADMISSION_CONTROL = {
+    'ENABLED': os.environ.get('ADMISSION_CONTROL', '1') == '1',
+    'GLOBAL_RATE': float(os.environ.get('ADMISSION_GLOBAL_RATE', 10)),
+    'GLOBAL_BURST': int(os.environ.get('ADMISSION_GLOBAL_BURST', 20)),
+    'TRUSTED_PROXY_DEPTH': int(os.environ.get('ADMISSION_TRUSTED_PROXY_DEPTH', 0)),
+}
+
+# 💡 แจ้งเตือนสินค้ากลับมามีสต็อกผ่าน LINE (ดู shop/restock.py)
+# ตั้ง LINE_API_HOST เป็น stub server ในเครื่องเพื่อทดสอบได้
+RESTOCK_NOTIFICATIONS = {
+    'CHANNEL_ACCESS_TOKEN': os.environ.get('LINE_CHANNEL_ACCESS_TOKEN', ''),
+    'API_HOST': os.environ.get('LINE_API_HOST', 'https://api.line.me'),
+    'RATE': float(os.environ.get('LINE_MULTICAST_RATE', 10)),
+    # ใช้ตรวจลายเซ็น webhook ตอนผูกบัญชี (ตั้ง Webhook URL ใน LINE Developers เป็น /line/webhook/)
+    'CHANNEL_SECRET': os.environ.get('LINE_CHANNEL_SECRET', ''),
+    'BOT_BASIC_ID': os.environ.get('LINE_BOT_BASIC_ID', ''),
+}
+
+# ซิงก์สถานะพัสดุจากบริษัทขนส่ง (ดู shop/courier.py) ตั้งบริษัทขนส่งเพิ่มได้ใน COURIERS
+# ⚠️ courier จาก env ต้องตั้งทั้ง URL และ PATTERN (regex ของเลขพัสดุ เช่น ^TH) ไม่งั้นจะไม่เปิดใช้
+COURIER_TRACKING = {
+    'COURIERS': [
+        {
+            'NAME': os.environ.get('COURIER_TRACKING_NAME', 'default'),
+            'PATTERN': os.environ.get('COURIER_TRACKING_PATTERN', ''),
+            'URL': os.environ.get('COURIER_TRACKING_URL', ''),
+            'TOKEN': os.environ.get('COURIER_TRACKING_TOKEN', ''),
+        },
+    ] if os.environ.get('COURIER_TRACKING_URL') and os.environ.get('COURIER_TRACKING_PATTERN') else [],
+    'CONCURRENCY': int(os.environ.get('COURIER_TRACKING_CONCURRENCY', 50)),
+}
+
+
+# บีบอัด response (ดู shop/compression.py) ติดตั้ง brotli เพื่อให้ใช้ br ได้ ไม่มีก็ใช้ gzip
+RESPONSE_COMPRESSION = {
+    'ENABLED': os.environ.get('RESPONSE_COMPRESSION', '1') == '1',
+}
+
+# Idempotency key ของ checkout / ยืนยันชำระเงิน (ดู shop/idempotency.py) เก็บผลลัพธ์ไว้ตอบซ้ำกี่วินาที
+IDEMPOTENCY = {
+    'TTL': int(os.environ.get('IDEMPOTENCY_TTL', 24 * 60 * 60)),
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -122,7 +213,116 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# 💡 ไฟล์ที่อัปโหลดใหม่ตั้งชื่อตาม hash ของเนื้อหา (cache ที่ browser/CDN ได้แบบ immutable)
+STORAGES = {
+    'default': {'BACKEND': 'shop.media.ContentHashStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+# เสิร์ฟ media (ดู shop/media.py): MEDIA_OFFLOAD=x-accel-redirect (nginx) หรือ x-sendfile (apache)
+# ให้ front server ส่งไฟล์เอง ว่าง = ส่งด้วย FileResponse + sendfile ของ gunicorn
+MEDIA_SERVING = {
+    'OFFLOAD': os.environ.get('MEDIA_OFFLOAD', ''),
+    'ACCEL_PREFIX': os.environ.get('MEDIA_ACCEL_PREFIX', '/protected-media/'),
+}
+
 # Authentication settings
 LOGIN_URL = '/login/' 
 LOGIN_REDIRECT_URL = '/login/redirect/' 
 
+
+# 💡 Slow query log (ดู shop/slowlog.py) เขียนเป็น JSON Lines ลงไฟล์ที่ rotate เมื่อครบ 10MB
+# ปิดไว้เป็นค่าเริ่มต้น เปิดด้วย SLOW_QUERY_LOG=1 / ⚠️ SLOW_QUERY_LOG_PARAMS=1 จะบันทึกค่า parameter (ข้อมูลลูกค้า) ด้วย
+SLOW_QUERY_LOG = {
+    'ENABLED': os.environ.get('SLOW_QUERY_LOG', '0') == '1',
+    'LOG_PARAMS': os.environ.get('SLOW_QUERY_LOG_PARAMS', '0') == '1',
+    'THRESHOLD_MS': float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 100)),
+    'FILE': os.environ.get('SLOW_QUERY_LOG_FILE', os.path.join(tempfile.gettempdir(), 'arttoy-slow-queries.jsonl')),
+}
+
+# 💡 Profiling ราย request (ดู shop/profiling.py) ปิดไว้เป็นค่าเริ่มต้น เปิดด้วย REQUEST_PROFILING=1
+REQUEST_PROFILING = {
+    'ENABLED': os.environ.get('REQUEST_PROFILING', '0') == '1',
+    'DIRECTORY': os.environ.get('PROFILES_DIR', os.path.join(tempfile.gettempdir(), 'arttoy-profiles')),
+    'SAMPLE_RATE': float(os.environ.get('PROFILING_SAMPLE_RATE', 0)),
+}
+
+# Logging
+# 💡 log เป็น JSON ผ่าน QueueListenerHandler เพื่อให้การเขียน stdout เกิดบน thread แยก ไม่บล็อก worker
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+# ระหว่าง manage.py test ไม่พิมพ์ log ลง console (assertLogs ยังจับได้ตามปกติ) ตั้ง TEST_LOG_LEVEL เพื่อดู log ได้
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
+CONSOLE_LOG_LEVEL = os.environ.get('TEST_LOG_LEVEL', 'CRITICAL') if TESTING else 'NOTSET'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'request_id': {
+            '()': 'shop.log.RequestIdFilter',
+        },
+    },
+    'formatters': {
+        'json': {
+            '()': 'shop.log.JsonFormatter',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json',
+            'level': CONSOLE_LOG_LEVEL,
+        },
+        'queue': {
+            '()': 'shop.log.QueueListenerHandler',
+            'handlers': ['cfg://handlers.console'],
+            'filters': ['request_id'],
+        },
+        'slow_query_file': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': SLOW_QUERY_LOG['FILE'],
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'encoding': 'utf-8',
+            'delay': True,
+            'formatter': 'json',
+        },
+        'slow_query_queue': {
+            '()': 'shop.log.QueueListenerHandler',
+            'handlers': ['cfg://handlers.slow_query_file', 'cfg://handlers.console'],
+            'filters': ['request_id'],
+        },
+    },
+    'root': {
+        'handlers': ['queue'],
+        'level': 'WARNING',
+    },
+    'loggers': {
+        'django': {
+            'handlers': ['queue'],
+            'level': os.environ.get('DJANGO_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+        'django.db.backends': {
+            'handlers': ['queue'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+        'shop': {
+            'handlers': ['queue'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
+        'shop.models': {
+            'level': os.environ.get('SHOP_PAYMENT_LOG_LEVEL', LOG_LEVEL),
+        },
+        'shop.signals': {
+            'level': os.environ.get('SHOP_STOCK_LOG_LEVEL', LOG_LEVEL),
+        },
+        'shop.slowlog': {
+            'handlers': ['slow_query_queue'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
@@ -16,10 +16,13 @@ Including another URLconf
 """
 # arttoy_project/urls.py
 
+import re
+
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings 
-from django.conf.urls.static import static 
+
+from shop import media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -27,6 +30,9 @@ urlpatterns = [
     path('', include('shop.urls', namespace='shop')), 
 ]
 
-# 💡 [NEW] เพิ่มการตั้งค่าสำหรับ Media file ใน Development
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+# 💡 Media file (รูปสินค้า) ทั้ง Development และ Production: ส่งต่อให้ nginx ถ้าตั้ง MEDIA_SERVING['OFFLOAD']
+# ไม่งั้นใช้ sendfile ของ WSGI server (ดู shop/media.py) ถ้า MEDIA_URL เป็น CDN/โดเมนอื่นไม่ต้องเสิร์ฟเอง
+if settings.MEDIA_URL.startswith('/'):
+    urlpatterns += [
+        re_path(r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')), media.serve, name='media'),
+    ]
\ No newline at end of file
@@ -1,9 +1,15 @@
 # shop/admin.py
 
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.utils.html import format_html
 from django.db.models import Sum
-from .models import Product, Order, OrderItem, Cart, CartItem, Payment
+from django.http import StreamingHttpResponse
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+from .models import Product, StockShard, Order, OrderItem, Cart, CartItem, Payment, RestockSubscription, LineAccount, IdempotencyRecord
+from .fulfilment import bulk_transition, parse_tracking_csv
+from . import exports
 
 # -----------------
 # 1. การจัดการ Order (แสดงรายละเอียด OrderItem ภายใน Order)
@@ -45,6 +51,96 @@ class OrderAdmin(admin.ModelAdmin):
         }),
     )
     inlines = [OrderItemInline]
+    # ✅ [NEW] อัปเดตสถานะหลายออเดอร์พร้อมกันจากหน้าลิสต์ (bulk_update + hook ครั้งเดียว)
+    actions = ['mark_confirmed', 'mark_shipped', 'mark_delivered', 'mark_cancelled']
+
+    def get_urls(self):
+        urls = [
+            path('import-tracking/', self.admin_site.admin_view(self.import_tracking_view), name='shop_order_import_tracking'),
+            path('export/', self.admin_site.admin_view(self.export_view), name='shop_order_export'),
+        ]
+        return urls + super().get_urls()
+
+    def import_tracking_view(self, request):
+        """อัปโหลด CSV (order_id, tracking_number) จากบริษัทขนส่ง แล้วเปลี่ยนสถานะเป็น SHIPPED"""
+        results = None
+        if request.method == 'POST':
+            if not self.has_change_permission(request):
+                messages.error(request, 'ไม่มีสิทธิ์แก้ไขคำสั่งซื้อ')
+                return redirect('admin:shop_order_changelist')
+            uploaded = request.FILES.get('csv_file')
+            if uploaded:
+                pairs, errors = parse_tracking_csv(uploaded)
+                results = errors + bulk_transition(list(pairs), tracking_numbers=pairs)
+                self._report_results(request, results)
+            else:
+                messages.error(request, 'กรุณาเลือกไฟล์ CSV')
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'นำเข้าหมายเลขติดตามพัสดุ (CSV)',
+            'results': results,
+        }
+        return TemplateResponse(request, 'admin/shop/order/import_tracking.html', context)
+
+    def export_view(self, request):
+        """ส่งออกยอดขาย (ออเดอร์ + รายการสินค้า + การชำระเงิน) ตามช่วงวันที่ แบบ stream (ดู shop/exports.py)"""
+        if not self.has_view_permission(request):
+            messages.error(request, 'ไม่มีสิทธิ์ดูคำสั่งซื้อ')
+            return redirect('admin:index')
+
+        fmt = request.GET.get('format', 'csv')
+        if 'start' in request.GET and fmt in exports.FORMATS:
+            try:
+                start, end = exports.parse_date_range(request.GET['start'], request.GET.get('end', ''))
+            except ValueError as exc:
+                messages.error(request, str(exc))
+            else:
+                response = StreamingHttpResponse(
+                    exports.generate(fmt, start, end),
+                    content_type=exports.FORMATS[fmt].content_type,
+                )
+                response['Content-Disposition'] = f'attachment; filename="{exports.filename(fmt, start, end)}"'
+                response['Cache-Control'] = 'private, no-store'
+                return response
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'ส่งออกยอดขายสำหรับฝ่ายบัญชี',
+            'formats': sorted(exports.FORMATS),
+            'values': request.GET,
+        }
+        return TemplateResponse(request, 'admin/shop/order/export.html', context)
+
+    def _apply_status(self, request, queryset, status):
+        results = bulk_transition(list(queryset.values_list('id', flat=True)), status)
+        self._report_results(request, results)
+
+    def _report_results(self, request, results):
+        failed = [row for row in results if not row.ok]
+        self.message_user(request, f'อัปเดตสำเร็จ {len(results) - len(failed)} รายการ', messages.SUCCESS)
+        for row in failed[:20]:
+            self.message_user(request, f'#{row.order_id}: {row.message}', messages.WARNING)
+        if len(failed) > 20:
+            self.message_user(request, f'และไม่สำเร็จอีก {len(failed) - 20} รายการ', messages.WARNING)
+
+    @admin.action(description='เปลี่ยนสถานะเป็น: ยืนยันแล้ว')
+    def mark_confirmed(self, request, queryset):
+        self._apply_status(request, queryset, 'CONFIRMED')
+
+    @admin.action(description='เปลี่ยนสถานะเป็น: กำลังจัดส่ง')
+    def mark_shipped(self, request, queryset):
+        self._apply_status(request, queryset, 'SHIPPED')
+
+    @admin.action(description='เปลี่ยนสถานะเป็น: จัดส่งสำเร็จ')
+    def mark_delivered(self, request, queryset):
+        self._apply_status(request, queryset, 'DELIVERED')
+
+    @admin.action(description='เปลี่ยนสถานะเป็น: ยกเลิก')
+    def mark_cancelled(self, request, queryset):
+        self._apply_status(request, queryset, 'CANCELLED')
     
     # ฟังก์ชันช่วยแสดงผล
     def display_total_amount(self, obj):
@@ -55,22 +151,73 @@ class OrderAdmin(admin.ModelAdmin):
 # -----------------
 # 2. การจัดการ Product
 # -----------------
+class StockShardInline(admin.TabularInline):
+    # แสดงสต็อกแต่ละ shard (แก้ไขผ่าน stock/shard_count ของสินค้าแทน)
+    model = StockShard
+    extra = 0
+    can_delete = False
+    readonly_fields = ('index', 'count')
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     # ❌ [FIXED] เปลี่ยน 'display_price' กลับเป็น 'price' เพื่อให้ 'list_editable' ทำงานได้
     # เราจะใช้การแสดงผลแบบดิบของ Django Admin สำหรับฟิลด์ที่สามารถแก้ไขได้
-    list_display = ('name', 'price', 'stock', 'is_active', 'is_in_stock', 'image_tag') 
-    list_filter = ('is_active', 'created_at')
+    list_display = ('name', 'price', 'stock', 'is_active', 'is_in_stock', 'days_of_cover', 'image_tag') 
+    list_filter = ('is_active', 'forecast__is_low_stock', 'created_at')
+    list_select_related = ('forecast',)
     # สามารถแก้ไขราคากับสต็อกได้จากหน้าลิสต์
     list_editable = ('price', 'stock', 'is_active') 
     search_fields = ('name', 'description')
     date_hierarchy = 'created_at'
+    inlines = [StockShardInline]
+    # 💡 Admin เห็นสินค้าทั้งหมดรวมที่ถูก soft delete / ลบจริงไม่ได้ (cascade ไปตะกร้าทั้งหมดในครั้งเดียว)
+    actions = ['soft_delete_selected', 'restore_selected']
+
+    def get_queryset(self, request):
+        return Product.all_objects.select_related('forecast')
+
+    def get_list_display(self, request):
+        return (*self.list_display, 'deleted_at')
+
+    def get_list_filter(self, request):
+        return (('deleted_at', admin.EmptyFieldListFilter), *self.list_filter)
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    @admin.action(description='ลบสินค้าที่เลือก (soft delete)')
+    def soft_delete_selected(self, request, queryset):
+        updated = queryset.soft_delete()
+        self.message_user(request, f'ลบสินค้า {updated} รายการแล้ว (ตะกร้าที่ค้างจะถูกล้างโดย purge_deleted_products)')
+
+    @admin.action(description='กู้คืนสินค้าที่เลือก')
+    def restore_selected(self, request, queryset):
+        updated = queryset.restore()
+        self.message_user(request, f'กู้คืนสินค้า {updated} รายการแล้ว (ยังเป็นสถานะปิดการขาย)')
 
     # ❌ [REMOVED] ลบ display_price ออก เพราะเราใช้ price ใน list_display แล้ว
     # def display_price(self, obj):
     #     return f"฿{obj.price:,.2f}"
     # display_price.short_description = 'ราคา'
 
+    # 💡 จาก DemandForecast (คำนวณทุกคืนด้วย forecast_demand)
+    @admin.display(description='สต็อกพอขาย (วัน)', ordering='forecast__days_of_cover')
+    def days_of_cover(self, obj):
+        forecast = getattr(obj, 'forecast', None)
+        if forecast is None or forecast.days_of_cover is None:
+            return '-'
+        if forecast.is_low_stock:
+            return format_html('<strong style="color: #dc3545;">⚠️ {}</strong>', f'{forecast.days_of_cover:.1f}')
+        return f'{forecast.days_of_cover:.1f}'
+
     def image_tag(self, obj):
         if obj.image:
             return format_html('<img src="{}" style="width: 60px; height: 60px; object-fit: cover; border-radius: 5px;" />'.format(obj.image.url))
@@ -123,4 +270,39 @@ class PaymentAdmin(admin.ModelAdmin):
             link = f'/admin/shop/order/{obj.order.id}/'
             return format_html('<a href="{}">Order #{}</a>', link, obj.order.id)
         return 'N/A'
-    order_link.short_description = 'Order ID'
\ No newline at end of file
+    order_link.short_description = 'Order ID'
+
+
+# -----------------
+# 4. แจ้งเตือนสินค้าเข้า (LINE)
+# -----------------
+@admin.register(RestockSubscription)
+class RestockSubscriptionAdmin(admin.ModelAdmin):
+    list_display = ('product', 'user', 'line_user_id', 'created_at', 'notified_at')
+    list_filter = ('notified_at', 'created_at')
+    search_fields = ('product__name', 'user__username', 'line_user_id')
+    raw_id_fields = ('product', 'user')
+
+
+@admin.register(LineAccount)
+class LineAccountAdmin(admin.ModelAdmin):
+    list_display = ('user', 'line_user_id', 'linked_at')
+    search_fields = ('user__username', 'line_user_id')
+    # line_user_id มาจาก webhook เท่านั้น ไม่ให้แก้มือ
+    readonly_fields = ('line_user_id', 'link_code', 'link_code_created_at', 'linked_at')
+    raw_id_fields = ('user',)
+
+
+# -----------------
+# 5. Idempotency key (ดูอย่างเดียว ใช้ไล่ปัญหาคำสั่งซื้อ/ชำระเงินซ้ำ)
+# -----------------
+@admin.register(IdempotencyRecord)
+class IdempotencyRecordAdmin(admin.ModelAdmin):
+    list_display = ('key', 'user', 'endpoint', 'status_code', 'location', 'created_at', 'completed_at')
+    list_filter = ('endpoint', 'status_code', 'created_at')
+    search_fields = ('key', 'user__username')
+    readonly_fields = ('user', 'key', 'endpoint', 'request_hash', 'status_code', 'location', 'content_type', 'created_at', 'completed_at')
+    exclude = ('body',)
+
+    def has_add_permission(self, request):
+        return False
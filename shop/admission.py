@@ -0,0 +1,238 @@
+# shop/admission.py
+
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, JsonResponse
+from django.shortcuts import redirect
+from django.urls import reverse
+from django.utils.http import urlencode
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 💡 Admission control สำหรับวัน drop
+# - token bucket ต่อผู้ใช้ และ token bucket รวมทั้งระบบ (จำกัดจำนวน request ที่เข้า cart/checkout)
+# - เมื่อ bucket รวมหมด ผู้ใช้จะได้บัตรคิว (FIFO) และไปรอที่หน้า waiting room ซึ่ง poll สถานะเป็นระยะ
+# - เมื่อคิวเต็มจะตอบ 503 ทันที / ผู้ใช้ที่ยิงถี่เกินจะได้ 429 ทันที (ไม่แตะ DB)
+# state ทั้งหมดอยู่ใน cache (ค่าเริ่มต้นคือ local-memory cache) จึงทดสอบได้แบบ offline
+# ----------------------------------------------------------------------
+
+DEFAULTS = {
+    'ENABLED': True,
+    'CACHE_ALIAS': 'default',
+    # ชื่อ URL ที่อยู่หลัง admission control
+    'URL_NAMES': ('shop:add_to_cart', 'shop:update_cart_quantity', 'shop:checkout', 'shop:payment_process'),
+    # ต่อผู้ใช้: เติม USER_RATE token/วินาที เก็บได้สูงสุด USER_BURST
+    'USER_RATE': 1.0,
+    'USER_BURST': 5,
+    # รวมทั้งระบบ: จำนวนผู้ใช้ที่ปล่อยเข้า cart/checkout ต่อวินาที
+    'GLOBAL_RATE': 10.0,
+    'GLOBAL_BURST': 20,
+    # ความยาวคิวสูงสุด เกินนี้ตอบ 503
+    'QUEUE_MAX': 5000,
+    # ผู้ใช้ที่ได้รับอนุญาตแล้วใช้ได้ ADMIT_REQUESTS request ภายใน ADMIT_TTL วินาที โดยไม่ต้องต่อคิวใหม่
+    # (โหลดสูงสุดบน cart/checkout ≈ GLOBAL_RATE × ADMIT_REQUESTS)
+    # บัตรคิวอยู่ได้นานเท่าเวลารอของคิวข้างหน้า (คนข้างหน้า / GLOBAL_RATE) + ADMIT_TTL
+    'ADMIT_REQUESTS': 5,
+    'ADMIT_TTL': 120,
+    # จำนวน reverse proxy ที่เชื่อถือได้หน้า Django (เช่น nginx = 1) ใช้อ่าน IP จริงจาก X-Forwarded-For
+    # 0 = ใช้ REMOTE_ADDR อย่างเดียว (X-Forwarded-For ปลอมได้ ห้ามเชื่อถ้าไม่มี proxy เติมให้)
+    'TRUSTED_PROXY_DEPTH': 0,
+    # ระยะเวลาที่ waiting room จะ poll สถานะ (วินาที)
+    'POLL_INTERVAL': 3,
+}
+
+# RLock: _advance ถือ lock ระหว่างเรียก TokenBucket.take (ซึ่งถือ lock เดียวกัน)
+_bucket_lock = threading.RLock()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'ADMISSION_CONTROL', {})}
+
+
+class TokenBucket:
+    """Token bucket เก็บ state (tokens, เวลาอัปเดตล่าสุด) ไว้ใน cache"""
+
+    def __init__(self, cache, key, rate, burst):
+        self.cache = cache
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+
+    def take(self, tokens=1):
+        """คืนค่า (สำเร็จหรือไม่, วินาทีที่ต้องรอถ้าไม่สำเร็จ)"""
+        with _bucket_lock:
+            now = time.time()
+            level, updated = self.cache.get(self.key) or (self.burst, now)
+            level = min(self.burst, level + (now - updated) * self.rate)
+            allowed = level >= tokens
+            if allowed:
+                level -= tokens
+            # เก็บไว้นานพอให้ bucket เต็มอีกครั้ง หลังจากนั้นเริ่มใหม่แบบเต็มได้
+            self.cache.set(self.key, (level, now), timeout=math.ceil(self.burst / self.rate) + 1)
+        wait = 0 if allowed else (tokens - level) / self.rate
+        return allowed, wait
+
+
+class AdmissionController:
+    """ตัดสินว่า request จะได้เข้า (admit) ต้องต่อคิว (queue) หรือถูกตัดทิ้ง (throttle/shed)"""
+
+    ADMIT, QUEUE, THROTTLE, SHED = 'admit', 'queue', 'throttle', 'shed'
+
+    def __init__(self, config=None, cache=None):
+        self.config = config or get_config()
+        self.cache = cache or caches[self.config['CACHE_ALIAS']]
+        self.global_bucket = TokenBucket(self.cache, 'admission:global', self.config['GLOBAL_RATE'], self.config['GLOBAL_BURST'])
+
+    # ---------- คิว FIFO ----------
+    def _counter(self, name):
+        key = f'admission:{name}'
+        self.cache.add(key, 0, timeout=None)
+        return key
+
+    def _advance(self):
+        """เลื่อนหัวคิว 1 ตำแหน่ง ถ้ามีคนรอและ bucket รวมยังมี token"""
+        # ⚠️ อ่าน-เทียบ-เพิ่มภายใต้ lock เดียวกับ TokenBucket.take ไม่งั้น poll พร้อมกันจะเลื่อน serving เกิน tail
+        with _bucket_lock:
+            tail = self.cache.get(self._counter('tail'), 0)
+            serving = self.cache.get(self._counter('serving'), 0)
+            if serving < tail and self.global_bucket.take()[0]:
+                return self.cache.incr(self._counter('serving'))
+            return serving
+
+    def queue_length(self):
+        return max(self.cache.get(self._counter('tail'), 0) - self.cache.get(self._counter('serving'), 0), 0)
+
+    def has_pass(self, client):
+        return (self.cache.get(f'admission:pass:{client}') or 0) > 0
+
+    def use_pass(self, client):
+        """ใช้สิทธิ์ 1 request จาก pass ที่ได้รับ คืนค่า False ถ้าไม่มี pass หรือใช้ครบแล้ว"""
+        key = f'admission:pass:{client}'
+        try:
+            remaining = self.cache.decr(key)
+        except ValueError:
+            return False
+        if remaining <= 0:
+            # ใช้ครั้งสุดท้ายแล้ว (หรือ request พร้อมกันลดจนติดลบ) → ลบทิ้ง ครั้งต่อไปต้องต่อคิวใหม่
+            self.cache.delete(key)
+        return remaining >= 0
+
+    def grant_pass(self, client):
+        self.cache.set(f'admission:pass:{client}', self.config['ADMIT_REQUESTS'], timeout=self.config['ADMIT_TTL'])
+        self.cache.delete(f'admission:ticket:{client}')
+
+    def ticket_ttl(self, ahead):
+        """อายุของบัตรคิว: เวลารอคนข้างหน้า ahead คนที่ GLOBAL_RATE คน/วินาที เผื่ออีก ADMIT_TTL"""
+        return math.ceil(ahead / self.config['GLOBAL_RATE']) + self.config['ADMIT_TTL']
+
+    # ---------- การตัดสิน ----------
+    def check(self, client):
+        """คืนค่า (decision, retry_after วินาที, ตำแหน่งในคิว)"""
+        user_bucket = TokenBucket(
+            self.cache, f'admission:user:{client}', self.config['USER_RATE'], self.config['USER_BURST'],
+        )
+        allowed, wait = user_bucket.take()
+        if not allowed:
+            return self.THROTTLE, wait, None
+
+        if self.use_pass(client):
+            return self.ADMIT, 0, None
+
+        decision, retry_after, position = self._enter(client)
+        if decision == self.ADMIT:
+            self.use_pass(client)
+        return decision, retry_after, position
+
+    def _enter(self, client):
+        """ผู้ที่ไม่มี pass: เข้าได้เลยถ้าไม่มีคิว / ต่อคิว (หรือใช้บัตรคิวเดิม) / 503 ถ้าคิวเต็ม (ไม่ใช้สิทธิ์ของ pass)"""
+        ticket = self.cache.get(f'admission:ticket:{client}')
+        if ticket is None:
+            # ไม่มีใครรอคิวอยู่และยังมี token → เข้าได้เลย
+            ahead = self.queue_length()
+            if ahead == 0 and self.global_bucket.take()[0]:
+                self.grant_pass(client)
+                return self.ADMIT, 0, None
+            if ahead >= self.config['QUEUE_MAX']:
+                return self.SHED, self.config['POLL_INTERVAL'] * 10, None
+            ticket = self.cache.incr(self._counter('tail'))
+            self.cache.set(f'admission:ticket:{client}', ticket, timeout=self.ticket_ttl(ahead + 1))
+        return self.poll(client, ticket)
+
+    def poll(self, client, ticket=None):
+        """ใช้จากหน้า waiting room: คืนค่า (decision, retry_after, ตำแหน่งในคิว) โดยไม่ใช้สิทธิ์ของ pass"""
+        if self.has_pass(client):
+            return self.ADMIT, 0, 0
+        ticket = ticket or self.cache.get(f'admission:ticket:{client}')
+        if ticket is None:
+            # ไม่มีบัตรคิว (ยังไม่เคยต่อคิว / บัตรหมดอายุ) → ตัดสินใหม่แบบเดียวกับ check ไม่ปล่อยเข้าฟรี
+            return self._enter(client)
+
+        serving = self._advance()
+        if ticket <= serving:
+            self.grant_pass(client)
+            return self.ADMIT, 0, 0
+        return self.QUEUE, self.config['POLL_INTERVAL'], ticket - serving
+
+
+def client_id(request, config=None):
+    if request.user.is_authenticated:
+        return f'u{request.user.pk}'
+    depth = (config or get_config())['TRUSTED_PROXY_DEPTH']
+    address = request.META.get('REMOTE_ADDR', '')
+    if depth:
+        # proxy แต่ละชั้นต่อ IP ที่ตัวเองเห็นไว้ท้ายรายการ → ตัวที่ depth นับจากท้ายคือ IP ที่ proxy นอกสุดเห็น
+        # ค่าที่อยู่ก่อนหน้านั้น client ใส่มาเองได้ จึงไม่ใช้
+        forwarded = [part.strip() for part in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if part.strip()]
+        if len(forwarded) >= depth:
+            address = forwarded[-depth]
+    return 'ip' + address
+
+
+def _is_ajax(request):
+    return request.headers.get('x-requested-with') == 'XMLHttpRequest' or 'application/json' in request.headers.get('accept', '')
+
+
+class AdmissionControlMiddleware:
+    """กั้น URL ของ cart/checkout ด้วย AdmissionController (ทำงานหลัง AuthenticationMiddleware)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.config = get_config()
+        self.url_names = set(self.config['URL_NAMES'])
+        self.controller = AdmissionController(self.config) if self.config['ENABLED'] else None
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if self.controller is None or request.resolver_match.view_name not in self.url_names:
+            return None
+
+        client = client_id(request, self.config)
+        decision, retry_after, position = self.controller.check(client)
+        if decision == AdmissionController.ADMIT:
+            return None
+
+        retry_after = max(1, math.ceil(retry_after))
+        logger.info('admission rejected', extra={
+            'event': f'admission.{decision}', 'client': client, 'view': request.resolver_match.view_name,
+            'position': position,
+        })
+        if decision == AdmissionController.THROTTLE:
+            response = HttpResponse('Too many requests', status=429, content_type='text/plain; charset=utf-8')
+        elif decision == AdmissionController.SHED:
+            response = HttpResponse('Service busy, please retry later', status=503, content_type='text/plain; charset=utf-8')
+        elif _is_ajax(request) or request.method not in ('GET', 'POST'):
+            response = JsonResponse({'queued': True, 'position': position, 'waiting_room': reverse('shop:waiting_room')}, status=503)
+        else:
+            # เข้าคิว: ส่งไปหน้า waiting room แล้วกลับมาหน้าเดิมเมื่อถึงคิว
+            next_url = request.get_full_path() if request.method == 'GET' else request.META.get('HTTP_REFERER', '')
+            response = redirect(f"{reverse('shop:waiting_room')}?{urlencode({'next': next_url})}")
+        response['Retry-After'] = str(retry_after)
+        return response
@@ -9,6 +9,6 @@ class ShopConfig(AppConfig):
     def ready(self):
         # นำเข้า Signals เมื่อ App พร้อมใช้งาน
         try:
-            from . import signals  # noqa
+            from . import signals, cart, restock  # noqa
         except ImportError:
             pass
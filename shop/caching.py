@@ -0,0 +1,192 @@
+# shop/caching.py
+
+import logging
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from collections import Counter, namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 💡 Cache กัน stampede (ใช้แทน cache.get/set ตรงๆ สำหรับของที่สร้างใหม่แพง เช่น fragment ของหน้า catalog)
+# - single-flight: ต่อ key มีผู้ rebuild ได้คนเดียว (ถือ lock ของ key) คนอื่นได้ค่าเก่าไป
+#   หรือถ้ายังไม่เคยมีค่าเลยจะรอจนผู้ rebuild เขียนค่าใหม่ลง cache (ไม่ query/render ซ้ำพร้อมกัน)
+# - stale-while-revalidate: เก็บค่าใน cache นานกว่า timeout อีก STALE_TTL วินาที
+#   ช่วงนั้นค่าถือว่าหมดอายุแล้วแต่ยังตอบได้ระหว่างที่มีคน rebuild (และใช้แทนถ้า rebuild error)
+# - probabilistic early expiry (XFetch): ก่อนหมดอายุจริง request จะสุ่ม rebuild ล่วงหน้า
+#   โอกาสสูงขึ้นเมื่อใกล้หมดอายุและเมื่อการ build ครั้งก่อนใช้เวลานาน (delta × BETA)
+#   ทำให้ key ที่ hot แทบไม่เคยหมดอายุพร้อมกันทุก worker
+# lock ใช้ cache.add (atomic ใน locmem / redis / memcached) ยกเว้น filebased ที่ add() ไม่ atomic
+# (has_key แล้วค่อย set) จึงใช้ไฟล์ .lock ที่สร้างด้วย O_CREAT | O_EXCL ข้างไฟล์ cache แทน
+# ----------------------------------------------------------------------
+
+DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    'STALE_TTL': 60,
+    'BETA': 1.0,
+    'LOCK_TIMEOUT': 30,
+    'WAIT_TIMEOUT': 5.0,
+    'POLL_INTERVAL': 0.02,
+}
+
+# ค่าที่เก็บใน cache: expires_at = เวลาหมดอายุ (soft) / delta = เวลาที่ใช้ build ครั้งล่าสุด (วินาที)
+Entry = namedtuple('Entry', 'value expires_at delta')
+
+# 💡 ตัวนับของ worker นี้: hit, miss, refresh (หมดอายุแล้ว rebuild), early (XFetch),
+# stale (ตอบค่าเก่าระหว่างคนอื่น rebuild), coalesced (รอค่าจากคนอื่นแทนการ build เอง),
+# wait_timeout, error_stale (build error แล้วตอบค่าเก่าแทน)
+_metrics = Counter()
+_metrics_lock = threading.Lock()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'STAMPEDE_CACHE', {})}
+
+
+def _count(event):
+    with _metrics_lock:
+        _metrics[event] += 1
+
+
+def metrics():
+    with _metrics_lock:
+        return dict(_metrics)
+
+
+def reset_metrics():
+    with _metrics_lock:
+        _metrics.clear()
+
+
+class _CacheLock:
+    """lock ต่อ key ด้วย cache.add (หมดอายุเองหลัง timeout กันผู้ถือ lock ตายค้าง)"""
+
+    def __init__(self, cache, key, timeout):
+        self.cache = cache
+        self.key = f'{key}:lock'
+        self.timeout = timeout
+        self.token = uuid.uuid4().hex
+
+    def acquire(self):
+        return self.cache.add(self.key, self.token, timeout=self.timeout)
+
+    def release(self):
+        if self.cache.get(self.key) == self.token:
+            self.cache.delete(self.key)
+
+    def is_held(self):
+        return self.cache.get(self.key) is not None
+
+
+class _FileLock:
+    """lock ต่อ key สำหรับ FileBasedCache: สร้างไฟล์แบบ O_EXCL (atomic ทั้งข้าม thread และข้าม process)"""
+
+    def __init__(self, cache, key, timeout):
+        self.path = cache._key_to_file(key) + '.lock'
+        self.timeout = timeout
+
+    def acquire(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        try:
+            os.close(os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            pass
+        try:
+            if time.time() - os.path.getmtime(self.path) > self.timeout:
+                # lock ค้างจาก process ที่ตายไป → ลบทิ้งแล้วลองใหม่ครั้งเดียว
+                os.remove(self.path)
+                os.close(os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+        except (FileNotFoundError, FileExistsError):
+            pass
+        return False
+
+    def release(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def is_held(self):
+        return os.path.exists(self.path)
+
+
+class SingleFlightCache:
+    def __init__(self, config=None, cache=None):
+        self.config = {**get_config(), **(config or {})}
+        self.cache = cache or caches[self.config['CACHE_ALIAS']]
+
+    def _refresh_early(self, entry, now):
+        # XFetch: -log(U) มีค่า 0..∞ ยิ่งใกล้ expires_at ยิ่งมีโอกาสเกิน
+        return now - entry.delta * self.config['BETA'] * math.log(1.0 - random.random()) >= entry.expires_at
+
+    def _build(self, key, builder, timeout):
+        started = time.perf_counter()
+        value = builder()
+        delta = time.perf_counter() - started
+        self.cache.set(key, Entry(value, time.time() + timeout, delta), timeout=timeout + self.config['STALE_TTL'])
+        return value
+
+    def get_or_build(self, key, builder, timeout):
+        """คืนค่าของ key จาก cache หรือเรียก builder() (ไม่เกินหนึ่งคนต่อ key ในเวลาเดียวกัน)"""
+        now = time.time()
+        entry = self.cache.get(key)
+        if entry is not None and not self._refresh_early(entry, now):
+            _count('hit')
+            return entry.value
+
+        lock_class = _FileLock if isinstance(self.cache, FileBasedCache) else _CacheLock
+        lock = lock_class(self.cache, key, self.config['LOCK_TIMEOUT'])
+        if lock.acquire():
+            if entry is None:
+                _count('miss')
+            else:
+                _count('early' if now < entry.expires_at else 'refresh')
+            try:
+                return self._build(key, builder, timeout)
+            except Exception:
+                if entry is None:
+                    raise
+                _count('error_stale')
+                logger.exception('cache rebuild failed, serving stale value', extra={'event': 'cache.rebuild_failed', 'key': key})
+                return entry.value
+            finally:
+                lock.release()
+
+        if entry is not None:
+            # มีคนกำลัง rebuild อยู่ → ตอบค่าเดิมไปก่อน
+            _count('hit' if now < entry.expires_at else 'stale')
+            return entry.value
+
+        # ยังไม่มีค่าเลย → รอค่าจากผู้ที่ถือ lock
+        deadline = time.monotonic() + self.config['WAIT_TIMEOUT']
+        while time.monotonic() < deadline:
+            time.sleep(self.config['POLL_INTERVAL'])
+            entry = self.cache.get(key)
+            if entry is not None:
+                _count('coalesced')
+                return entry.value
+            if not lock.is_held():
+                # lock ถูกปล่อยระหว่าง get ด้านบนกับตรงนี้ → อ่านซ้ำอีกครั้งก่อน
+                # ถ้ายังไม่มีค่า = ผู้ถือ lock build ไม่สำเร็จ (error) → build เองแทนการรอจนหมดเวลา
+                entry = self.cache.get(key)
+                if entry is not None:
+                    _count('coalesced')
+                    return entry.value
+                break
+        _count('wait_timeout')
+        logger.warning('cache rebuild wait timed out', extra={'event': 'cache.wait_timeout', 'key': key})
+        return self._build(key, builder, timeout)
+
+
+def get_or_build(key, builder, timeout, cache=None):
+    return SingleFlightCache(cache=cache).get_or_build(key, builder, timeout)
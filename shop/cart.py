@@ -0,0 +1,186 @@
+# shop/cart.py
+
+import functools
+import logging
+from decimal import Decimal
+
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.dispatch import receiver
+
+from .catalog import get_snapshot
+from .models import Cart, CartItem, Product
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 💡 ตะกร้าสินค้า
+# - ผู้ใช้ที่ล็อกอิน: Cart ใน DB ถูกสร้างตอนเพิ่มสินค้าครั้งแรกเท่านั้น (ไม่สร้างตอนสมัครสมาชิก)
+# - ผู้ใช้ทั่วไป (guest): เก็บใน signed cookie ไม่มีการเขียน DB เลย
+# - ตอนล็อกอิน ตะกร้า guest จะถูกรวมเข้ากับ Cart ของผู้ใช้ด้วย bulk upsert ครั้งเดียว
+# - ชื่อ/ราคา/สต็อกของสินค้าในตะกร้าทั้งสองแบบอ่านจาก catalog snapshot (CartLine)
+#   ยกเว้น checkout ที่ใช้ราคาจาก DB ตอนสร้าง Order
+# ----------------------------------------------------------------------
+
+GUEST_CART_COOKIE = 'guest_cart'
+GUEST_CART_SALT = 'shop.cart'
+GUEST_CART_MAX_AGE = 60 * 60 * 24 * 30  # 30 วัน
+GUEST_CART_MAX_ITEMS = 50  # จำกัดเพื่อให้ cookie ไม่เกิน 4KB
+
+
+class CartLine:
+    """รายการสินค้าในตะกร้าที่ product เป็น CatalogItem จาก snapshot (หน้าตาเหมือน CartItem เพื่อใช้ template เดียวกัน)"""
+
+    def __init__(self, product, quantity, item_id=None):
+        self.product = product
+        self.quantity = quantity
+        self.item_id = item_id
+
+    @property
+    def id(self):
+        # ตะกร้า guest ไม่มี CartItem.id จึงใช้ product id แทน (ดู views.remove_from_cart)
+        return self.product.id if self.item_id is None else self.item_id
+
+    def subtotal(self):
+        return self.quantity * self.product.price
+
+
+class GuestCart:
+    """ตะกร้าของผู้ใช้ที่ยังไม่ล็อกอิน เก็บเป็น {product_id: quantity} ใน signed cookie"""
+
+    def __init__(self, request):
+        self.data = {}
+        self.dirty = False
+        raw = request.get_signed_cookie(GUEST_CART_COOKIE, default='', salt=GUEST_CART_SALT, max_age=GUEST_CART_MAX_AGE)
+        for pair in raw.split(',') if raw else ():
+            product_id, _, quantity = pair.partition(':')
+            if product_id.isdigit() and quantity.isdigit() and int(quantity) > 0:
+                self.data[int(product_id)] = int(quantity)
+
+    def __bool__(self):
+        return bool(self.data)
+
+    def get_items(self):
+        # ราคา/ชื่อสินค้าอ่านจาก catalog snapshot (ไม่ query DB)
+        snapshot = get_snapshot()
+        return [CartLine(snapshot.get(pk), quantity) for pk, quantity in self.data.items() if snapshot.get(pk)]
+
+    def get_quantity(self, product_id):
+        return self.data.get(product_id, 0)
+
+    def set_quantity(self, product, quantity):
+        if product.id not in self.data and len(self.data) >= GUEST_CART_MAX_ITEMS:
+            raise ValueError('ตะกร้าสินค้าเต็ม')
+        self.data[product.id] = quantity
+        self.dirty = True
+
+    def remove(self, product_id):
+        """ลบสินค้าออกจากตะกร้า คืน CartLine ที่ถูกลบ (None ถ้าไม่มีในตะกร้า)"""
+        quantity = self.data.pop(product_id, None)
+        if quantity is None:
+            return None
+        self.dirty = True
+        product = get_snapshot().get(product_id)
+        return CartLine(product, quantity) if product else None
+
+    def clear(self):
+        self.data = {}
+        self.dirty = True
+
+    @property
+    def total_items(self):
+        return sum(self.data.values())
+
+    @property
+    def total_price(self):
+        return sum((item.subtotal() for item in self.get_items()), Decimal('0.00'))
+
+    def save(self, response):
+        if not self.dirty:
+            return
+        if self.data:
+            value = ','.join(f'{pk}:{quantity}' for pk, quantity in self.data.items())
+            response.set_signed_cookie(
+                GUEST_CART_COOKIE, value, salt=GUEST_CART_SALT,
+                max_age=GUEST_CART_MAX_AGE, httponly=True, samesite='Lax',
+            )
+        else:
+            response.delete_cookie(GUEST_CART_COOKIE, samesite='Lax')
+        self.dirty = False
+
+
+def snapshot_lines(rows):
+    """[(CartItem id, product id, จำนวน), ...] ของตะกร้าใน DB → CartLine (ข้ามสินค้าที่ไม่อยู่ใน catalog แล้ว)"""
+    snapshot = get_snapshot()
+    return [
+        CartLine(snapshot.get(product_id), quantity, item_id)
+        for item_id, product_id, quantity in rows if snapshot.get(product_id)
+    ]
+
+
+def get_guest_cart(request):
+    if getattr(request, '_guest_cart', None) is None:
+        request._guest_cart = GuestCart(request)
+    return request._guest_cart
+
+
+def get_cart(request, create=False):
+    """
+    คืนตะกร้าของ request ปัจจุบัน
+    - ล็อกอินแล้ว: Cart ใน DB (None ถ้ายังไม่เคยมีและ create=False)
+    - ยังไม่ล็อกอิน: GuestCart
+    """
+    if not request.user.is_authenticated:
+        return get_guest_cart(request)
+    if create:
+        return Cart.objects.get_or_create(user=request.user)[0]
+    return Cart.objects.filter(user=request.user).first()
+
+
+class GuestCartMiddleware:
+    """เขียน cookie ตะกร้า guest กลับไปใน response เมื่อมีการเปลี่ยนแปลง"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        guest_cart = getattr(request, '_guest_cart', None)
+        if guest_cart is not None:
+            guest_cart.save(response)
+        return response
+
+
+def cart_context(request):
+    """context processor: จำนวนชิ้นในตะกร้าสำหรับ badge บน navbar (query เฉพาะตอนที่ template ใช้)"""
+    # 💡 template เรียก cart_total_items หลายครั้ง (เช็ค > 0 แล้วแสดงผล) จึงจำผลไว้ → query ครั้งเดียวต่อ request
+    @functools.cache
+    def total_items():
+        cart = get_cart(request)
+        return cart.total_items if cart is not None else 0
+    return {'cart_total_items': total_items}
+
+
+# ================== Merge at login ==================
+@receiver(user_logged_in)
+def merge_guest_cart(sender, request, user, **kwargs):
+    """รวมตะกร้า guest เข้ากับ Cart ของผู้ใช้ด้วย bulk upsert ครั้งเดียว แล้วล้าง cookie"""
+    if request is None:
+        return
+    guest_cart = get_guest_cart(request)
+    if not guest_cart:
+        return
+
+    products = Product.objects.filter(pk__in=guest_cart.data, is_active=True).only('id', 'stock', 'shard_count').in_bulk()
+    with transaction.atomic():
+        cart = Cart.objects.get_or_create(user=user)[0]
+        existing = dict(CartItem.objects.filter(cart=cart, product_id__in=products).values_list('product_id', 'quantity'))
+        merged = [
+            CartItem(cart=cart, product_id=pk, quantity=min(existing.get(pk, 0) + quantity, max(products[pk].available_stock, 1)))
+            for pk, quantity in guest_cart.data.items() if pk in products
+        ]
+        CartItem.objects.bulk_create(
+            merged, update_conflicts=True, unique_fields=['cart', 'product'], update_fields=['quantity'],
+        )
+    guest_cart.clear()
+    logger.info('guest cart merged', extra={'event': 'cart.guest_merged', 'user_id': user.pk, 'items': len(merged)})
@@ -0,0 +1,190 @@
+# shop/catalog.py
+
+import logging
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from .inventory import available_stock_expression
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 💡 Catalog read model (ต่อ worker)
+# เก็บสินค้าที่ active ทั้งหมดไว้ในหน่วยความจำเป็น tuple เรียงตาม created_at ล่าสุดก่อน + dict ตาม id
+# ทุก worker ตรวจ version กลางใน shared cache (อย่างมากทุก CATALOG_VERSION_CHECK_INTERVAL วินาที)
+# เมื่อ Product ถูกบันทึก/ลบ version จะเปลี่ยน แล้วทุก worker จะโหลดใหม่เองตอนอ่านครั้งถัดไป
+#
+# 💡 stock ใน snapshot คือสต็อกที่ขายได้ (ผลรวม shard สำหรับสินค้าที่แบ่ง shard)
+#    การตัด/คืนสต็อกใน shop/inventory.py (checkout, ยกเลิกออเดอร์, จอง shard) ไม่ bump version ของ catalog
+#    แต่เปลี่ยน stock version แยก → worker อ่านแค่ (id, สต็อก) มาแทนค่าเดิม ไม่ต้องสร้าง snapshot ใหม่ทั้งก้อน
+#    (ช่วง drop ที่ขายทุกวินาที อ่านไม่เกิน 1 ครั้ง / worker / CATALOG_VERSION_CHECK_INTERVAL)
+# ⚠️ ยังช้ากว่า DB ได้ไม่เกินช่วงตรวจ version ส่วนที่ต้องใช้สต็อกจริง (add_to_cart, checkout) อ่านจาก DB เสมอ
+# ----------------------------------------------------------------------
+
+VERSION_KEY = 'catalog:version'
+STOCK_VERSION_KEY = 'catalog:stock_version'
+
+_FIELDS = ('id', 'name', 'description', 'price', 'stock', 'image', 'created_at')
+
+
+class ImageRef(str):
+    """ชื่อไฟล์รูปที่มี .url เหมือน ImageFieldFile (ใช้ใน template ได้เหมือนเดิม)"""
+    __slots__ = ()
+
+    @property
+    def url(self):
+        return default_storage.url(self)
+
+
+class CatalogItem(namedtuple('CatalogItem', _FIELDS)):
+    """สินค้า 1 รายการใน snapshot (อ่านอย่างเดียว หน้าตาเหมือน Product สำหรับ template)"""
+    __slots__ = ()
+
+    @property
+    def pk(self):
+        return self.id
+
+    @property
+    def available_stock(self):
+        # ค่า ณ stock version ล่าสุดที่ worker เห็น ห้ามใช้ตัดสินว่าขายได้หรือไม่ (ดูหมายเหตุด้านบน)
+        return self.stock
+
+    def is_in_stock(self):
+        return self.stock > 0
+
+
+class CatalogSnapshot:
+    __slots__ = ('version', 'stock_version', 'items', 'by_id', 'built_at')
+
+    def __init__(self, version, items, stock_version=None):
+        self.version = version
+        self.stock_version = stock_version
+        self.items = items
+        self.by_id = {item.id: item for item in items}
+        self.built_at = time.time()
+
+    def get(self, product_id):
+        return self.by_id.get(product_id)
+
+
+def _shared_cache():
+    return caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')]
+
+
+def _current(key, value=None):
+    version = _shared_cache().get(key) if value is None else value
+    if version is None:
+        version = uuid.uuid4().hex
+        if not _shared_cache().add(key, version, timeout=None):
+            version = _shared_cache().get(key)
+    return version
+
+
+def current_version():
+    return _current(VERSION_KEY)
+
+
+def current_stock_version():
+    return _current(STOCK_VERSION_KEY)
+
+
+def current_versions():
+    """(catalog version, stock version) อ่านจาก shared cache ในรอบเดียว"""
+    versions = _shared_cache().get_many([VERSION_KEY, STOCK_VERSION_KEY])
+    return _current(VERSION_KEY, versions.get(VERSION_KEY)), _current(STOCK_VERSION_KEY, versions.get(STOCK_VERSION_KEY))
+
+
+def bump_version():
+    """เปลี่ยน version กลาง (เรียกหลัง commit) ให้ทุก worker โหลด snapshot ใหม่"""
+    version = uuid.uuid4().hex
+    _shared_cache().set(VERSION_KEY, version, timeout=None)
+    _state['checked_at'] = 0.0
+    logger.info('catalog version bumped', extra={'event': 'catalog.version_bumped', 'version': version})
+
+
+def bump_version_on_commit():
+    transaction.on_commit(bump_version)
+
+
+def bump_stock_version():
+    """สต็อกเปลี่ยน (เรียกหลัง commit) ให้ทุก worker อ่านสต็อกใน snapshot ใหม่"""
+    _shared_cache().set(STOCK_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+    _state['checked_at'] = 0.0
+
+
+def bump_stock_version_on_commit():
+    transaction.on_commit(bump_stock_version)
+
+
+_lock = threading.Lock()
+_state = {'snapshot': None, 'checked_at': 0.0}
+
+
+def _build(version, stock_version=None):
+    started = time.perf_counter()
+    rows = (
+        Product.objects.filter(is_active=True)
+        .annotate(available=available_stock_expression())
+        .order_by('-created_at', '-id')
+        .values_list(*_FIELDS[:4], 'available', *_FIELDS[5:])
+    )
+    items = tuple(
+        CatalogItem(pk, name, description, price, stock, ImageRef(image) if image else None, created_at)
+        for pk, name, description, price, stock, image, created_at in rows
+    )
+    logger.info('catalog snapshot built', extra={
+        'event': 'catalog.snapshot_built', 'version': version, 'items': len(items),
+        'duration_ms': round((time.perf_counter() - started) * 1000, 2),
+    })
+    return CatalogSnapshot(version, items, stock_version)
+
+
+def _refresh_stock(snapshot, stock_version):
+    """snapshot เดิมที่อัปเดตแค่สต็อก (query เดียว อ่านแค่ id กับสต็อกที่ขายได้)"""
+    started = time.perf_counter()
+    stock = dict(
+        Product.objects.filter(is_active=True)
+        .annotate(available=available_stock_expression())
+        .values_list('id', 'available')
+    )
+    items = tuple(
+        item._replace(stock=stock[item.id]) if stock.get(item.id, item.stock) != item.stock else item
+        for item in snapshot.items
+    )
+    logger.info('catalog stock refreshed', extra={
+        'event': 'catalog.stock_refreshed', 'version': snapshot.version, 'items': len(items),
+        'changed': sum(old is not new for old, new in zip(snapshot.items, items)),
+        'duration_ms': round((time.perf_counter() - started) * 1000, 2),
+    })
+    return CatalogSnapshot(snapshot.version, items, stock_version)
+
+
+def get_snapshot():
+    """คืน CatalogSnapshot ปัจจุบันของ worker นี้ (โหลดใหม่เมื่อ version กลางเปลี่ยน / อ่านสต็อกใหม่เมื่อ stock version เปลี่ยน)"""
+    snapshot = _state['snapshot']
+    now = time.monotonic()
+    if snapshot is not None and now - _state['checked_at'] < getattr(settings, 'CATALOG_VERSION_CHECK_INTERVAL', 1.0):
+        return snapshot
+
+    # อ่าน version ก่อน query เสมอ: ถ้ามีการเปลี่ยนระหว่าง build จะเห็น version ใหม่ในรอบตรวจถัดไป
+    version, stock_version = current_versions()
+    _state['checked_at'] = now
+    if snapshot is not None and snapshot.version == version and snapshot.stock_version == stock_version:
+        return snapshot
+
+    with _lock:
+        snapshot = _state['snapshot']
+        if snapshot is None or snapshot.version != version:
+            snapshot = _build(version, stock_version)
+        elif snapshot.stock_version != stock_version:
+            snapshot = _refresh_stock(snapshot, stock_version)
+        _state['snapshot'] = snapshot
+    return snapshot
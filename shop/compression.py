@@ -0,0 +1,171 @@
+# shop/compression.py
+
+import gzip
+import re
+import zlib
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # 💡 brotli เป็น optional ไม่ได้ติดตั้งก็ใช้ gzip อย่างเดียว
+    brotli = None
+
+# ----------------------------------------------------------------------
+# 💡 บีบอัด response ตาม Accept-Encoding ของ browser (แทน django GZipMiddleware)
+# - เลือก br (brotli) ก่อน gzip เมื่อ browser รับได้ทั้งคู่ (เคารพค่า q; q=0 = ห้ามใช้)
+#   HTML ภาษาไทย (UTF-8 3 ไบต์ต่อตัวอักษร) + CSS inline เล็กลงราว 80-90%
+# - บีบเฉพาะ content type ที่เป็นข้อความ และ body ตั้งแต่ MIN_SIZE ไบต์ (ตัวเล็กบีบแล้วไม่คุ้ม CPU)
+#   ถ้าบีบแล้วไม่เล็กลงจะส่งแบบเดิม
+# - StreamingHttpResponse บีบทีละ chunk แล้ว flush ทุก chunk (browser ได้ข้อมูลทันที ไม่ต้องรอจนจบ)
+# - ข้าม response ที่บีบมาแล้ว / Cache-Control: no-transform / 206 Range
+# - ข้าม FileResponse (มี file_to_stream) และ response ที่มี Accept-Ranges: ไฟล์ (เช่น SVG ใน media/static)
+#   ควรส่งตามเดิมให้ sendfile / Range / Content-Length ทำงานได้ ส่วน SVG ที่ view สร้างเองยังบีบตามปกติ
+# ⚠️ BREACH: csrf token ในหน้าถูก mask ใหม่ทุก response อยู่แล้ว ห้ามใส่ secret คงที่อื่นลงใน HTML ที่บีบ
+# ระดับการบีบตั้งไว้สำหรับ response แบบ dynamic (brotli quality 11 ช้าเกินไปสำหรับทุก request)
+# ----------------------------------------------------------------------
+
+DEFAULTS = {
+    'ENABLED': True,
+    'MIN_SIZE': 512,
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 5,
+    'CONTENT_TYPES': (
+        'text/', 'application/json', 'application/javascript', 'application/xml',
+        'application/x-ndjson', 'image/svg+xml',
+    ),
+}
+
+_CODING_RE = re.compile(r'^\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*$')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'RESPONSE_COMPRESSION', {})}
+
+
+def available_encodings():
+    """encoding ที่ server นี้บีบได้ เรียงตามที่อยากใช้ก่อน"""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def choose_encoding(accept_encoding, supported=None):
+    """เลือก encoding จาก header Accept-Encoding (q สูงสุดก่อน เท่ากันใช้ลำดับของ server) หรือ None"""
+    supported = supported or available_encodings()
+    weights = {}
+    for part in accept_encoding.lower().split(','):
+        match = _CODING_RE.match(part)
+        if not match:
+            continue
+        try:
+            weights[match.group(1)] = float(match.group(2)) if match.group(2) else 1.0
+        except ValueError:
+            continue
+    best, best_q = None, 0.0
+    for encoding in supported:
+        q = weights.get(encoding, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(encoding, data, config=None):
+    config = config or get_config()
+    if encoding == 'br':
+        return brotli.compress(data, quality=config['BROTLI_QUALITY'])
+    # mtime=0 ให้ body เดิมได้ผลเหมือนเดิมทุกครั้ง (ETag / cache ของ proxy ไม่แกว่ง)
+    return gzip.compress(data, compresslevel=config['GZIP_LEVEL'], mtime=0)
+
+
+class _StreamCompressor:
+    def __init__(self, encoding, config):
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=config['BROTLI_QUALITY'])
+            self._compress, self._flush, self._finish = self._compressor.process, self._compressor.flush, self._compressor.finish
+        else:
+            # wbits 31 = deflate ห่อด้วย header ของ gzip
+            self._compressor = zlib.compressobj(config['GZIP_LEVEL'], zlib.DEFLATED, 31)
+            self._compress = self._compressor.compress
+            self._flush = lambda: self._compressor.flush(zlib.Z_SYNC_FLUSH)
+            self._finish = self._compressor.flush
+
+    def chunk(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        return self._compress(data) + self._flush()
+
+    def finish(self):
+        return self._finish()
+
+
+def compress_stream(encoding, chunks, config=None):
+    compressor = _StreamCompressor(encoding, config or get_config())
+    for data in chunks:
+        out = compressor.chunk(data)
+        if out:
+            yield out
+    yield compressor.finish()
+
+
+async def compress_async_stream(encoding, chunks, config=None):
+    compressor = _StreamCompressor(encoding, config or get_config())
+    async for data in chunks:
+        out = compressor.chunk(data)
+        if out:
+            yield out
+    yield compressor.finish()
+
+
+class CompressionMiddleware:
+    """ต้องอยู่ก่อน middleware ที่อ่าน/แก้ body ของ response (ทำงานเป็นลำดับท้ายๆ ขาออก)"""
+
+    def __init__(self, get_response):
+        self.config = get_config()
+        if not self.config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.content_types = tuple(self.config['CONTENT_TYPES'])
+
+    def _compressible(self, response):
+        if response.has_header('Content-Encoding') or response.status_code in (204, 206, 304):
+            return False
+        if 'no-transform' in response.get('Cache-Control', ''):
+            return False
+        if getattr(response, 'file_to_stream', None) is not None or response.has_header('Accept-Ranges'):
+            return False
+        content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+        return content_type.startswith(self.content_types)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not self._compressible(response):
+            return response
+        if not response.streaming and len(response.content) < self.config['MIN_SIZE']:
+            return response
+
+        # 💡 cache / CDN ต้องแยกเก็บตาม Accept-Encoding แม้ request นี้จะไม่ได้บีบ
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = compress_async_stream(encoding, response.streaming_content, self.config)
+            else:
+                response.streaming_content = compress_stream(encoding, response.streaming_content, self.config)
+            del response.headers['Content-Length']
+        else:
+            compressed = compress(encoding, response.content, self.config)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        # body เปลี่ยนแล้ว strong ETag ของ body เดิมใช้ไม่ได้ (เหมือน GZipMiddleware)
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,186 @@
+# shop/courier.py
+
+import asyncio
+import logging
+import random
+import re
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .fulfilment import bulk_transition
+from .models import Order
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 💡 ซิงก์สถานะพัสดุจากบริษัทขนส่ง (SHIPPED → DELIVERED อัตโนมัติ)
+# - อ่านออเดอร์ SHIPPED ที่มี tracking number ทั้งหมดจาก DB ก่อน (query เดียว)
+# - ถามสถานะจาก tracking API ของบริษัทขนส่งพร้อมกันด้วย asyncio + aiohttp
+#   ใช้ ClientSession เดียว (connection pool + keep-alive) จำกัดงานพร้อมกันด้วย Semaphore(CONCURRENCY)
+# - 429 / 5xx / timeout / connection error / body ขาดกลางทาง → retry แบบ exponential backoff + jitter
+#   (เคารพ Retry-After แต่ไม่เกิน MAX_RETRY_AFTER วินาที กัน API ตอบค่าใหญ่มากจนงานค้างทั้งรอบ)
+# - body ที่ไม่ใช่ JSON object → พัสดุนั้นได้ 'error' (ไม่ล้มทั้งรอบ)
+# - พัสดุที่ส่งถึงแล้วเปลี่ยนสถานะด้วย fulfilment.bulk_transition ครั้งเดียว (bulk_update + signal ครั้งเดียว)
+# การคุยกับ DB ทั้งหมดอยู่นอก event loop จึงไม่ต้องใช้ async ORM
+#
+# COURIERS: list ของ dict เลือกตาม PATTERN (regex ของ tracking number) ตัวแรกที่ตรง
+#   PATTERN ต้องระบุเสมอ (ว่าง = ตรงกับทุกเลขพัสดุ จึงไม่อนุญาต)
+#   {'NAME': 'kerry', 'PATTERN': r'^KE', 'URL': 'https://.../track/{tracking_number}', 'TOKEN': '...',
+#    'STATUS_FIELD': 'status', 'DELIVERED': ['delivered']}
+# ----------------------------------------------------------------------
+
+DEFAULTS = {
+    'COURIERS': [],
+    'CONCURRENCY': 50,
+    'TIMEOUT': 10.0,
+    'MAX_RETRIES': 3,
+    'BACKOFF': 0.5,
+    'MAX_RETRY_AFTER': 30.0,
+}
+
+COURIER_DEFAULTS = {
+    'TOKEN': '',
+    'STATUS_FIELD': 'status',
+    'DELIVERED': ['delivered'],
+}
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'COURIER_TRACKING', {})}
+
+
+class TrackingError(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _couriers(config):
+    couriers = []
+    for courier in config['COURIERS']:
+        courier = {**COURIER_DEFAULTS, **courier}
+        if not courier.get('PATTERN'):
+            raise ImproperlyConfigured(f"COURIER_TRACKING: courier {courier.get('NAME')!r} ต้องมี PATTERN")
+        courier['_pattern'] = re.compile(courier['PATTERN'])
+        courier['_delivered'] = {status.lower() for status in courier['DELIVERED']}
+        couriers.append(courier)
+    return couriers
+
+
+def courier_for(tracking_number, couriers):
+    for courier in couriers:
+        if courier['_pattern'].search(tracking_number):
+            return courier
+    return None
+
+
+class CourierPoller:
+    def __init__(self, config=None):
+        self.config = {**get_config(), **(config or {})}
+        self.couriers = _couriers(self.config)
+
+    async def _fetch(self, session, courier, tracking_number):
+        url = courier['URL'].format(tracking_number=tracking_number)
+        headers = {'Authorization': f"Bearer {courier['TOKEN']}"} if courier['TOKEN'] else {}
+        async with session.get(url, headers=headers) as response:
+            if response.status in RETRYABLE_STATUSES:
+                retry_after = response.headers.get('Retry-After')
+                raise TrackingError(f'HTTP {response.status}', float(retry_after) if retry_after and retry_after.isdigit() else None)
+            if response.status == 404:
+                return None
+            response.raise_for_status()
+            data = await response.json(content_type=None)
+        if not isinstance(data, dict):
+            raise ValueError(f'unexpected body: {type(data).__name__}')
+        return str(data.get(courier['STATUS_FIELD']) or '').lower()
+
+    async def _track(self, session, semaphore, courier, tracking_number):
+        """สถานะของพัสดุหนึ่งชิ้น (retry ภายใน) คืน 'delivered' / 'in_transit' / 'unknown' / 'error'"""
+        import aiohttp
+
+        for attempt in range(self.config['MAX_RETRIES'] + 1):
+            try:
+                async with semaphore:
+                    status = await self._fetch(session, courier, tracking_number)
+            except (TrackingError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+                if attempt == self.config['MAX_RETRIES']:
+                    logger.warning('courier tracking failed', extra={
+                        'event': 'courier.track_failed', 'courier': courier['NAME'],
+                        'tracking_number': tracking_number, 'error': str(e) or type(e).__name__,
+                    })
+                    return 'error'
+                # รอ backoff นอก semaphore ให้พัสดุอื่นใช้ช่องนี้ไปก่อน
+                retry_after = getattr(e, 'retry_after', None)
+                if retry_after is not None:
+                    delay = min(retry_after, self.config['MAX_RETRY_AFTER'])
+                else:
+                    delay = self.config['BACKOFF'] * 2 ** attempt * random.uniform(0.5, 1.5)
+                await asyncio.sleep(delay)
+                continue
+            except aiohttp.ClientResponseError as e:
+                logger.warning('courier tracking rejected', extra={
+                    'event': 'courier.track_rejected', 'courier': courier['NAME'],
+                    'tracking_number': tracking_number, 'status': e.status,
+                })
+                return 'error'
+            except (ValueError, AttributeError) as e:
+                # body ไม่ใช่ JSON / ไม่ใช่ object → ไม่ retry (ตอบแบบเดิมซ้ำ) แต่ไม่ให้ล้มทั้ง gather
+                logger.warning('courier tracking invalid response', extra={
+                    'event': 'courier.track_invalid', 'courier': courier['NAME'],
+                    'tracking_number': tracking_number, 'error': str(e),
+                })
+                return 'error'
+            if status is None:
+                return 'unknown'
+            return 'delivered' if status in courier['_delivered'] else 'in_transit'
+
+    async def poll(self, parcels):
+        """parcels: list ของ (order_id, tracking_number) คืน {order_id: ผลลัพธ์}"""
+        import aiohttp
+
+        results = {}
+        jobs = []
+        for order_id, tracking_number in parcels:
+            courier = courier_for(tracking_number, self.couriers)
+            if courier is None:
+                results[order_id] = 'no_courier'
+            else:
+                jobs.append((order_id, courier, tracking_number))
+
+        semaphore = asyncio.Semaphore(self.config['CONCURRENCY'])
+        connector = aiohttp.TCPConnector(limit=self.config['CONCURRENCY'], ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=self.config['TIMEOUT'])
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, raise_for_status=False) as session:
+            statuses = await asyncio.gather(*(
+                self._track(session, semaphore, courier, tracking_number) for _, courier, tracking_number in jobs
+            ))
+        results.update({order_id: status for (order_id, _, _), status in zip(jobs, statuses)})
+        return results
+
+
+def sync(config=None, limit=None):
+    """ถามสถานะพัสดุของทุกออเดอร์ SHIPPED แล้วเปลี่ยนที่ส่งถึงแล้วเป็น DELIVERED คืน dict สรุปผล"""
+    started = time.perf_counter()
+    parcels = (
+        Order.objects.filter(status='SHIPPED', tracking_number__gt='')
+        .order_by('updated_at').values_list('id', 'tracking_number')
+    )
+    parcels = list(parcels[:limit] if limit else parcels)
+
+    results = asyncio.run(CourierPoller(config).poll(parcels)) if parcels else {}
+    delivered = [order_id for order_id, status in results.items() if status == 'delivered']
+    updated = sum(1 for row in bulk_transition(delivered, 'DELIVERED') if row.ok) if delivered else 0
+
+    counts = Counter(results.values())
+    stats = {
+        'parcels': len(parcels), 'delivered': updated, 'in_transit': counts['in_transit'],
+        'unknown': counts['unknown'], 'errors': counts['error'], 'no_courier': counts['no_courier'],
+        'duration_ms': round((time.perf_counter() - started) * 1000, 2),
+    }
+    logger.info('courier tracking synced', extra={'event': 'courier.synced', **stats})
+    return stats
@@ -0,0 +1,33 @@
+# shop/db.py
+
+from contextlib import contextmanager
+
+from django.db import transaction
+
+# ----------------------------------------------------------------------
+# 💡 transaction ที่จอง write lock ของ SQLite ตั้งแต่ BEGIN (BEGIN IMMEDIATE)
+# ใช้เฉพาะ block ที่อ่านก่อนแล้วค่อยเขียน และมี request อื่นเขียนพร้อมกันได้ (เช่น checkout)
+# ถ้าเป็น BEGIN ธรรมดา SQLite จะไม่ยอม upgrade read lock เป็น write lock ขณะที่ connection อื่นกำลังเขียน
+# และตอบ "database is locked" ทันที (ไม่รอตาม timeout) / แบบ IMMEDIATE จะรอ lock ตาม timeout แทน
+# atomic block อื่นทั้งโปรเจกต์ยังเป็น BEGIN ธรรมดา (อ่านพร้อมกันได้)
+# DB อื่นที่ไม่ใช่ SQLite / block ที่ซ้อนอยู่ใน transaction อยู่แล้ว = transaction.atomic ปกติ
+# ----------------------------------------------------------------------
+
+
+@contextmanager
+def immediate_atomic(using=None):
+    connection = transaction.get_connection(using)
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        with transaction.atomic(using=using):
+            yield
+        return
+
+    previous = connection.transaction_mode
+    connection.transaction_mode = 'IMMEDIATE'
+    try:
+        with transaction.atomic(using=using):
+            # BEGIN ถูกส่งไปแล้วตอนเข้า block → คืนค่าเดิมทันทีไม่ให้กระทบ transaction อื่นของ connection นี้
+            connection.transaction_mode = previous
+            yield
+    finally:
+        connection.transaction_mode = previous
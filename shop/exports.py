@@ -0,0 +1,195 @@
+# shop/exports.py
+
+import csv
+import datetime
+import io
+import json
+import logging
+import time
+
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .models import Order, OrderItem
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 💡 ส่งออกยอดขายให้ฝ่ายบัญชี (CSV / JSON Lines) ตามช่วงวันที่สั่งซื้อ
+# 1 แถว = 1 รายการสินค้าในออเดอร์ พร้อมข้อมูลออเดอร์ ลูกค้า และการชำระเงิน
+# (ออเดอร์ที่ไม่มีรายการสินค้าได้ 1 แถวที่คอลัมน์ของสินค้าว่าง)
+# - อ่าน Order ทีละ chunk แบบ keyset (id > id สุดท้ายของ chunk ก่อน) ด้วย .iterator()
+#   และ values_list ที่ JOIN user / payment ไว้ในคำสั่งเดียว (ไม่สร้าง model instance ไม่มี query ต่อแถว)
+#   แล้วดึง OrderItem + ชื่อสินค้าของทั้ง chunk ในอีกหนึ่ง query (ช่วง order_id เดียวกัน) → 2 query ต่อ chunk
+# - yield ข้อความออกไปทีละ chunk → หน่วยความจำคงที่ไม่ว่าจะส่งออกกี่ล้านแถว
+#   (ใช้กับ StreamingHttpResponse และ command export_sales)
+# - ช่วงวันที่ใช้ index (created_at, id) หา id แรก/สุดท้ายครั้งเดียว แล้วไล่ตาม primary key
+# วันที่เป็นเวลาท้องถิ่นของร้าน (TIME_ZONE) ทั้งตัวกรองและค่าที่ส่งออก
+# ----------------------------------------------------------------------
+
+CHUNK_SIZE = 2000
+
+COLUMNS = (
+    'order_id', 'order_created_at', 'customer', 'email', 'order_status', 'order_total',
+    'item_id', 'product_id', 'product_name', 'quantity', 'unit_price', 'line_total',
+    'payment_method', 'transaction_id', 'payment_successful', 'amount_paid', 'paid_at',
+)
+
+_ORDER_FIELDS = (
+    'id', 'created_at', 'user__username', 'user__email', 'status', 'total_amount',
+    'payment__payment_method', 'payment__transaction_id', 'payment__is_successful',
+    'payment__amount_paid', 'payment__paid_at',
+)
+_ITEM_FIELDS = ('order_id', 'id', 'product_id', 'product__name', 'quantity', 'price')
+_EMPTY_ITEM = (None, None, None, None, None)
+TEXT_COLUMNS = ('customer', 'email', 'product_name')
+_FORMULA_PREFIXES = ('=', '+', '-', '@')
+
+
+def parse_date_range(start, end):
+    """'YYYY-MM-DD' สองค่า (รวมวันสุดท้าย) → (start, end) เป็น datetime แบบ aware ช่วง [start, end)"""
+    try:
+        start_date = datetime.date.fromisoformat(start)
+        end_date = datetime.date.fromisoformat(end)
+    except (TypeError, ValueError):
+        raise ValueError('วันที่ต้องอยู่ในรูปแบบ YYYY-MM-DD')
+    if end_date < start_date:
+        raise ValueError('วันที่สิ้นสุดต้องไม่ก่อนวันที่เริ่มต้น')
+    tz = timezone.get_current_timezone()
+    return (
+        datetime.datetime.combine(start_date, datetime.time.min, tzinfo=tz),
+        datetime.datetime.combine(end_date + datetime.timedelta(days=1), datetime.time.min, tzinfo=tz),
+    )
+
+
+def filename(fmt, start, end):
+    return f'sales_{start:%Y%m%d}-{(end - datetime.timedelta(days=1)):%Y%m%d}.{fmt}'
+
+
+def _local(value, tz):
+    return value.astimezone(tz).isoformat() if value else None
+
+
+def _order_parts(order, tz):
+    """คอลัมน์ของออเดอร์ (ก่อนรายการสินค้า) และของการชำระเงิน (หลังรายการสินค้า) แปลงครั้งเดียวต่อออเดอร์"""
+    (order_id, created_at, username, email, status, total_amount,
+     payment_method, transaction_id, is_successful, amount_paid, paid_at) = order
+    head = {
+        'order_id': order_id,
+        'order_created_at': _local(created_at, tz),
+        'customer': username,
+        'email': email,
+        'order_status': status,
+        'order_total': str(total_amount),
+    }
+    tail = {
+        'payment_method': payment_method,
+        'transaction_id': transaction_id,
+        'payment_successful': is_successful,
+        'amount_paid': str(amount_paid) if amount_paid is not None else None,
+        'paid_at': _local(paid_at, tz),
+    }
+    return head, tail
+
+
+def _record(head, item, tail):
+    item_id, product_id, product_name, quantity, price = item
+    return {
+        **head,
+        'item_id': item_id,
+        'product_id': product_id,
+        'product_name': product_name,
+        'quantity': quantity,
+        'unit_price': str(price) if price is not None else None,
+        'line_total': str(price * quantity) if item_id is not None else None,
+        **tail,
+    }
+
+
+# ================== Formats ==================
+class JsonLinesFormat:
+    content_type = 'application/x-ndjson; charset=utf-8'
+    extension = 'jsonl'
+
+    def header(self):
+        return ''
+
+    def render(self, records):
+        return ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+
+
+class CsvFormat:
+    content_type = 'text/csv; charset=utf-8'
+    extension = 'csv'
+
+    def _write(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerows(rows)
+        return buffer.getvalue()
+
+    def header(self):
+        # BOM ให้ Excel เปิดภาษาไทยถูก encoding
+        return '\ufeff' + self._write([COLUMNS])
+
+    def render(self, records):
+        rows = []
+        for record in records:
+            # ⚠️ กันชื่อสินค้า / username ที่ขึ้นต้นด้วยสูตร (=, +, -, @) ถูก Excel รันเป็นสูตร
+            for column in TEXT_COLUMNS:
+                value = record[column]
+                if value and value[0] in _FORMULA_PREFIXES:
+                    record[column] = "'" + value
+            rows.append(record.values())
+        return self._write(rows)
+
+
+FORMATS = {fmt.extension: fmt for fmt in (JsonLinesFormat(), CsvFormat())}
+
+
+# ================== Generator ==================
+def generate(fmt, start, end, chunk_size=CHUNK_SIZE):
+    """yield ข้อมูลส่งออก (str) ทีละ chunk ของออเดอร์ที่สร้างในช่วง [start, end) เรียงตาม id"""
+    export_format = FORMATS[fmt]
+    started = time.perf_counter()
+    tz = timezone.get_current_timezone()
+    stats = {'chunks': 0, 'orders': 0, 'rows': 0}
+
+    yield export_format.header()
+    orders = Order.objects.filter(created_at__gte=start, created_at__lt=end)
+    bounds = orders.aggregate(first=Min('pk'), last=Max('pk'))
+    after = (bounds['first'] or 0) - 1
+    while bounds['first'] is not None:
+        order_rows = list(
+            orders.filter(pk__gt=after, pk__lte=bounds['last'])
+            .order_by('pk').values_list(*_ORDER_FIELDS)[:chunk_size]
+            .iterator(chunk_size=chunk_size)
+        )
+        if not order_rows:
+            break
+        items = {}
+        item_rows = (
+            OrderItem.objects.filter(order_id__gt=after, order_id__lte=order_rows[-1][0])
+            .order_by('order_id', 'pk').values_list(*_ITEM_FIELDS)
+            .iterator(chunk_size=chunk_size)
+        )
+        for order_id, *item in item_rows:
+            items.setdefault(order_id, []).append(item)
+
+        records = []
+        for order in order_rows:
+            head, tail = _order_parts(order, tz)
+            records.extend(_record(head, item, tail) for item in items.get(order[0], [_EMPTY_ITEM]))
+        stats['chunks'] += 1
+        stats['orders'] += len(order_rows)
+        stats['rows'] += len(records)
+        yield export_format.render(records)
+        after = order_rows[-1][0]
+        if len(order_rows) < chunk_size or after >= bounds['last']:
+            break
+
+    logger.info('sales export generated', extra={
+        'event': 'exports.generated', 'format': fmt,
+        'start': start.isoformat(), 'end': end.isoformat(),
+        'duration_ms': round((time.perf_counter() - started) * 1000, 2), **stats,
+    })
@@ -0,0 +1,170 @@
+# shop/facets.py
+
+import hashlib
+import logging
+from collections import namedtuple
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import Count, Q
+from django.utils import timezone
+from django.utils.http import urlencode
+
+from . import caching
+from .inventory import available_stock_expression
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 💡 Faceted browsing (ช่วงราคา / มีสินค้า / สินค้าใหม่ + การเรียงลำดับ)
+# - ตัวกรองแปลงเป็น filter ของ queryset ที่มี index รองรับทุกแบบการเรียง (ดู Product.Meta.indexes)
+# - จำนวนสินค้าในแต่ละ facet นับจากชุดผลลัพธ์ของหน้านั้นจริง (คำค้น + ตัวกรองของ facet กลุ่มอื่น)
+#   ด้วย aggregate เดียว: ตัวเลขข้าง "500 - 1,000 ฿" = จำนวนที่จะได้ถ้าติ๊กช่วงราคานี้เพิ่ม
+# - "มีสินค้า" ใช้สต็อกที่ขายได้จริงจาก DB (ผลรวม shard สำหรับสินค้าที่แบ่ง shard) ทั้งตัวกรองและตัวนับ
+#   ทุกหน้า (รวมหน้าแรก) นับจากแหล่งเดียวกัน ตัวเลขข้าง "มีสินค้า" จึงตรงกับจำนวนที่ได้เมื่อติ๊ก
+# - ผลนับ cache ต่อ (catalog version, stock version, วัน, คำค้น + ตัวกรองที่ normalise แล้ว)
+#   ผ่าน caching.get_or_build (กัน stampede) → aggregate ไม่เกิน 1 ครั้งต่อชุดตัวกรองต่อการเปลี่ยนแปลง
+# ----------------------------------------------------------------------
+
+PriceBand = namedtuple('PriceBand', 'slug label low high')
+
+PRICE_BANDS = (
+    PriceBand('under-500', 'ต่ำกว่า 500 ฿', None, Decimal('500')),
+    PriceBand('500-1000', '500 - 1,000 ฿', Decimal('500'), Decimal('1000')),
+    PriceBand('1000-3000', '1,000 - 3,000 ฿', Decimal('1000'), Decimal('3000')),
+    PriceBand('3000-up', '3,000 ฿ ขึ้นไป', Decimal('3000'), None),
+)
+_BANDS_BY_SLUG = {band.slug: band for band in PRICE_BANDS}
+
+# สินค้าที่เพิ่มภายในกี่วันถือเป็น "สินค้าใหม่"
+NEW_ARRIVAL_DAYS = 30
+
+# ทุกแบบการเรียงมี id ต่อท้ายเพื่อให้ลำดับคงที่ระหว่างหน้า
+SORTS = {
+    'newest': ('ใหม่ล่าสุด', ('-created_at', '-id')),
+    'price_asc': ('ราคาต่ำ → สูง', ('price', 'id')),
+    'price_desc': ('ราคาสูง → ต่ำ', ('-price', '-id')),
+    'name': ('ชื่อ ก-ฮ / A-Z', ('name', 'id')),
+}
+DEFAULT_SORT = 'newest'
+
+
+class Filters(namedtuple('Filters', 'price_bands in_stock new_arrivals sort')):
+    """ตัวกรองที่อ่านจาก query string (ค่าที่ไม่รู้จักจะถูกข้าม)"""
+    __slots__ = ()
+
+    @classmethod
+    def from_query(cls, params):
+        bands = tuple(slug for slug in params.getlist('price') if slug in _BANDS_BY_SLUG)
+        sort = params.get('sort')
+        return cls(
+            price_bands=bands,
+            in_stock=params.get('in_stock') == '1',
+            new_arrivals=params.get('new') == '1',
+            sort=sort if sort in SORTS else DEFAULT_SORT,
+        )
+
+    def query_items(self):
+        """ตัวกรองในรูป (ชื่อ, ค่า) ลำดับคงที่ (ใช้ทำ cache key / ลิงก์แบ่งหน้า ไม่ขึ้นกับ query string ดิบ)"""
+        items = [('price', band.slug) for band in PRICE_BANDS if band.slug in self.price_bands]
+        if self.in_stock:
+            items.append(('in_stock', '1'))
+        if self.new_arrivals:
+            items.append(('new', '1'))
+        if self.sort != DEFAULT_SORT:
+            items.append(('sort', self.sort))
+        return items
+
+    @property
+    def is_default(self):
+        return not (self.price_bands or self.in_stock or self.new_arrivals) and self.sort == DEFAULT_SORT
+
+    def price_q(self):
+        price_q = Q()
+        for slug in self.price_bands:
+            price_q |= _band_q(_BANDS_BY_SLUG[slug])
+        return price_q
+
+    def apply(self, queryset):
+        """กรองและเรียง queryset ของ Product ตามตัวกรองนี้"""
+        if self.price_bands:
+            queryset = queryset.filter(self.price_q())
+        if self.in_stock:
+            queryset = queryset.annotate(available=available_stock_expression()).filter(available__gt=0)
+        if self.new_arrivals:
+            queryset = queryset.filter(_new_q())
+        return queryset.order_by(*SORTS[self.sort][1])
+
+
+def _band_q(band):
+    band_q = Q()
+    if band.low is not None:
+        band_q &= Q(price__gte=band.low)
+    if band.high is not None:
+        band_q &= Q(price__lt=band.high)
+    return band_q
+
+
+def _new_q():
+    return Q(created_at__gte=timezone.now() - timedelta(days=NEW_ARRIVAL_DAYS))
+
+
+# ================== Facet counts ==================
+# นานสุดที่ผลนับเดิมถูกใช้ (key เปลี่ยนเองเมื่อสินค้า/สต็อกเปลี่ยน timeout นี้มีไว้ให้ "สินค้าใหม่" เลื่อนตามเวลา)
+COUNTS_TIMEOUT = 300
+
+
+def facet_counts(queryset, filters):
+    """
+    จำนวนสินค้าต่อ facet ภายใน queryset (ผลลัพธ์ก่อนใช้ตัวกรอง facet) ใน query เดียว
+    แต่ละตัวนับใช้ตัวกรองของ facet กลุ่มอื่นที่เลือกอยู่ แต่ไม่ใช้ของกลุ่มตัวเอง
+    """
+    in_stock_q = Q(available__gt=0)
+    new_q = _new_q()
+    price_q = filters.price_q()
+    stock_filter = in_stock_q if filters.in_stock else Q()
+    new_filter = new_q if filters.new_arrivals else Q()
+
+    aggregates = {
+        f'price_{index}': Count('pk', filter=_band_q(band) & stock_filter & new_filter)
+        for index, band in enumerate(PRICE_BANDS)
+    }
+    aggregates.update(
+        in_stock=Count('pk', filter=price_q & in_stock_q & new_filter),
+        out_of_stock=Count('pk', filter=price_q & ~in_stock_q & new_filter),
+        new=Count('pk', filter=price_q & stock_filter & new_q),
+        total=Count('pk', filter=price_q & stock_filter & new_filter),
+    )
+    row = queryset.order_by().annotate(available=available_stock_expression()).aggregate(**aggregates)
+    return {
+        'price': {band.slug: row[f'price_{index}'] for index, band in enumerate(PRICE_BANDS)},
+        'in_stock': row['in_stock'], 'out_of_stock': row['out_of_stock'],
+        'new': row['new'], 'total': row['total'],
+    }
+
+
+def counts_key(snapshot, filters, query=''):
+    """cache key ของผลนับ (ตัวกรองในรูป normalise การเรียงไม่มีผลกับจำนวน)"""
+    params = urlencode([('q', query)] + [item for item in filters.query_items() if item[0] != 'sort'])
+    digest = hashlib.md5(params.encode()).hexdigest()
+    return f'facets:{snapshot.version}:{snapshot.stock_version}:{timezone.localdate().isoformat()}:{digest}'
+
+
+def facet_context(filters, snapshot, queryset=None, query=''):
+    """
+    context สำหรับ template shop/facet_filters.html
+    queryset = ผลลัพธ์ของหน้านั้นก่อนใช้ตัวกรอง facet (เช่นผลค้นหาของ query) / None = catalog ทั้งหมด
+    """
+    if queryset is None:
+        queryset = Product.objects.filter(is_active=True)
+    counts = caching.get_or_build(counts_key(snapshot, filters, query), lambda: facet_counts(queryset, filters), COUNTS_TIMEOUT)
+    return {
+        'filters': filters,
+        'facet_counts': counts,
+        'price_bands': [
+            {'slug': band.slug, 'label': band.label, 'count': counts['price'][band.slug], 'selected': band.slug in filters.price_bands}
+            for band in PRICE_BANDS
+        ],
+        'sort_options': [(slug, label) for slug, (label, _) in SORTS.items()],
+    }
@@ -0,0 +1,194 @@
+# shop/feeds.py
+
+import csv
+import hashlib
+import io
+import json
+import logging
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+from django.urls import reverse
+
+from . import caching
+from .catalog import current_versions
+from .inventory import available_stock_expression
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 💡 Product feed สำหรับ marketplace / เว็บเปรียบเทียบราคา (JSON Lines, CSV, XML แบบ Google Merchant)
+# - อ่าน Product ทีละ chunk แบบ keyset (id > id สุดท้ายของ chunk ก่อน) ด้วย .iterator()
+#   แล้ว yield ออกไปทีละ chunk → ใช้หน่วยความจำคงที่ไม่ว่า catalog จะใหญ่แค่ไหน
+# - ข้อความของแต่ละ chunk ถูก cache ไว้ใน shared cache โดยมี "generation" อยู่ใน key
+#   generation = catalog version + digest ของชุดสินค้าที่หมดสต็อก และใช้เป็น ETag ของ feed ด้วย
+#   เมื่อสินค้าถูกแก้ไข (version เปลี่ยน) หรือสินค้าหมด/กลับมามีสต็อก (digest เปลี่ยน)
+#   chunk เก่าจะไม่ถูกใช้อีกและ client ได้ feed ใหม่แทน 304
+# ⚠️ การตัดสต็อกตอนชำระเงินไม่ bump version จึงต้องมี digest: ถ้าใช้แค่ version
+#   ETag จะเท่าเดิมและ marketplace ได้ 304 พร้อม availability เก่าไปเรื่อยๆ
+#   digest ถูก cache ต่อ (catalog version, stock version) → conditional GET ที่ไม่มีอะไรเปลี่ยน
+#   ไม่ต้องไล่อ่านสินค้าที่หมดสต็อกทุกครั้ง (สแกนใหม่เฉพาะหลังสต็อกเปลี่ยน และตัวเลขเดิมได้ ETag เดิม)
+# - availability ใช้สต็อกที่ขายได้จริง (ผลรวม shard สำหรับสินค้าที่แบ่ง shard)
+# ----------------------------------------------------------------------
+
+CHUNK_SIZE = 500
+FEED_CACHE_TIMEOUT = 60 * 15
+
+_FIELDS = ('id', 'name', 'description', 'price', 'available', 'image')
+CSV_COLUMNS = ('id', 'title', 'description', 'link', 'image_link', 'price', 'availability')
+
+
+def _cache():
+    return caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')]
+
+
+def _record(row, base_url):
+    pk, name, description, price, stock, image = row
+    return {
+        'id': pk,
+        'title': name,
+        'description': description,
+        'link': base_url + reverse('shop:product_detail', args=[pk]),
+        'image_link': base_url + default_storage.url(image) if image else '',
+        'price': f'{price} THB',
+        'availability': 'in_stock' if stock > 0 else 'out_of_stock',
+    }
+
+
+# ================== Formats ==================
+class JsonLinesFormat:
+    content_type = 'application/x-ndjson; charset=utf-8'
+    extension = 'jsonl'
+
+    def header(self, base_url):
+        return ''
+
+    def render(self, records):
+        return ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+
+    def footer(self):
+        return ''
+
+
+class CsvFormat:
+    content_type = 'text/csv; charset=utf-8'
+    extension = 'csv'
+
+    def _write(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerows(rows)
+        return buffer.getvalue()
+
+    def header(self, base_url):
+        return self._write([CSV_COLUMNS])
+
+    def render(self, records):
+        return self._write([record[column] for column in CSV_COLUMNS] for record in records)
+
+    def footer(self):
+        return ''
+
+
+class XmlFormat:
+    """RSS 2.0 + namespace g: ตามรูปแบบ Google Merchant Center"""
+    content_type = 'application/xml; charset=utf-8'
+    extension = 'xml'
+
+    def header(self, base_url):
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<rss version="2.0" xmlns:g="http://base.google.com/ns/1.0">\n<channel>\n'
+            f'<title>Art Toy Shop</title>\n<link>{escape(base_url)}/</link>\n'
+            '<description>Art Toy Shop product feed</description>\n'
+        )
+
+    def render(self, records):
+        return ''.join(
+            '<item>'
+            f'<g:id>{record["id"]}</g:id>'
+            f'<title>{escape(record["title"])}</title>'
+            f'<description>{escape(record["description"])}</description>'
+            f'<link>{escape(record["link"])}</link>'
+            f'<g:image_link>{escape(record["image_link"])}</g:image_link>'
+            f'<g:price>{record["price"]}</g:price>'
+            f'<g:availability>{record["availability"].replace("_", " ")}</g:availability>'
+            f'<g:condition>new</g:condition>'
+            '</item>\n'
+            for record in records
+        )
+
+    def footer(self):
+        return '</channel>\n</rss>\n'
+
+
+FORMATS = {fmt.extension: fmt for fmt in (JsonLinesFormat(), CsvFormat(), XmlFormat())}
+
+
+# ================== Generator ==================
+def _products():
+    return Product.objects.filter(is_active=True).annotate(available=available_stock_expression())
+
+
+def availability_digest():
+    """digest ของ id สินค้าที่หมดสต็อก (เปลี่ยนเมื่อ availability ของสินค้าใดๆ ใน feed เปลี่ยน)"""
+    hasher = hashlib.md5()
+    out_of_stock = _products().filter(available__lte=0).order_by('pk').values_list('pk', flat=True)
+    for pk in out_of_stock.iterator(chunk_size=CHUNK_SIZE):
+        hasher.update(b'%d,' % pk)
+    return hasher.hexdigest()[:12]
+
+
+def feed_generation():
+    version, stock_version = current_versions()
+    digest = caching.get_or_build(f'feed:digest:{version}:{stock_version}', availability_digest, FEED_CACHE_TIMEOUT, cache=_cache())
+    return f'{version}-{digest}'
+
+
+def feed_etag(fmt, generation=None):
+    return f'"{generation or feed_generation()}-{fmt}"'
+
+
+def generate(fmt, base_url, chunk_size=CHUNK_SIZE, generation=None):
+    """
+    yield feed ทีละ chunk (str) ของสินค้าที่ active ทั้งหมด เรียงตาม id
+    base_url เช่น 'https://shop.example.com' ใช้สร้างลิงก์แบบ absolute
+    """
+    feed_format = FORMATS[fmt]
+    generation = generation or feed_generation()
+    cache = _cache()
+    key_prefix = f'feed:{generation}:{fmt}:{hashlib.md5(base_url.encode()).hexdigest()[:8]}:{chunk_size}'
+    stats = {'chunks': 0, 'cached': 0, 'products': 0}
+
+    yield feed_format.header(base_url)
+    after = 0
+    while True:
+        key = f'{key_prefix}:{after}'
+        cached = cache.get(key)
+        if cached is None:
+            rows = (
+                _products().filter(pk__gt=after)
+                .order_by('pk').values_list(*_FIELDS)[:chunk_size]
+                .iterator(chunk_size=chunk_size)
+            )
+            records = [_record(row, base_url) for row in rows]
+            last = records[-1]['id'] if records else None
+            cached = (feed_format.render(records), last, len(records))
+            cache.set(key, cached, timeout=FEED_CACHE_TIMEOUT)
+        else:
+            stats['cached'] += 1
+
+        text, last, count = cached
+        if count:
+            stats['chunks'] += 1
+            stats['products'] += count
+            yield text
+        if count < chunk_size:
+            break
+        after = last
+
+    yield feed_format.footer()
+    logger.info('product feed generated', extra={'event': 'feed.generated', 'format': fmt, 'generation': generation, **stats})
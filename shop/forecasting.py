@@ -0,0 +1,131 @@
+# shop/forecasting.py
+
+import logging
+import time
+from datetime import timedelta
+
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DemandForecast, OrderItem, Product, StockShard
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 💡 คาดการณ์ยอดขายและแจ้งเตือนสต็อกใกล้หมด
+# - ดึงยอดขายรายวันของทุกสินค้าด้วย query เดียว (GROUP BY product, วัน) ใส่ numpy matrix [สินค้า × วัน]
+# - คำนวณ moving average และ EWMA ของทั้ง catalog พร้อมกันด้วย matrix @ weights (ไม่วน loop ต่อสินค้า)
+# - ใช้เฉพาะวันที่จบแล้ว (ถึงเมื่อวาน) วันนี้ยังขายไม่ครบวัน ถ้านับรวมจะดึงค่าเฉลี่ย/EWMA ให้ต่ำกว่าจริง
+#   (โดยเฉพาะ EWMA ที่ให้น้ำหนักวันล่าสุดมากที่สุด)
+# - days of cover = สต็อก / ยอดขายคาดการณ์ต่อวัน ต่ำกว่า LOW_STOCK_DAYS ถือว่าต้องเติมสต็อก
+# ผลลัพธ์เขียนลง DemandForecast (upsert ทีละ batch) ให้ dashboard / admin อ่านได้ทันที
+# ----------------------------------------------------------------------
+
+HISTORY_DAYS = 90
+MOVING_AVERAGE_DAYS = 28
+ALPHA = 0.2
+LOW_STOCK_DAYS = 14
+COUNTED_STATUSES = ('CONFIRMED', 'SHIPPED', 'DELIVERED')
+
+
+def daily_sales(product_ids, start, days):
+    """
+    คืน numpy matrix [len(product_ids) × days] ของจำนวนชิ้นที่ขายได้ต่อวัน ตั้งแต่ start (ต้นวัน เวลาท้องถิ่น)
+    (product_ids ต้องเรียงจากน้อยไปมาก)
+    """
+    import numpy as np
+
+    rows = (
+        OrderItem.objects.filter(
+            order__status__in=COUNTED_STATUSES, order__created_at__gte=start,
+            order__created_at__lt=start + timedelta(days=days), product__isnull=False,
+        )
+        .annotate(day=TruncDate('order__created_at'))
+        .values_list('product_id', 'day')
+        .annotate(quantity=Sum('quantity'))
+        .order_by()
+    )
+    sales = np.zeros((len(product_ids), days))
+    data = list(rows)
+    if not data:
+        return sales
+
+    product, day, quantity = zip(*data)
+    product = np.array(product)
+    day_index = np.array([(d - start.date()).days for d in day])
+    product_index = np.searchsorted(product_ids, product)
+    # ข้ามสินค้าที่ไม่อยู่ในรายการ (เช่นสินค้าที่ถูกปิดการขาย) และวันที่อยู่นอกช่วง
+    valid = (product_index < len(product_ids)) & (day_index >= 0) & (day_index < days)
+    valid[valid] &= product_ids[product_index[valid]] == product[valid]
+    np.add.at(sales, (product_index[valid], day_index[valid]), np.array(quantity, dtype=float)[valid])
+    return sales
+
+
+def ewma_weights(days, alpha):
+    """น้ำหนักของ EWMA (วันล่าสุดอยู่ท้าย) normalize ให้รวมเป็น 1 เพื่อแก้ bias ช่วงต้น"""
+    import numpy as np
+    weights = alpha * (1 - alpha) ** np.arange(days - 1, -1, -1)
+    return weights / weights.sum()
+
+
+def build(days=HISTORY_DAYS, alpha=ALPHA, low_stock_days=LOW_STOCK_DAYS, batch_size=2000):
+    """คำนวณ DemandForecast ของสินค้าที่ active ทั้งหมด คืน dict สรุปผล"""
+    import numpy as np
+
+    started = time.perf_counter()
+    now = timezone.now()
+    # days วันเต็มที่จบแล้ว (ต้นวันเวลาท้องถิ่น ถึงก่อนเที่ยงคืนที่ผ่านมา) ไม่รวมวันนี้ที่ยังขายไม่ครบวัน
+    start = timezone.localtime(now).replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days)
+
+    products = list(Product.objects.filter(is_active=True).order_by('pk').values_list('pk', 'stock', 'shard_count'))
+    if not products:
+        return {'products': 0, 'low_stock': 0, 'duration_ms': 0}
+    product_ids, stock, shard_count = (np.array(column) for column in zip(*products))
+
+    # สินค้าที่แบ่ง shard ใช้ผลรวมของ shard เป็นสต็อกจริง
+    if shard_count.any():
+        shard_totals = StockShard.objects.filter(product__shard_count__gt=0).values_list('product_id').annotate(total=Sum('count')).order_by()
+        for pk, total in shard_totals:
+            i = np.searchsorted(product_ids, pk)
+            if i < len(product_ids) and product_ids[i] == pk:
+                stock[i] = total
+
+    sales = daily_sales(product_ids, start, days)
+    moving_average = sales[:, -MOVING_AVERAGE_DAYS:].mean(axis=1)
+    forecast = sales @ ewma_weights(days, alpha)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cover = np.where(forecast > 0, np.maximum(stock, 0) / forecast, np.inf)
+    low_stock = (forecast > 0) & (cover < low_stock_days)
+
+    forecasts = [
+        DemandForecast(
+            product_id=pk, moving_average=round(ma, 4), forecast_daily=round(f, 4), stock=s,
+            days_of_cover=None if np.isinf(c) else round(c, 2), is_low_stock=low, computed_at=now,
+        )
+        for pk, ma, f, s, c, low in zip(
+            product_ids.tolist(), moving_average.tolist(), forecast.tolist(), stock.tolist(), cover.tolist(), low_stock.tolist(),
+        )
+    ]
+    DemandForecast.objects.bulk_create(
+        forecasts, batch_size=batch_size, update_conflicts=True, unique_fields=['product'],
+        update_fields=['moving_average', 'forecast_daily', 'stock', 'days_of_cover', 'is_low_stock', 'computed_at'],
+    )
+    # สินค้าที่ถูกปิดการขายไปแล้วไม่ต้องแจ้งเตือน
+    DemandForecast.objects.filter(computed_at__lt=now).delete()
+
+    stats = {
+        'products': len(forecasts), 'low_stock': int(low_stock.sum()),
+        'duration_ms': round((time.perf_counter() - started) * 1000, 2),
+    }
+    logger.info('demand forecast built', extra={'event': 'forecast.built', **stats})
+    return stats
+
+
+def low_stock_alerts(limit=20):
+    """สินค้าที่สต็อกจะหมดก่อน LOW_STOCK_DAYS วัน เรียงจากใกล้หมดที่สุด"""
+    return (
+        DemandForecast.objects.filter(is_low_stock=True)
+        .select_related('product').order_by('days_of_cover')[:limit]
+    )
@@ -0,0 +1,129 @@
+# shop/fulfilment.py
+
+import csv
+import io
+import logging
+from dataclasses import dataclass
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import order_cache
+from .models import Order, order_status_changed
+
+logger = logging.getLogger(__name__)
+
+BULK_BATCH_SIZE = 500
+# 💡 ไฟล์จาก Excel ภาษาไทยมักเป็น cp874 (TIS-620) ไม่ใช่ UTF-8 → ลอง UTF-8 (ตัด BOM) ก่อนแล้วค่อย cp874
+CSV_ENCODINGS = ('utf-8-sig', 'cp874')
+
+
+@dataclass
+class RowResult:
+    """ผลลัพธ์ของแต่ละออเดอร์ในการอัปเดตแบบกลุ่ม"""
+    order_id: object
+    ok: bool
+    message: str
+
+
+def bulk_transition(order_ids, new_status=None, tracking_numbers=None):
+    """
+    เปลี่ยนสถานะ (และ/หรือ tracking number) ของหลายออเดอร์พร้อมกัน
+
+    - บันทึกด้วย bulk_update เป็น batch (ไม่เรียก save() ทีละออเดอร์)
+    - ส่ง order_status_changed ครั้งเดียวพร้อม transition ทั้งหมด
+    - tracking_numbers: dict {order_id: tracking_number}
+    - ถ้า new_status เป็น None จะใช้ SHIPPED สำหรับออเดอร์ที่มี tracking number
+
+    คืนค่า list ของ RowResult เรียงตาม order_ids ที่ส่งเข้ามา
+    """
+    tracking_numbers = tracking_numbers or {}
+    order_ids = list(dict.fromkeys(order_ids))
+    valid_statuses = {choice[0] for choice in Order.STATUS_CHOICES}
+    if new_status is not None and new_status not in valid_statuses:
+        return [RowResult(order_id, False, 'สถานะคำสั่งซื้อไม่ถูกต้อง') for order_id in order_ids]
+
+    results = {}
+    changed = []
+    transitions = []
+    now = timezone.now()
+
+    with transaction.atomic():
+        orders = Order.objects.select_for_update().filter(pk__in=order_ids).only('id', 'user', 'status', 'tracking_number', 'updated_at')
+        orders = {order.id: order for order in orders}
+
+        for order_id in order_ids:
+            order = orders.get(order_id)
+            if order is None:
+                results[order_id] = RowResult(order_id, False, 'ไม่พบคำสั่งซื้อ')
+                continue
+
+            target = new_status or ('SHIPPED' if order_id in tracking_numbers else order.status)
+            if not Order.can_transition(order.status, target):
+                results[order_id] = RowResult(order_id, False, f'ไม่สามารถเปลี่ยนสถานะจาก {order.status} เป็น {target} ได้')
+                continue
+
+            old_status = order.status
+            order.status = target
+            if tracking_numbers.get(order_id):
+                order.tracking_number = tracking_numbers[order_id]
+            if not order.get_dirty_fields():
+                results[order_id] = RowResult(order_id, True, 'ไม่มีการเปลี่ยนแปลง')
+                continue
+
+            order.updated_at = now
+            changed.append(order)
+            if old_status != target:
+                transitions.append((order, old_status, target))
+            results[order_id] = RowResult(order_id, True, f'{old_status} → {target}')
+
+        Order.objects.bulk_update(changed, ['status', 'tracking_number', 'updated_at'], batch_size=BULK_BATCH_SIZE)
+        for order in changed:
+            order._snapshot_tracked_fields()
+        order_cache.invalidate_orders(changed)
+
+        # 💡 dispatch hook ครั้งเดียวสำหรับทั้ง batch
+        if transitions:
+            order_status_changed.send(sender=Order, transitions=transitions)
+
+    logger.info('bulk order update', extra={
+        'event': 'fulfilment.bulk_transition', 'status': new_status, 'requested': len(order_ids),
+        'updated': len(changed), 'transitions': len(transitions),
+    })
+    return [results[order_id] for order_id in order_ids]
+
+
+def parse_tracking_csv(uploaded_file):
+    """
+    อ่านไฟล์ CSV จากบริษัทขนส่ง (คอลัมน์ order_id, tracking_number; มี header หรือไม่มีก็ได้)
+    encoding ตาม CSV_ENCODINGS ถ้าอ่านไม่ได้ทั้งหมดจะได้ RowResult ของไฟล์หนึ่งแถว (ไม่ raise)
+    คืนค่า (dict {order_id: tracking_number}, list ของ RowResult สำหรับแถวที่อ่านไม่ได้)
+    """
+    raw = uploaded_file.read()
+    for encoding in CSV_ENCODINGS:
+        try:
+            text = raw.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        return {}, [RowResult('ไฟล์', False, 'อ่านไฟล์ไม่ได้: ต้องเป็น CSV แบบ UTF-8 หรือ TIS-620 (cp874)')]
+
+    pairs = {}
+    errors = []
+    for line_no, row in enumerate(csv.reader(io.StringIO(text, newline='')), start=1):
+        if not row or not any(cell.strip() for cell in row):
+            continue
+        if len(row) < 2:
+            errors.append(RowResult(f'แถว {line_no}', False, 'ต้องมี 2 คอลัมน์: order_id, tracking_number'))
+            continue
+        raw_id, tracking = row[0].strip().lstrip('#'), row[1].strip()
+        if not raw_id.isdigit():
+            if line_no != 1:  # แถวแรกอาจเป็น header
+                errors.append(RowResult(f'แถว {line_no}', False, f'order_id ไม่ถูกต้อง: {raw_id}'))
+            continue
+        if not tracking:
+            errors.append(RowResult(int(raw_id), False, 'ไม่มีหมายเลขติดตามพัสดุ'))
+            continue
+        pairs[int(raw_id)] = tracking[:100]
+    return pairs, errors
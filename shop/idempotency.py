@@ -0,0 +1,153 @@
+# shop/idempotency.py
+
+import hashlib
+import logging
+import re
+import time
+import uuid
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+
+from .models import IdempotencyRecord
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 💡 Idempotency key สำหรับ POST ที่สร้างข้อมูล (checkout / payment_process)
+# ฟอร์มแต่ละครั้งที่ render ได้ key ใหม่ (hidden field idempotency_key หรือ header Idempotency-Key)
+# - request แรกของ key จะ "จอง" key ด้วย INSERT (unique (user, key)) แล้วทำงานตามปกติ
+#   เสร็จแล้วเก็บ response (status / redirect / body) ไว้ใน IdempotencyRecord
+# - request ซ้ำ (ดับเบิลคลิก / มือถือ retry) INSERT ไม่ผ่าน → ได้ response เดิมกลับไปทันที
+#   ถ้า request แรกยังไม่เสร็จจะรอได้ไม่เกิน WAIT_TIMEOUT วินาที (ไม่สร้าง Order / Payment ซ้ำ)
+# - view error / ตอบ 5xx → ลบการจองทิ้ง ให้ส่งใหม่ด้วย key เดิมได้
+# - key เดิมแต่ข้อมูลไม่ตรงกัน (request_hash ต่าง) → 422
+# record เก่ากว่า TTL ลบด้วยคำสั่ง purge_idempotency_records
+# ----------------------------------------------------------------------
+
+DEFAULTS = {
+    'TTL': 24 * 60 * 60,
+    'WAIT_TIMEOUT': 10.0,
+    'POLL_INTERVAL': 0.05,
+    'MAX_BODY': 64 * 1024,
+}
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+FIELD = 'idempotency_key'
+_KEY_RE = re.compile(r'^[\w-]{8,64}$')
+_IGNORED_FIELDS = {FIELD, 'csrfmiddlewaretoken'}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'IDEMPOTENCY', {})}
+
+
+def new_key():
+    """key ใหม่สำหรับฟอร์มหนึ่งครั้ง (ใส่ใน context ของหน้าที่มีฟอร์ม)"""
+    return uuid.uuid4().hex
+
+
+def request_hash(request):
+    """hash ของสิ่งที่ request ขอ (path + ข้อมูลฟอร์ม ไม่รวม csrf token / key)"""
+    digest = hashlib.sha256(request.path.encode())
+    if request.content_type in ('application/x-www-form-urlencoded', 'multipart/form-data'):
+        for name in sorted(set(request.POST) - _IGNORED_FIELDS):
+            digest.update(f'\0{name}={request.POST.getlist(name)!r}'.encode())
+    else:
+        digest.update(request.body)
+    return digest.hexdigest()
+
+
+def _claim(request, key, endpoint, digest, config):
+    """จอง key: คืน (record, True) ถ้าเป็น request แรก หรือ (record เดิม, False)"""
+    for _ in range(3):
+        try:
+            with transaction.atomic():
+                return IdempotencyRecord.objects.create(user=request.user, key=key, endpoint=endpoint, request_hash=digest), True
+        except IntegrityError:
+            pass
+        record = IdempotencyRecord.objects.filter(user=request.user, key=key).first()
+        if record is None:
+            # ถูกลบไประหว่างนั้น (request แรก error) → จองใหม่
+            continue
+        if record.created_at < timezone.now() - timedelta(seconds=config['TTL']):
+            IdempotencyRecord.objects.filter(pk=record.pk, created_at=record.created_at).delete()
+            continue
+        return record, False
+    raise IntegrityError(f'could not claim idempotency key {key}')
+
+
+def _wait(record, config):
+    """รอให้ request แรกของ key ทำงานเสร็จ (คืน record ล่าสุด หรือ None ถ้าถูกลบเพราะ error)"""
+    deadline = time.monotonic() + config['WAIT_TIMEOUT']
+    while record.status_code is None and time.monotonic() < deadline:
+        time.sleep(config['POLL_INTERVAL'])
+        record = IdempotencyRecord.objects.filter(pk=record.pk).first()
+        if record is None:
+            return None
+    return record
+
+
+def _store(record, response, config):
+    record.status_code = response.status_code
+    record.location = response.get('Location', '')[:500]
+    record.content_type = response.get('Content-Type', '')[:100]
+    if not record.location and len(response.content) <= config['MAX_BODY']:
+        record.body = response.content
+    record.completed_at = timezone.now()
+    record.save(update_fields=['status_code', 'location', 'content_type', 'body', 'completed_at'])
+
+
+def _replay(request, record):
+    response = HttpResponse(bytes(record.body), status=record.status_code, content_type=record.content_type or None)
+    if record.location:
+        response['Location'] = record.location
+        messages.info(request, 'คำขอนี้ถูกดำเนินการไปแล้ว')
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """decorator สำหรับ view ที่รับ POST (ต้องอยู่ใต้ @login_required) ไม่มี key = ทำงานตามปกติ"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.META.get(HEADER) or (request.POST.get(FIELD) if request.method == 'POST' else None)
+        if request.method != 'POST' or not key or not request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+        if not _KEY_RE.match(key):
+            return HttpResponse('Invalid idempotency key', status=400, content_type='text/plain; charset=utf-8')
+
+        config = get_config()
+        endpoint = request.resolver_match.view_name if request.resolver_match else view.__name__
+        digest = request_hash(request)
+        record, created = _claim(request, key, endpoint, digest, config)
+
+        if not created:
+            if record.endpoint != endpoint or record.request_hash != digest:
+                return HttpResponse('Idempotency key was used for a different request', status=422, content_type='text/plain; charset=utf-8')
+            record = _wait(record, config)
+            if record is None or record.status_code is None:
+                response = HttpResponse('Request is still being processed', status=409, content_type='text/plain; charset=utf-8')
+                response['Retry-After'] = '1'
+                return response
+            logger.info('idempotent replay', extra={
+                'event': 'idempotency.replayed', 'endpoint': endpoint, 'user_id': request.user.id, 'status': record.status_code,
+            })
+            return _replay(request, record)
+
+        try:
+            response = view(request, *args, **kwargs)
+        except BaseException:
+            record.delete()
+            raise
+        if response.status_code >= 500 or response.streaming:
+            record.delete()
+            return response
+        _store(record, response, config)
+        return response
+    return wrapper
@@ -0,0 +1,136 @@
+# shop/inventory.py
+
+import logging
+import random
+import zlib
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, When
+from django.db.models.functions import Coalesce
+
+from .models import Product, StockShard
+
+logger = logging.getLogger(__name__)
+
+
+# ----------------------------------------------------------------------
+# 💡 Sharded stock counter
+# สินค้า hot จะแบ่งสต็อกไว้ใน StockShard N แถว การจองสต็อกจะ UPDATE แค่แถวเดียว
+# (เลือกแบบสุ่มหรือ hash จาก key) ทำให้ผู้ซื้อพร้อมกันไม่ต้องรอ row lock เดียวกัน
+# เมื่อ shard ที่เลือกไม่พอจะลอง shard อื่น และถ้าทุก shard ไม่พอจะ rebalance ก่อนลองใหม่
+# ----------------------------------------------------------------------
+
+def available_stock_expression():
+    """expression ของสต็อกที่ขายได้สำหรับ annotate บน queryset ของ Product (คู่กับ Product.available_stock)"""
+    shard_total = (
+        StockShard.objects.filter(product=OuterRef('pk'))
+        .values('product').annotate(total=Sum('count')).values('total')
+    )
+    return Case(
+        # สินค้าที่แบ่ง shard: Product.stock อัปเดตแค่ตอน reshard จึงใช้ผลรวมของ shard แทน
+        When(shard_count__gt=0, then=Coalesce(Subquery(shard_total), 0)),
+        default=F('stock'), output_field=IntegerField(),
+    )
+
+
+def _stock_changed():
+    # import ตอนเรียก: catalog import โมดูลนี้ (available_stock_expression)
+    from .catalog import bump_stock_version_on_commit
+    bump_stock_version_on_commit()
+
+
+def _split(total, shards):
+    """แบ่ง total เป็น shards ส่วนให้ใกล้เคียงกันที่สุด"""
+    base, extra = divmod(max(total, 0), shards)
+    return [base + (1 if i < extra else 0) for i in range(shards)]
+
+
+def _shard_order(shards, key=None):
+    start = zlib.crc32(str(key).encode()) % shards if key is not None else random.randrange(shards)
+    return [(start + offset) % shards for offset in range(shards)]
+
+
+@transaction.atomic
+def reshard(product, shards, total=None):
+    """
+    เปิด/ปิด/เปลี่ยนจำนวน shard ของสินค้า
+    - total: สต็อกรวมที่ต้องการ (ไม่ระบุ = ใช้สต็อกที่ขายได้ปัจจุบัน)
+    - shards = 0 คือปิด sharding และย้ายผลรวมกลับไปที่ Product.stock
+    """
+    Product.all_objects.select_for_update().filter(pk=product.pk).first()
+    existing = StockShard.objects.filter(product_id=product.pk)
+    if total is None:
+        total = existing.aggregate(total=Sum('count'))['total']
+        total = product.stock if total is None else total
+
+    existing.delete()
+    if shards:
+        StockShard.objects.bulk_create([
+            StockShard(product_id=product.pk, index=i, count=count)
+            for i, count in enumerate(_split(total, shards))
+        ])
+    Product.all_objects.filter(pk=product.pk).update(stock=total, shard_count=shards)
+    product.stock, product.shard_count = total, shards
+    product._snapshot_tracked_fields()
+    product.__dict__.pop('_available_stock', None)
+    _stock_changed()
+    logger.info('stock resharded', extra={
+        'event': 'inventory.resharded', 'product_id': product.pk, 'shards': shards, 'total': total,
+    })
+
+
+@transaction.atomic
+def rebalance(product, take=0):
+    """
+    รวมสต็อกจากทุก shard แล้วกระจายใหม่ให้เท่ากัน (เรียกเมื่อ shard ไม่พอ/หมด)
+    take: จำนวนที่ต้องตัดออกจากผลรวมก่อนกระจาย (ใช้ตอนจองที่ไม่มี shard เดียวพอ)
+    คืนค่า total คงเหลือ หรือ None ถ้าผลรวมไม่พอให้ตัด take
+    """
+    shards = list(StockShard.objects.select_for_update().filter(product_id=product.pk).order_by('index'))
+    total = sum(shard.count for shard in shards)
+    if not shards or total < take:
+        return None
+    total -= take
+    for shard, count in zip(shards, _split(total, len(shards))):
+        shard.count = count
+    StockShard.objects.bulk_update(shards, ['count'])
+    # อัปเดต snapshot ของ Product.stock (เกิดไม่บ่อย จึงไม่เป็นจุดแย่ง lock)
+    Product.all_objects.filter(pk=product.pk).update(stock=total)
+    _stock_changed()
+    logger.info('stock shards rebalanced', extra={
+        'event': 'inventory.rebalanced', 'product_id': product.pk, 'shards': len(shards), 'total': total, 'taken': take,
+    })
+    return total
+
+
+def reserve(product, quantity, key=None):
+    """
+    ตัดสต็อก quantity ชิ้น คืนค่า True ถ้าสำเร็จ
+    key (เช่น order id) ใช้เลือก shard แบบ hash ถ้าไม่ระบุจะสุ่ม
+    """
+    if not product.shard_count:
+        updated = Product.all_objects.filter(pk=product.pk, stock__gte=quantity).update(stock=F('stock') - quantity)
+        if updated:
+            _stock_changed()
+        return bool(updated)
+
+    for index in _shard_order(product.shard_count, key):
+        updated = StockShard.objects.filter(
+            product_id=product.pk, index=index, count__gte=quantity,
+        ).update(count=F('count') - quantity)
+        if updated:
+            _stock_changed()
+            return True
+
+    # ไม่มี shard เดียวที่พอ (shard เริ่มหมด): ตัดจากผลรวมทุก shard พร้อม rebalance ในคราวเดียว
+    return rebalance(product, take=quantity) is not None
+
+
+def release(product, quantity, key=None):
+    """คืนสต็อก quantity ชิ้น (เช่นตอนยกเลิกออเดอร์)"""
+    _stock_changed()
+    if not product.shard_count:
+        Product.all_objects.filter(pk=product.pk).update(stock=F('stock') + quantity)
+        return
+    index = _shard_order(product.shard_count, key)[0]
+    StockShard.objects.filter(product_id=product.pk, index=index).update(count=F('count') + quantity)
@@ -0,0 +1,165 @@
+# shop/log.py
+
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import threading
+import uuid
+from datetime import datetime, timezone as dt_timezone
+from logging.config import ConvertingList
+from logging.handlers import QueueHandler, QueueListener
+
+# 💡 request id ของ request ปัจจุบัน (ใช้ contextvar เพื่อให้ทำงานได้ทั้ง thread และ async)
+_request_id = contextvars.ContextVar('request_id', default='-')
+
+# attribute มาตรฐานของ LogRecord ที่ไม่ต้องใส่ซ้ำลงใน JSON
+_RESERVED_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'request_id'}
+
+
+def get_request_id():
+    return _request_id.get()
+
+
+def set_request_id(value):
+    """ตั้งค่า request id และคืน token สำหรับ reset กลับ"""
+    return _request_id.set(value)
+
+
+def reset_request_id(token):
+    _request_id.reset(token)
+
+
+# ================== Filter / Formatter ==================
+class RequestIdFilter(logging.Filter):
+    """แนบ request_id ลงใน record (ต้องทำงานบน thread ของ request ก่อนเข้าคิว)"""
+
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = _request_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    แปลง LogRecord เป็น JSON หนึ่งบรรทัด
+    ค่าที่ส่งผ่าน extra={...} (เช่น order_id, product_id, quantity, duration_ms) จะถูกใส่เป็น key ระดับบนสุด
+    """
+
+    def format(self, record):
+        payload = {
+            'ts': datetime.fromtimestamp(record.created, tz=dt_timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'request_id': getattr(record, 'request_id', '-'),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith('_'):
+                payload[key] = value
+        if record.exc_info:
+            payload['exc'] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+# ================== Queue Handler ==================
+def _resolve_handlers(handlers):
+    # dictConfig ส่ง 'cfg://handlers.xxx' มาเป็น ConvertingList การเข้าถึงทีละตัวจะได้ handler object จริง
+    if isinstance(handlers, ConvertingList):
+        return [handlers[i] for i in range(len(handlers))]
+    return list(handlers)
+
+
+_start_lock = threading.Lock()
+
+
+def _reinit_start_lock():
+    # lock ที่ thread อื่นของ parent ถืออยู่ตอน fork จะค้างใน child ตลอดไป → สร้างใหม่
+    global _start_lock
+    _start_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reinit_start_lock)
+
+
+class QueueListenerHandler(QueueHandler):
+    """
+    Handler ที่แค่ใส่ record ลงคิว (non-blocking) แล้วให้ QueueListener บน thread แยก
+    เป็นคนเขียนลง handler ปลายทาง (stdout/file) เพื่อไม่ให้ I/O บล็อก request thread
+
+    ถ้าคิวเต็ม (เช่นช่วง drop day) จะทิ้ง record แทนการรอ
+    """
+
+    def __init__(self, handlers, maxsize=10000, respect_handler_level=True):
+        super().__init__(queue.Queue(maxsize))
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._handlers = _resolve_handlers(handlers)
+        self._respect_handler_level = respect_handler_level
+        self._listener = None
+        self._pid = None
+        atexit.register(self._stop_listener)
+
+    def _ensure_listener(self):
+        """
+        เริ่ม listener thread ตอน emit ครั้งแรกของแต่ละ process
+        ⚠️ dictConfig ทำงานใน master ตอน gunicorn --preload แล้ว fork worker ซึ่งไม่ได้ thread ติดมาด้วย
+        ถ้าเริ่มตอน __init__ worker จะใส่ record ลงคิวที่ไม่มีใครอ่านจนเต็มแล้วทิ้ง log ทั้งหมด
+        """
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with _start_lock:
+            if self._pid == pid:
+                return
+            if self._pid is not None:
+                # process ที่ fork มา: คิวเดิมเป็นของ listener ใน parent (และ lock ในคิวอาจค้าง) → ใช้คิวใหม่
+                self.queue = queue.Queue(self.maxsize)
+            self._listener = QueueListener(
+                self.queue, *self._handlers, respect_handler_level=self._respect_handler_level
+            )
+            self._listener.start()
+            self._pid = pid
+
+    def _stop_listener(self):
+        # หยุดเฉพาะ listener ที่เริ่มใน process นี้ (thread ของ parent ไม่มีอยู่ใน child)
+        listener, self._listener = self._listener, None
+        if listener is not None and self._pid == os.getpid():
+            listener.stop()
+        self._pid = None
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        self._stop_listener()
+        super().close()
+
+
+# ================== Middleware ==================
+class RequestIdMiddleware:
+    """
+    กำหนด request id ให้ทุก request (ใช้ค่าจาก header X-Request-ID ถ้ามี)
+    และส่งกลับใน response header เพื่อใช้ correlate log
+    """
+    header = 'HTTP_X_REQUEST_ID'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_id = request.META.get(self.header, '')[:64] or uuid.uuid4().hex
+        request.request_id = request_id
+        token = set_request_id(request_id)
+        try:
+            response = self.get_response(request)
+        finally:
+            reset_request_id(token)
+        response['X-Request-ID'] = request_id
+        return response
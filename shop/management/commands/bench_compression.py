@@ -0,0 +1,83 @@
+# shop/management/commands/bench_compression.py
+
+import copy
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from shop.compression import available_encodings, compress, get_config
+
+PAGES = (
+    ('index.html', 'shop:index'),
+    ('my_orders.html', 'shop:my_orders'),
+    ('view_cart.html', 'shop:view_cart'),
+)
+
+
+def _plain_templates():
+    """TEMPLATES เดิมแต่ใช้ loader ปกติ (ไม่ย่อ HTML) ไว้เทียบขนาด"""
+    templates = copy.deepcopy(settings.TEMPLATES)
+    for engine in templates:
+        engine['OPTIONS'].pop('loaders', None)
+        engine['APP_DIRS'] = True
+    return templates
+
+
+class Command(BaseCommand):
+    help = (
+        'วัดจำนวนไบต์ที่ส่งจริง (ไม่ย่อ / ย่อ HTML / gzip / br) และเวลา CPU ที่ใช้บีบอัด '
+        'ของหน้า index, my_orders และ view_cart'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='username ที่ใช้เปิดหน้า my_orders / view_cart (ค่าเริ่มต้น: ผู้ใช้คนแรก)')
+        parser.add_argument('--iterations', type=int, default=50, help='จำนวนรอบที่บีบอัดต่อหน้าเพื่อหาเวลาเฉลี่ย')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['user']).first() if options['user'] else User.objects.order_by('pk').first()
+        if user is None:
+            raise CommandError('ไม่พบผู้ใช้สำหรับเปิดหน้า (สร้างผู้ใช้ก่อนหรือระบุ --user)')
+        config = get_config()
+        encodings = available_encodings()
+        if 'br' not in encodings:
+            self.stdout.write(self.style.WARNING('ไม่ได้ติดตั้ง brotli: วัดเฉพาะ gzip (pip install brotli)'))
+
+        client = Client()
+        client.force_login(user)
+        self.stdout.write(
+            f"{'page':<16}{'raw':>10}{'minified':>10}"
+            + ''.join(f'{encoding:>10}{encoding + " ms":>10}' for encoding in encodings)
+        )
+        for name, url_name in PAGES:
+            raw = self._render(client, url_name, _plain_templates())
+            minified = self._render(client, url_name)
+            row = f'{name:<16}{len(raw):>10,}{len(minified):>10,}'
+            for encoding in encodings:
+                started = time.perf_counter()
+                for _ in range(options['iterations']):
+                    compressed = compress(encoding, minified, config)
+                elapsed_ms = (time.perf_counter() - started) * 1000 / options['iterations']
+                row += f'{len(compressed):>10,}{elapsed_ms:>10.2f}'
+            self.stdout.write(row)
+
+        best = encodings[0]
+        self.stdout.write(
+            f'raw / minified = ขนาด HTML ก่อน/หลังย่อ (ไบต์) · {best} = ไบต์ที่ส่งจริงเมื่อ browser รองรับ · '
+            f'ms = เวลา CPU เฉลี่ยต่อ response (gzip level {config["GZIP_LEVEL"]}, brotli quality {config["BROTLI_QUALITY"]})'
+        )
+
+    def _render(self, client, url_name, templates=None):
+        # ล้าง fragment cache ให้ทั้งสองแบบ render HTML เต็มหน้าจริง
+        caches['default'].clear()
+        overrides = {'TEMPLATES': templates} if templates else {}
+        with override_settings(**overrides):
+            response = client.get(reverse(url_name), HTTP_ACCEPT_ENCODING='identity')
+        caches['default'].clear()
+        if response.status_code != 200:
+            raise CommandError(f'{url_name} ตอบ {response.status_code}')
+        return response.content
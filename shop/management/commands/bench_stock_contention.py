@@ -0,0 +1,92 @@
+# shop/management/commands/bench_stock_contention.py
+
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, connections
+
+from shop import inventory
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = 'เปรียบเทียบ throughput การตัดสต็อกแบบแถวเดียวกับแบบ sharded ภายใต้การ checkout พร้อมกันหลาย thread'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='จำนวน thread ที่ตัดสต็อกพร้อมกัน')
+        parser.add_argument('--reservations', type=int, default=2000, help='จำนวนการตัดสต็อกทั้งหมดต่อรอบ')
+        parser.add_argument('--shards', type=int, default=8, help='จำนวน shard สำหรับรอบ sharded')
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+        total = options['reservations']
+        shards = options['shards']
+
+        if connection.vendor == 'sqlite':
+            self.stdout.write(self.style.WARNING(
+                'SQLite ล็อกทั้งไฟล์ตอนเขียน ผลของ sharding จะเห็นชัดบน PostgreSQL/MySQL ที่ล็อกระดับแถว'
+            ))
+
+        for label, shard_count in (('single-row', 0), (f'sharded x{shards}', shards)):
+            product = Product.objects.create(
+                name=f'__bench_stock_{label}', description='benchmark', price=1, stock=total, is_active=False,
+            )
+            try:
+                if shard_count:
+                    inventory.reshard(product, shard_count)
+                result = self._run(product, threads, total)
+            finally:
+                product.delete()
+
+            self.stdout.write(
+                f'{label:>14}: {result["ok"]} ok / {result["failed"]} failed / {result["errors"]} lock errors '
+                f'in {result["elapsed"]:.2f}s → {result["ok"] / result["elapsed"]:.0f} reservations/s, '
+                f'p50 {result["p50"]:.2f}ms p99 {result["p99"]:.2f}ms'
+            )
+
+    def _run(self, product, threads, total):
+        per_thread = total // threads
+        latencies = []
+        counters = {'ok': 0, 'failed': 0, 'errors': 0}
+        lock = threading.Lock()
+        barrier = threading.Barrier(threads)
+
+        def worker(worker_id):
+            local_latencies = []
+            local = {'ok': 0, 'failed': 0, 'errors': 0}
+            barrier.wait()
+            try:
+                for n in range(per_thread):
+                    started = time.perf_counter()
+                    try:
+                        if inventory.reserve(product, 1, key=f'{worker_id}:{n}'):
+                            local['ok'] += 1
+                        else:
+                            local['failed'] += 1
+                    except OperationalError:
+                        local['errors'] += 1
+                    local_latencies.append((time.perf_counter() - started) * 1000)
+            finally:
+                connections.close_all()
+            with lock:
+                latencies.extend(local_latencies)
+                for key, value in local.items():
+                    counters[key] += value
+
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        return {
+            **counters,
+            'elapsed': elapsed,
+            'p50': statistics.median(latencies) if latencies else 0,
+            'p99': latencies[int(len(latencies) * 0.99) - 1] if latencies else 0,
+        }
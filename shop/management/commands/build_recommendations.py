@@ -0,0 +1,25 @@
+# shop/management/commands/build_recommendations.py
+
+from django.core.management.base import BaseCommand
+
+from shop import recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        'สร้างตารางสินค้าแนะนำ (ซื้อคู่กันบ่อย) จาก OrderItem แบบเพิ่มเติมตั้งแต่ครั้งล่าสุด '
+        '(ตั้ง cron ให้รันเป็นระยะ)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='ล้างยอดสะสมและคำนวณใหม่จาก Order ทั้งหมด')
+        parser.add_argument('--chunk-size', type=int, default=recommendations.CHUNK_SIZE, help='จำนวน Order id ต่อรอบ')
+        parser.add_argument('--top-k', type=int, default=recommendations.TOP_K, help='จำนวนสินค้าแนะนำต่อสินค้า')
+
+    def handle(self, *args, **options):
+        stats = recommendations.build(full=options['full'], chunk_size=options['chunk_size'], top_k=options['top_k'])
+        self.stdout.write(self.style.SUCCESS(
+            f"orders #{stats['from_order']}→#{stats['to_order']}: {stats['order_items']} items, "
+            f"{stats['products']} products updated, {stats['recommendations']} recommendations "
+            f"in {stats['duration_ms']}ms"
+        ))
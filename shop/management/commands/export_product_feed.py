@@ -0,0 +1,27 @@
+# shop/management/commands/export_product_feed.py
+
+from django.core.management.base import BaseCommand
+
+from shop import feeds
+
+
+class Command(BaseCommand):
+    help = 'ส่งออก product feed (jsonl / csv / xml) แบบ stream ทีละ chunk ไปยังไฟล์หรือ stdout'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(feeds.FORMATS), default='jsonl', help='รูปแบบ feed')
+        parser.add_argument('--base-url', required=True, help='URL หลักของร้าน เช่น https://shop.example.com')
+        parser.add_argument('--output', help='ไฟล์ปลายทาง (ค่าเริ่มต้น: stdout)')
+        parser.add_argument('--chunk-size', type=int, default=feeds.CHUNK_SIZE, help='จำนวนสินค้าต่อ chunk')
+
+    def handle(self, *args, **options):
+        chunks = feeds.generate(options['format'], options['base_url'].rstrip('/'), chunk_size=options['chunk_size'])
+        if not options['output']:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+
+        with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+            for chunk in chunks:
+                output.write(chunk)
+        self.stderr.write(self.style.SUCCESS(f"เขียน feed ไปที่ {options['output']} แล้ว"))
@@ -0,0 +1,35 @@
+# shop/management/commands/export_sales.py
+
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import exports
+
+
+class Command(BaseCommand):
+    help = 'ส่งออกยอดขาย (ออเดอร์ + รายการสินค้า + การชำระเงิน) ตามช่วงวันที่ แบบ stream ทีละ chunk ไปยังไฟล์หรือ stdout'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', required=True, help='วันที่เริ่มต้น YYYY-MM-DD')
+        parser.add_argument('--end', required=True, help='วันที่สิ้นสุด YYYY-MM-DD (รวมวันนี้)')
+        parser.add_argument('--format', choices=sorted(exports.FORMATS), default='csv', help='รูปแบบไฟล์')
+        parser.add_argument('--output', help='ไฟล์ปลายทาง (ค่าเริ่มต้น: stdout)')
+        parser.add_argument('--chunk-size', type=int, default=exports.CHUNK_SIZE, help='จำนวนออเดอร์ต่อ chunk')
+
+    def handle(self, *args, **options):
+        try:
+            start, end = exports.parse_date_range(options['start'], options['end'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        chunks = exports.generate(options['format'], start, end, chunk_size=options['chunk_size'])
+        if not options['output']:
+            for chunk in chunks:
+                sys.stdout.write(chunk)
+            return
+
+        with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+            for chunk in chunks:
+                output.write(chunk)
+        self.stderr.write(self.style.SUCCESS(f"เขียนยอดขายไปที่ {options['output']} แล้ว"))
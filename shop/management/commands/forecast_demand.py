@@ -0,0 +1,20 @@
+# shop/management/commands/forecast_demand.py
+
+from django.core.management.base import BaseCommand
+
+from shop import forecasting
+
+
+class Command(BaseCommand):
+    help = 'คำนวณยอดขายคาดการณ์และสินค้าที่ต้องเติมสต็อกของทั้ง catalog (ตั้ง cron ให้รันทุกคืน)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=forecasting.HISTORY_DAYS, help='จำนวนวันย้อนหลังที่ใช้คำนวณ')
+        parser.add_argument('--alpha', type=float, default=forecasting.ALPHA, help='smoothing factor ของ EWMA (0-1)')
+        parser.add_argument('--low-stock-days', type=int, default=forecasting.LOW_STOCK_DAYS, help='แจ้งเตือนเมื่อสต็อกพอขายน้อยกว่ากี่วัน')
+
+    def handle(self, *args, **options):
+        stats = forecasting.build(days=options['days'], alpha=options['alpha'], low_stock_days=options['low_stock_days'])
+        self.stdout.write(self.style.SUCCESS(
+            f"คำนวณ {stats['products']} สินค้า ต้องเติมสต็อก {stats['low_stock']} รายการ ({stats['duration_ms']}ms)"
+        ))
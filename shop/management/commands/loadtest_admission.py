@@ -0,0 +1,102 @@
+# shop/management/commands/loadtest_admission.py
+
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+
+from shop.admission import DEFAULTS, AdmissionController
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class Command(BaseCommand):
+    help = (
+        'จำลองโหลดเกินกำลัง (overload) บน cart/checkout แล้วเทียบ latency p50/p99 '
+        'ระหว่างไม่มีและมี admission control (ทำงาน offline ด้วย local-memory cache)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='จำนวน worker thread (เหมือน gunicorn threads)')
+        parser.add_argument('--service-ms', type=float, default=5.0, help='เวลาที่ view ถือ DB write lock ต่อ request')
+        parser.add_argument('--rps', type=int, default=600, help='จำนวน request ต่อวินาทีที่ยิงเข้ามา')
+        parser.add_argument('--clients', type=int, default=500, help='จำนวนผู้ใช้ที่แตกต่างกัน')
+        parser.add_argument('--duration', type=float, default=5.0, help='ระยะเวลาทดสอบ (วินาที)')
+
+    def handle(self, *args, **options):
+        capacity = 1000.0 / options['service_ms']
+        self.stdout.write(
+            f"capacity ≈ {capacity:.0f} req/s, offered {options['rps']} req/s "
+            f"({options['rps'] / capacity:.1f}x overload), {options['workers']} workers"
+        )
+        for admission in (False, True):
+            result = self._run(admission=admission, capacity=capacity, **options)
+            label = 'with admission' if admission else 'no admission'
+            self.stdout.write(
+                f"{label:>15}: served {result['served']} "
+                f"p50 {result['p50']:.1f}ms p99 {result['p99']:.1f}ms | "
+                f"all responses p99 {result['p99_all']:.1f}ms | rejected {dict(result['rejected'])}"
+            )
+
+    def _run(self, admission, capacity, workers, service_ms, rps, clients, duration, **_):
+        db_lock = threading.Lock()  # จำลอง SQLite write lock
+        controller = None
+        if admission:
+            config = {
+                **DEFAULTS,
+                'GLOBAL_RATE': capacity * 0.8 / DEFAULTS['ADMIT_REQUESTS'],
+                'GLOBAL_BURST': workers,
+                'USER_RATE': 2.0,
+                'USER_BURST': 3,
+                'QUEUE_MAX': clients // 2,
+            }
+            controller = AdmissionController(config, cache=LocMemCache(f'loadtest-{time.time()}', {'OPTIONS': {'MAX_ENTRIES': 100000}}))
+
+        served_latencies = []
+        all_latencies = []
+        rejected = Counter()
+        lock = threading.Lock()
+
+        def handle_request(client, arrived):
+            outcome = 'admit'
+            if controller is not None:
+                outcome = controller.check(client)[0]
+            if outcome == 'admit':
+                with db_lock:
+                    time.sleep(service_ms / 1000.0)
+            latency = (time.perf_counter() - arrived) * 1000
+            with lock:
+                all_latencies.append(latency)
+                if outcome == 'admit':
+                    served_latencies.append(latency)
+                else:
+                    rejected[outcome] += 1
+
+        pool = ThreadPoolExecutor(max_workers=workers)
+        interval = 1.0 / rps
+        started = time.perf_counter()
+        next_at = started
+        while next_at - started < duration:
+            now = time.perf_counter()
+            if now < next_at:
+                time.sleep(next_at - now)
+            pool.submit(handle_request, f'c{random.randrange(clients)}', time.perf_counter())
+            next_at += interval
+        pool.shutdown(wait=True)
+
+        return {
+            'served': len(served_latencies),
+            'p50': _percentile(served_latencies, 50),
+            'p99': _percentile(served_latencies, 99),
+            'p99_all': _percentile(all_latencies, 99),
+            'rejected': rejected,
+        }
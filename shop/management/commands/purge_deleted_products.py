@@ -0,0 +1,29 @@
+# shop/management/commands/purge_deleted_products.py
+
+from django.core.management.base import BaseCommand
+
+from shop.purge import get_config, purge_deleted_products
+
+
+class Command(BaseCommand):
+    help = (
+        'ลบรายการในตะกร้าและการแจ้งเตือนสินค้าเข้าที่ค้างอยู่ของสินค้าที่ถูกลบ (soft delete) '
+        'ทีละชุดเพื่อไม่ล็อก DB นาน (ตั้ง cron ทุก 5-15 นาที)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='ลบครั้งละกี่แถว (ค่าเริ่มต้นจาก settings)')
+        parser.add_argument('--pause', type=float, help='หยุดพักระหว่างชุดกี่วินาที')
+
+    def handle(self, *args, **options):
+        config = get_config()
+        if options['batch_size']:
+            config['BATCH_SIZE'] = options['batch_size']
+        if options['pause'] is not None:
+            config['PAUSE'] = options['pause']
+
+        stats = purge_deleted_products(config)
+        self.stdout.write(self.style.SUCCESS(
+            f"ลบรายการในตะกร้า {stats['cart_items']} รายการ, การแจ้งเตือนที่ค้าง {stats['subscriptions']} รายการ "
+            f"({stats['batches']} ชุด, {stats['duration_ms'] / 1000:.1f}s)"
+        ))
@@ -0,0 +1,28 @@
+# shop/management/commands/purge_idempotency_records.py
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from shop.idempotency import get_config
+from shop.models import IdempotencyRecord
+
+
+class Command(BaseCommand):
+    help = 'ลบ idempotency record ที่เก่ากว่า IDEMPOTENCY["TTL"] ทีละชุด (ตั้ง cron วันละครั้ง)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='ลบครั้งละกี่แถว')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=get_config()['TTL'])
+        expired = IdempotencyRecord.objects.filter(created_at__lt=cutoff)
+        deleted = 0
+        while True:
+            # 💡 ลบทีละชุดด้วย pk__in เพื่อไม่ล็อกตารางนานระหว่างที่หน้า checkout ยังเขียน record ใหม่
+            ids = list(expired.values_list('pk', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            deleted += IdempotencyRecord.objects.filter(pk__in=ids).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f'ลบ idempotency record ที่หมดอายุแล้ว {deleted} รายการ'))
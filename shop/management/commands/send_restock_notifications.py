@@ -0,0 +1,25 @@
+# shop/management/commands/send_restock_notifications.py
+
+from django.core.management.base import BaseCommand
+
+from shop.restock import RestockNotifier
+
+
+class Command(BaseCommand):
+    help = (
+        'ส่งแจ้งเตือน LINE ที่ค้างอยู่ของสินค้าที่กลับมามีสต็อกแล้ว '
+        '(ตั้ง cron เป็นตาข่ายรองรับกรณี worker ส่งไม่สำเร็จหรือ process ถูก restart)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', type=int, help='ส่งเฉพาะสินค้านี้')
+
+    def handle(self, *args, **options):
+        notifier = RestockNotifier()
+        if options['product']:
+            results = {options['product']: notifier.notify_product(options['product'])}
+        else:
+            results = notifier.drain()
+        for product_id, sent in results.items():
+            self.stdout.write(f'product #{product_id}: ส่ง {sent} คน')
+        self.stdout.write(self.style.SUCCESS(f'รวม {sum(results.values())} คน จาก {len(results)} สินค้า'))
@@ -0,0 +1,30 @@
+# shop/management/commands/sync_courier_tracking.py
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.courier import get_config, sync
+
+
+class Command(BaseCommand):
+    help = (
+        'ถามสถานะพัสดุของออเดอร์ที่กำลังจัดส่งจาก tracking API ของบริษัทขนส่ง (พร้อมกันแบบ async) '
+        'แล้วเปลี่ยนออเดอร์ที่ส่งถึงแล้วเป็น DELIVERED (ตั้ง cron ทุก 15-30 นาที)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, help='จำนวน request พร้อมกันสูงสุด (ค่าเริ่มต้นจาก settings)')
+        parser.add_argument('--limit', type=int, help='ตรวจไม่เกินกี่ออเดอร์ (เก่าสุดก่อน)')
+
+    def handle(self, *args, **options):
+        config = get_config()
+        if not config['COURIERS']:
+            raise CommandError('ยังไม่ได้ตั้งค่า COURIER_TRACKING["COURIERS"] ใน settings')
+        if options['concurrency']:
+            config['CONCURRENCY'] = options['concurrency']
+
+        stats = sync(config, limit=options['limit'])
+        self.stdout.write(self.style.SUCCESS(
+            f"ตรวจ {stats['parcels']} พัสดุใน {stats['duration_ms'] / 1000:.1f}s: ส่งถึงแล้ว {stats['delivered']}, "
+            f"ระหว่างทาง {stats['in_transit']}, ไม่พบ {stats['unknown']}, ผิดพลาด {stats['errors']}, "
+            f"ไม่รู้จักบริษัทขนส่ง {stats['no_courier']}"
+        ))
@@ -0,0 +1,182 @@
+# shop/media.py
+
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import FileSystemStorage
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+# ----------------------------------------------------------------------
+# 💡 เสิร์ฟไฟล์ใน MEDIA_ROOT (รูปสินค้า) บน production โดยไม่ให้ worker ของ gunicorn อ่าน/ส่งไบต์เอง
+# - OFFLOAD='x-accel-redirect' (nginx) / 'x-sendfile' (apache, lighttpd): Django แค่ตรวจ path,
+#   ตอบ 304 ถ้า browser มีไฟล์อยู่แล้ว แล้วส่ง header ให้ front server ส่งไฟล์เอง (รองรับ Range เอง)
+#     nginx:  location /protected-media/ { internal; alias /path/to/media/; }
+# - ไม่ได้ตั้ง OFFLOAD: FileResponse ที่ WSGI server ส่งด้วย wsgi.file_wrapper
+#   (gunicorn ใช้ os.sendfile ส่งจาก kernel ตรงไป socket) รองรับ Range (ช่วงเดียว) / If-Range
+# - ทุกแบบมี ETag + Last-Modified (ตอบ 304 ได้) และ Cache-Control:
+#   ชื่อไฟล์ที่มี hash ของเนื้อหา (ContentHashStorage ด้านล่าง) = immutable cache ได้ 1 ปี
+#   ชื่อไฟล์ธรรมดา (รูปเก่าก่อนมี hash) = MAX_AGE แล้ว revalidate ด้วย ETag
+# ----------------------------------------------------------------------
+
+DEFAULTS = {
+    'OFFLOAD': '',
+    'ACCEL_PREFIX': '/protected-media/',
+    'MAX_AGE': 60 * 60,
+    'IMMUTABLE_MAX_AGE': 365 * 24 * 60 * 60,
+}
+
+HASH_LENGTH = 12
+# ชื่อไฟล์ที่ ContentHashStorage สร้าง: <ชื่อเดิม>.<hash 12 ตัว>.<นามสกุล>
+HASHED_NAME_RE = re.compile(r'\.[0-9a-f]{%d}\.[\w]+$' % HASH_LENGTH)
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'MEDIA_SERVING', {})}
+
+
+class ContentHashStorage(FileSystemStorage):
+    """ตั้งชื่อไฟล์ที่อัปโหลดตาม hash ของเนื้อหา ไฟล์เดิมเนื้อหาเดิมใช้ไฟล์เดียวกัน ไม่เขียนซ้ำ"""
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        root, ext = os.path.splitext(name)
+        name = f'{root}.{digest.hexdigest()[:HASH_LENGTH]}{ext.lower()}'
+        if self.exists(name):
+            return name
+        return super()._save(name, content)
+
+
+class _FileRange:
+    """file object ที่อ่านได้เฉพาะช่วง [start, start + length) (fileno() ยังใช้ sendfile ได้ตาม Content-Length)"""
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self._file = file
+        self.name = file.name
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self._file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def close(self):
+        self._file.close()
+
+
+def _parse_range(header, size):
+    """'bytes=0-99' → (start, end) รวมปลาย / None = ส่งทั้งไฟล์ / False = ช่วงที่ขอเกินไฟล์ (416)"""
+    match = _RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        # หลายช่วง (multipart/byteranges) หรือรูปแบบแปลก → ส่งทั้งไฟล์ตาม RFC 9110
+        return None
+    first, last = match.groups()
+    if first == '':
+        # suffix range: n ไบต์สุดท้าย
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _if_range_matches(request, etag, mtime):
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    since = parse_http_date_safe(if_range)
+    return since is not None and int(mtime) <= since
+
+
+def _cache_control(path, config):
+    if HASHED_NAME_RE.search(path):
+        return f"public, max-age={config['IMMUTABLE_MAX_AGE']}, immutable"
+    return f"public, max-age={config['MAX_AGE']}"
+
+
+@require_safe
+def serve(request, path, config=None):
+    """view ของ MEDIA_URL (GET / HEAD)"""
+    config = config or get_config()
+    path = posixpath.normpath(path).lstrip('/')
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('ไม่พบไฟล์')
+    try:
+        st = os.stat(fullpath)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404('ไม่พบไฟล์')
+    if not stat.S_ISREG(st.st_mode):
+        raise Http404('ไม่พบไฟล์')
+
+    etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+    content_type, encoding = mimetypes.guess_type(fullpath)
+    content_type = content_type or 'application/octet-stream'
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(st.st_mtime))
+    if response is None:
+        offload = config['OFFLOAD'].lower()
+        if offload == 'x-accel-redirect':
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = config['ACCEL_PREFIX'].rstrip('/') + '/' + quote(path)
+        elif offload == 'x-sendfile':
+            response = HttpResponse(content_type=content_type)
+            response['X-Sendfile'] = fullpath
+        else:
+            response = _file_response(request, fullpath, st.st_size, content_type, etag, st.st_mtime)
+
+    if response.status_code in (200, 206, 304):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(st.st_mtime)
+        response['Cache-Control'] = _cache_control(path, config)
+    if encoding and response.status_code in (200, 206):
+        response['Content-Encoding'] = encoding
+    return response
+
+
+def _file_response(request, fullpath, size, content_type, etag, mtime):
+    byte_range = None
+    if 'Range' in request.headers and _if_range_matches(request, etag, mtime):
+        byte_range = _parse_range(request.headers['Range'], size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    file = open(fullpath, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+    else:
+        start, end = byte_range
+        response = FileResponse(_FileRange(file, start, end - start + 1), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_product_listing_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RestockSubscription',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('line_user_id', models.CharField(max_length=64, verbose_name='LINE user ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('notified_at', models.DateTimeField(blank=True, null=True, verbose_name='แจ้งเตือนเมื่อ')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='restock_subscriptions', to='shop.product', verbose_name='สินค้า')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='ผู้ใช้งาน')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'notified_at', 'id'], name='restock_pending_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'user'), name='unique_restock_subscription')],
+            },
+        ),
+    ]
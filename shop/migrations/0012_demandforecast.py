@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0011_restocksubscription'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DemandForecast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('moving_average', models.FloatField(default=0, verbose_name='ยอดขายเฉลี่ย/วัน')),
+                ('forecast_daily', models.FloatField(default=0, verbose_name='ยอดขายคาดการณ์/วัน (EWMA)')),
+                ('stock', models.IntegerField(default=0, verbose_name='สต็อกตอนคำนวณ')),
+                ('days_of_cover', models.FloatField(blank=True, null=True, verbose_name='สต็อกพอขาย (วัน)')),
+                ('is_low_stock', models.BooleanField(default=False, verbose_name='ต้องเติมสต็อก')),
+                ('computed_at', models.DateTimeField(verbose_name='คำนวณเมื่อ')),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='forecast', to='shop.product', verbose_name='สินค้า')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['is_low_stock', 'days_of_cover'], name='forecast_low_stock_idx')],
+            },
+        ),
+    ]
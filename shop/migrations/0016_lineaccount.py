@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0015_order_created_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='restocksubscription',
+            name='line_user_id',
+            field=models.CharField(blank=True, max_length=64, verbose_name='LINE user ID'),
+        ),
+        migrations.CreateModel(
+            name='LineAccount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('line_user_id', models.CharField(blank=True, db_index=True, max_length=64, verbose_name='LINE user ID')),
+                ('link_code', models.CharField(blank=True, max_length=16, null=True, unique=True, verbose_name='รหัสยืนยัน')),
+                ('link_code_created_at', models.DateTimeField(blank=True, null=True)),
+                ('linked_at', models.DateTimeField(blank=True, null=True, verbose_name='ยืนยันเมื่อ')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='line_account', to=settings.AUTH_USER_MODEL, verbose_name='ผู้ใช้งาน')),
+            ],
+        ),
+    ]
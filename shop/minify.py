@@ -0,0 +1,54 @@
+# shop/minify.py
+
+import re
+
+from django.template.loaders import app_directories, filesystem
+
+# ----------------------------------------------------------------------
+# 💡 ย่อ HTML ตอนโหลด template (ครั้งเดียวต่อ template ต่อ worker เพราะอยู่ใต้ cached.Loader)
+# ไม่ได้ย่อ response ทุก request จึงไม่มีต้นทุน CPU ตอน render
+# - ตัดช่องว่าง/ย่อหน้าต้นบรรทัดและท้ายบรรทัด และบรรทัดว่างทิ้ง (เหลือขึ้นบรรทัดใหม่ตัวเดียว
+#   browser แสดงผลเหมือนเดิม และ JavaScript ที่พึ่ง automatic semicolon insertion ไม่พัง)
+# - ตัด <!-- comment --> ของ HTML ทิ้ง (ยกเว้น conditional comment <!--[if ...]>)
+# - ไม่แตะเนื้อหาใน <pre> และ <textarea> ที่ช่องว่างมีความหมาย
+# ใช้กับไฟล์ .html เท่านั้น (template ของ email / txt / xml ไม่ถูกแก้)
+# ----------------------------------------------------------------------
+
+EXTENSIONS = ('.html',)
+
+_PROTECTED_RE = re.compile(r'(<(pre|textarea)\b.*?</\2\s*>)', re.IGNORECASE | re.DOTALL)
+_COMMENT_RE = re.compile(r'<!--(?!\[if|<!).*?-->', re.DOTALL)
+_LINE_BREAK_RE = re.compile(r'[ \t\r]*\n\s*')
+
+
+def _minify_segment(text):
+    text = _COMMENT_RE.sub('', text)
+    return _LINE_BREAK_RE.sub('\n', text)
+
+
+def minify_html(source):
+    """คืน source ของ template ที่ตัดช่องว่างที่ไม่มีผลต่อการแสดงผลออกแล้ว"""
+    parts = _PROTECTED_RE.split(source)
+    # split ด้วย group 2 ชั้น: [ข้อความ, บล็อกที่ห้ามแตะ, ชื่อ tag, ข้อความ, ...]
+    out = []
+    for index in range(0, len(parts), 3):
+        out.append(_minify_segment(parts[index]))
+        if index + 1 < len(parts):
+            out.append(parts[index + 1])
+    return ''.join(out).strip()
+
+
+class MinifyMixin:
+    def get_contents(self, origin):
+        contents = super().get_contents(origin)
+        if origin.name.endswith(EXTENSIONS):
+            return minify_html(contents)
+        return contents
+
+
+class FilesystemLoader(MinifyMixin, filesystem.Loader):
+    pass
+
+
+class AppDirectoriesLoader(MinifyMixin, app_directories.Loader):
+    pass
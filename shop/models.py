@@ -3,10 +3,87 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.db.models import Sum, F
+from django.core.exceptions import ValidationError
+from django.dispatch import Signal
+import logging
 import uuid
+from decimal import Decimal
+
+logger = logging.getLogger(__name__)
+
+# 💡 ส่งเมื่อสถานะ Order เปลี่ยนจริงเท่านั้น
+# kwargs: transitions = [(order, old_status, new_status), ...]
+order_status_changed = Signal()
+
+# 💡 ส่งเมื่อ stock ของสินค้าเปลี่ยนจาก 0 (หรือน้อยกว่า) เป็นมากกว่า 0 ตอน save
+# kwargs: products = [product, ...]
+product_restocked = Signal()
+
+
+# ================== Dirty-field tracking ==================
+class TrackedFieldsMixin:
+    """
+    จำค่าของ field ใน tracked_fields ไว้ในหน่วยความจำตอนโหลดจาก DB
+    เพื่อให้ตรวจได้ว่า field ไหนเปลี่ยนโดยไม่ต้อง SELECT ซ้ำก่อน save
+    """
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot_tracked_fields()
+        return instance
+
+    def _snapshot_tracked_fields(self, fields=None):
+        loaded = getattr(self, '_loaded_values', {})
+        for name in fields or self.tracked_fields:
+            # ข้าม field ที่ถูก defer ไว้ (ยังไม่ได้โหลด)
+            if name in self.tracked_fields and name in self.__dict__:
+                loaded[name] = self.__dict__[name]
+        self._loaded_values = loaded
+
+    def get_loaded_value(self, name, default=None):
+        """ค่าของ field ตอนโหลดจาก DB (หรือ default ถ้าเป็น instance ใหม่)"""
+        return getattr(self, '_loaded_values', {}).get(name, default)
+
+    def get_dirty_fields(self):
+        """คืน dict {field: ค่าเดิม} ของ tracked field ที่ถูกแก้ไขหลังโหลด"""
+        loaded = getattr(self, '_loaded_values', {})
+        return {
+            name: old for name, old in loaded.items()
+            if name in self.__dict__ and self.__dict__[name] != old
+        }
+
 
 # ================== Product ==================
-class Product(models.Model):
+class ProductQuerySet(models.QuerySet):
+    def soft_delete(self):
+        """
+        ลบแบบ soft delete: UPDATE แถวสินค้าอย่างเดียว (ปิดการขายพร้อมกัน)
+        ไม่ cascade ไป CartItem / ไม่แก้ OrderItem ประวัติคำสั่งซื้อยังผูกกับสินค้าเดิม
+        CartItem ที่ค้างอยู่ถูกซ่อนทันที (CartItemManager) แล้วลบทีหลังทีละชุดด้วย purge_deleted_products
+        """
+        from django.utils import timezone
+        from .catalog import bump_version_on_commit
+
+        updated = self.filter(deleted_at__isnull=True).update(deleted_at=timezone.now(), is_active=False)
+        if updated:
+            bump_version_on_commit()
+        return updated
+
+    def restore(self):
+        """กู้คืนสินค้าที่ถูกลบ (ยังเป็นสถานะปิดการขาย ให้ staff เปิดขายเองเมื่อพร้อม)"""
+        return self.filter(deleted_at__isnull=False).update(deleted_at=None)
+
+
+class ProductManager(models.Manager.from_queryset(ProductQuerySet)):
+    """manager หลักของ Product: ไม่เห็นสินค้าที่ถูก soft delete (ทุกหน้า catalog / ตะกร้า / จัดการสินค้า)"""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
+class Product(TrackedFieldsMixin, models.Model):
     name = models.CharField(max_length=200, verbose_name="ชื่อสินค้า")
     description = models.TextField(verbose_name="คำอธิบาย")
     price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="ราคา")
@@ -14,15 +91,187 @@ class Product(models.Model):
     image = models.ImageField(upload_to='products/', null=True, blank=True, verbose_name="รูปภาพสินค้า")
     is_active = models.BooleanField(default=True, verbose_name="สถานะสินค้า")
     created_at = models.DateTimeField(auto_now_add=True)
+    # 💡 สินค้า hot (เช่น blind-box drop) แบ่งสต็อกเป็นหลายแถวใน StockShard เพื่อลดการแย่ง row lock
+    # 0 = ไม่แบ่ง (ใช้ stock ตามปกติ) / เมื่อแบ่งแล้ว stock จะเป็นเพียง snapshot ของผลรวม
+    shard_count = models.PositiveSmallIntegerField(default=0, verbose_name="จำนวน shard ของสต็อก")
+    # 💡 soft delete (ดู ProductQuerySet.soft_delete) NULL = ยังไม่ถูกลบ
+    deleted_at = models.DateTimeField(null=True, blank=True, verbose_name="ลบเมื่อ")
+
+    # ⚠️ objects ต้องอยู่ก่อน (เป็น default manager) / all_objects ใช้เมื่อต้องเห็นสินค้าที่ถูกลบด้วย (Admin, สต็อก)
+    # ประวัติคำสั่งซื้อ (OrderItem.product) ยังอ่านสินค้าที่ถูกลบได้เพราะ related object ใช้ base manager
+    objects = ProductManager()
+    all_objects = ProductQuerySet.as_manager()
+
+    tracked_fields = ('stock', 'shard_count')
+
+    class Meta:
+        # 💡 partial index (เฉพาะสินค้าที่ active) สำหรับทุกแบบการเรียงของหน้ารายการสินค้า (ดู shop/facets.py SORTS)
+        # price_desc ใช้ index ของ price แบบอ่านย้อนหลัง
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], condition=models.Q(is_active=True), name='product_active_newest_idx'),
+            models.Index(fields=['price', 'id'], condition=models.Q(is_active=True), name='product_active_price_idx'),
+            models.Index(fields=['name', 'id'], condition=models.Q(is_active=True), name='product_active_name_idx'),
+            # สำหรับ purge_deleted_products (แถวที่ถูกลบมีน้อย index จึงเล็ก)
+            models.Index(fields=['deleted_at'], condition=models.Q(deleted_at__isnull=False), name='product_deleted_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    @property
+    def is_sharded(self):
+        return self.shard_count > 0
+
+    @property
+    def available_stock(self):
+        """สต็อกจริงที่ขายได้ (ผลรวมของ shard ถ้าสินค้านี้เปิดใช้ sharding)"""
+        if not self.is_sharded:
+            return self.stock
+        if not hasattr(self, '_available_stock'):
+            total = self.stockshard_set.aggregate(total=Sum('count'))['total']
+            self._available_stock = total or 0
+        return self._available_stock
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        dirty = self.get_dirty_fields() if not adding else {}
+        super().save(*args, **kwargs)
+        self._snapshot_tracked_fields(kwargs.get('update_fields'))
+
+        # สินค้าใหม่ที่สร้างพร้อม shard_count → สร้าง StockShard จากสต็อกเริ่มต้น (ไม่งั้นจองสต็อกไม่ได้เลย)
+        if adding and self.shard_count:
+            from .inventory import reshard
+            reshard(self, self.shard_count, total=self.stock)
+        # แก้ stock / จำนวน shard ของสินค้าที่แบ่ง shard (เช่นจาก Admin) → กระจายสต็อกลง shard ใหม่
+        elif 'shard_count' in dirty or (self.is_sharded and 'stock' in dirty):
+            from .inventory import reshard
+            reshard(self, self.shard_count, total=self.stock if 'stock' in dirty else None)
+
+        if 'stock' in dirty and dirty['stock'] <= 0 < self.stock:
+            product_restocked.send(sender=Product, products=[self])
+
+    @property
+    def is_deleted(self):
+        return self.deleted_at is not None
+
     def is_in_stock(self):
-        return self.stock > 0
+        return self.available_stock > 0
     is_in_stock.boolean = True
     is_in_stock.short_description = 'มีสินค้า'
 
+class StockShard(models.Model):
+    """ส่วนหนึ่งของสต็อกสินค้าที่เปิดใช้ sharding (ดู shop/inventory.py)"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name="สินค้า")
+    index = models.PositiveSmallIntegerField(verbose_name="ลำดับ shard")
+    count = models.IntegerField(default=0, verbose_name="จำนวนคงเหลือ")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'index'], name='unique_stock_shard'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}#{self.index}: {self.count}"
+
+# ================== Recommendations ==================
+class ProductPairCount(models.Model):
+    """จำนวนคำสั่งซื้อที่มีสินค้าทั้งคู่ (product == other คือจำนวนคำสั่งซื้อของสินค้านั้น) ดู shop/recommendations.py"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+', verbose_name="สินค้า")
+    other = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+', verbose_name="สินค้าที่ซื้อคู่กัน")
+    count = models.PositiveIntegerField(default=0, verbose_name="จำนวนคำสั่งซื้อ")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'other'], name='unique_product_pair'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} + {self.other_id}: {self.count}"
+
+class ProductRecommendation(models.Model):
+    """สินค้าแนะนำ top-K ของแต่ละสินค้า (คำนวณล่วงหน้าด้วยคำสั่ง build_recommendations)"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations', verbose_name="สินค้า")
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+', verbose_name="สินค้าแนะนำ")
+    score = models.FloatField(verbose_name="คะแนน")
+    rank = models.PositiveSmallIntegerField(verbose_name="อันดับ")
+
+    class Meta:
+        ordering = ['product', 'rank']
+        constraints = [
+            # unique (product, rank) เป็น index ที่ product_detail ใช้อ่านด้วย query เดียว
+            models.UniqueConstraint(fields=['product', 'rank'], name='unique_product_recommendation_rank'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} → {self.recommended_id} (#{self.rank})"
+
+class RecommendationWatermark(models.Model):
+    """Order id ล่าสุดที่นับเข้า ProductPairCount แล้ว (มีแถวเดียว)"""
+    last_order_id = models.PositiveIntegerField(default=0, verbose_name="Order ล่าสุดที่ประมวลผล")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Recommendations built up to order #{self.last_order_id}"
+
+# ================== Demand forecast ==================
+class DemandForecast(models.Model):
+    """ยอดขายคาดการณ์ต่อวันและจำนวนวันที่สต็อกพอขาย (คำนวณทุกคืนด้วยคำสั่ง forecast_demand)"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='forecast', verbose_name="สินค้า")
+    moving_average = models.FloatField(default=0, verbose_name="ยอดขายเฉลี่ย/วัน")
+    forecast_daily = models.FloatField(default=0, verbose_name="ยอดขายคาดการณ์/วัน (EWMA)")
+    stock = models.IntegerField(default=0, verbose_name="สต็อกตอนคำนวณ")
+    # null = ไม่มียอดขายในช่วงที่คำนวณ (สต็อกพอขายไม่จำกัด)
+    days_of_cover = models.FloatField(null=True, blank=True, verbose_name="สต็อกพอขาย (วัน)")
+    is_low_stock = models.BooleanField(default=False, verbose_name="ต้องเติมสต็อก")
+    computed_at = models.DateTimeField(verbose_name="คำนวณเมื่อ")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['is_low_stock', 'days_of_cover'], name='forecast_low_stock_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}: {self.forecast_daily:.2f}/วัน"
+
+# ================== Restock notifications ==================
+class RestockSubscription(models.Model):
+    """ผู้ใช้ที่ขอให้แจ้งเตือนผ่าน LINE เมื่อสินค้ากลับมามีสต็อก (ดู shop/restock.py)"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='restock_subscriptions', verbose_name="สินค้า")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="ผู้ใช้งาน")
+    # ค่าว่าง = ผู้ใช้ยังไม่ได้ยืนยันบัญชี LINE (เติมให้ตอนผูกบัญชีสำเร็จ ดู LineAccount)
+    line_user_id = models.CharField(max_length=64, blank=True, verbose_name="LINE user ID")
+    created_at = models.DateTimeField(auto_now_add=True)
+    # null = ยังไม่ได้แจ้ง (รอสินค้าเข้า)
+    notified_at = models.DateTimeField(null=True, blank=True, verbose_name="แจ้งเตือนเมื่อ")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'user'], name='unique_restock_subscription'),
+        ]
+        indexes = [
+            models.Index(fields=['product', 'notified_at', 'id'], name='restock_pending_idx'),
+        ]
+
+    @classmethod
+    def pending(cls):
+        """subscription ที่ยังไม่ได้แจ้ง และผูกบัญชี LINE แล้ว (ส่งได้)"""
+        return cls.objects.filter(notified_at__isnull=True).exclude(line_user_id='')
+
+    def __str__(self):
+        return f"{self.user} → {self.product_id} ({'แจ้งแล้ว' if self.notified_at else 'รอ'})"
+
+class LineAccount(models.Model):
+    """บัญชี LINE ของผู้ใช้ ผูกเมื่อผู้ใช้ส่งรหัสยืนยันหา LINE bot ของร้าน (ได้ user ID จาก webhook ไม่ใช่จากที่ผู้ใช้พิมพ์)"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='line_account', verbose_name="ผู้ใช้งาน")
+    # ค่าว่าง = ยังไม่ได้ยืนยัน หรือผู้ใช้ block/unfollow bot ไปแล้ว
+    line_user_id = models.CharField(max_length=64, blank=True, db_index=True, verbose_name="LINE user ID")
+    link_code = models.CharField(max_length=16, null=True, blank=True, unique=True, verbose_name="รหัสยืนยัน")
+    link_code_created_at = models.DateTimeField(null=True, blank=True)
+    linked_at = models.DateTimeField(null=True, blank=True, verbose_name="ยืนยันเมื่อ")
+
+    def __str__(self):
+        return f"{self.user} ({'ยืนยันแล้ว' if self.line_user_id else 'ยังไม่ยืนยัน'})"
+
 # ================== Cart ==================
 class Cart(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, verbose_name="ผู้ใช้งาน")
@@ -30,22 +279,57 @@ class Cart(models.Model):
 
     @property
     def total_price(self):
-        total = self.cartitem_set.aggregate(sum_price=Sum(F('quantity') * F('product__price')))['sum_price']
-        return total if total is not None else 0.00
-    
+        # ราคาจาก catalog snapshot เหมือน get_items (ยอดของ Order จริงคำนวณจากราคาใน DB ตอน checkout)
+        return sum((item.subtotal() for item in self.get_items()), Decimal('0.00'))
+
     @property
     def total_items(self):
         total = self.cartitem_set.aggregate(total_qty=Sum('quantity'))['total_qty']
         return total if total is not None else 0
 
+    def get_items(self):
+        # 💡 query แค่ CartItem ส่วนชื่อ/ราคา/สต็อกอ่านจาก catalog snapshot (ไม่ join Product)
+        from .cart import snapshot_lines
+        return snapshot_lines(self.cartitem_set.order_by('id').values_list('id', 'product_id', 'quantity'))
+
+    def get_quantity(self, product_id):
+        return self.cartitem_set.filter(product_id=product_id).values_list('quantity', flat=True).first() or 0
+
+    def set_quantity(self, product, quantity):
+        CartItem.objects.update_or_create(cart=self, product=product, defaults={'quantity': quantity})
+
+    def remove(self, item_id):
+        """ลบ CartItem item_id ของตะกร้านี้ คืน CartLine ที่ถูกลบ (None ถ้าไม่มีในตะกร้านี้)"""
+        from .cart import snapshot_lines
+        items = self.cartitem_set.filter(pk=item_id)
+        lines = snapshot_lines(items.values_list('id', 'product_id', 'quantity'))
+        items.delete()
+        return lines[0] if lines else None
+
     def __str__(self):
         return f"Cart of {self.user.username}"
 
+class CartItemManager(models.Manager):
+    """ซ่อนรายการของสินค้าที่ถูก soft delete (รอ purge_deleted_products ลบจริง) ใช้กับ cart.cartitem_set ด้วย"""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(product__deleted_at__isnull=True)
+
+
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, verbose_name="ตะกร้าสินค้า")
     product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name="สินค้า")
     quantity = models.IntegerField(default=1, verbose_name="จำนวน")
 
+    objects = CartItemManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        constraints = [
+            # ใช้เป็น conflict target ตอนรวมตะกร้า guest (bulk upsert)
+            models.UniqueConstraint(fields=['cart', 'product'], name='unique_cart_product'),
+        ]
+
     def subtotal(self):
         if self.product and self.product.price:
             return self.quantity * self.product.price
@@ -55,7 +339,7 @@ class CartItem(models.Model):
         return f"{self.quantity} x {self.product.name} in Cart {self.cart.user.username}"
 
 # ================== Order ==================
-class Order(models.Model):
+class Order(TrackedFieldsMixin, models.Model):
     STATUS_CHOICES = [
         ('PENDING', 'รอชำระเงิน'),
         ('CONFIRMED', 'ยืนยันแล้ว'), # ยืนยันเมื่อชำระเงินสำเร็จ
@@ -72,12 +356,59 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # 💡 ส่งออกยอดขายตามช่วงวันที่ (exports.py) หา id แรก/สุดท้ายของช่วงจาก index นี้
+            models.Index(fields=['created_at', 'id'], name='order_created_idx'),
+        ]
+
     def __str__(self):
         return f"Order {self.id} by {self.user.username}"
 
-    # **[NEW]** Override save method to ensure updated_at is set properly on status change
+    # 💡 State machine: สถานะที่เปลี่ยนไปได้จากแต่ละสถานะ
+    TRANSITIONS = {
+        'PENDING': ('CONFIRMED', 'CANCELLED'),
+        'CONFIRMED': ('SHIPPED', 'CANCELLED'),
+        'SHIPPED': ('DELIVERED', 'CANCELLED'),
+        'DELIVERED': (),
+        'CANCELLED': (),
+    }
+    tracked_fields = ('status', 'tracking_number')
+
+    @classmethod
+    def can_transition(cls, old_status, new_status):
+        return old_status == new_status or new_status in cls.TRANSITIONS.get(old_status, ())
+
+    def _loaded_status(self):
+        """สถานะล่าสุดที่รู้ว่าอยู่ใน DB (None ถ้าเป็น Order ใหม่)"""
+        if self._state.adding:
+            return None
+        if 'status' in getattr(self, '_loaded_values', {}):
+            return self._loaded_values['status']
+        # instance ที่ไม่ได้โหลดผ่าน from_db (เช่นสร้างเองพร้อม pk) ต้องอ่านจาก DB
+        return Order.objects.filter(pk=self.pk).values_list('status', flat=True).first()
+
+    def clean(self):
+        super().clean()
+        old_status = self._loaded_status()
+        if old_status is not None and not self.can_transition(old_status, self.status):
+            raise ValidationError({'status': f'ไม่สามารถเปลี่ยนสถานะจาก {old_status} เป็น {self.status} ได้'})
+
+    # **[NEW]** Override save method เพื่อตรวจสอบ transition และส่ง hook เมื่อสถานะเปลี่ยนจริงเท่านั้น
     def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        saves_status = update_fields is None or 'status' in update_fields
+        old_status = self._loaded_status() if saves_status else None
+        status_changed = old_status is not None and old_status != self.status
+
+        if status_changed and not self.can_transition(old_status, self.status):
+            raise ValidationError(f'ไม่สามารถเปลี่ยนสถานะ Order #{self.pk} จาก {old_status} เป็น {self.status} ได้')
+
         super().save(*args, **kwargs)
+        self._snapshot_tracked_fields(update_fields)
+
+        if status_changed:
+            order_status_changed.send(sender=Order, transitions=[(self, old_status, self.status)])
 
 
 class OrderItem(models.Model):
@@ -96,7 +427,7 @@ class OrderItem(models.Model):
         return f"{self.quantity} x {self.product.name if self.product else 'Deleted Product'} in Order {self.order.id}"
 
 # ================== Payment ==================
-class Payment(models.Model):
+class Payment(TrackedFieldsMixin, models.Model):
     order = models.OneToOneField(Order, on_delete=models.CASCADE, verbose_name="คำสั่งซื้อ")
     payment_method = models.CharField(max_length=50, verbose_name="วิธีการชำระเงิน")
     transaction_id = models.CharField(max_length=100, unique=True, default=uuid.uuid4, verbose_name="รหัสธุรกรรม")
@@ -104,48 +435,51 @@ class Payment(models.Model):
     amount_paid = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="ยอดเงินที่ชำระ", default=0.00)
     paid_at = models.DateTimeField(auto_now_add=True, verbose_name="วันเวลาที่ชำระ")
 
+    tracked_fields = ('is_successful',)
+
     def __str__(self):
         return f"Payment for Order {self.order.id} ({'Successful' if self.is_successful else 'Failed'})"
 
     def save(self, *args, **kwargs):
         """
-        Override save method เพื่อ:
-        1. อัปเดตสถานะ Order เป็น CONFIRMED เมื่อชำระเงินสำเร็จ
-        2. ตัดสต็อกสินค้าอัตโนมัติ
+        Override save method เพื่ออัปเดตสถานะ Order เป็น CONFIRMED เมื่อชำระเงินสำเร็จ
+        (การตัดสต็อกทำใน hook ของ order_status_changed ดู signals.py)
         """
-        # เช็กว่าเป็นการอัปเดตหรือสร้างใหม่
-        is_new = self.pk is None
-        old_is_successful = False
-        
-        if not is_new:
-            try:
-                old_payment = Payment.objects.get(pk=self.pk)
-                old_is_successful = old_payment.is_successful
-            except Payment.DoesNotExist:
-                pass
-        
+        # ค่าเดิมของ is_successful มาจากตอนโหลด ไม่ต้อง SELECT ซ้ำ
+        old_is_successful = self.get_loaded_value('is_successful', False)
+
         # บันทึก Payment
         super().save(*args, **kwargs)
+        self._snapshot_tracked_fields(kwargs.get('update_fields'))
 
         # ✅ ถ้าชำระเงินสำเร็จ (เปลี่ยนจาก False → True)
         if self.is_successful and not old_is_successful:
-            # 1. อัปเดตสถานะ Order
+            logger.info('payment succeeded', extra={
+                'event': 'payment.succeeded', 'order_id': self.order_id, 'payment_id': self.pk,
+            })
             if self.order.status == 'PENDING':
                 self.order.status = 'CONFIRMED'
                 self.order.save(update_fields=['status', 'updated_at'])
-            
-            # 2. ตัดสต็อกสินค้าทุกรายการใน Order
-            order_items = self.order.items.select_related('product').all()
-            
-            for item in order_items:
-                if item.product:  # ตรวจสอบว่าสินค้ายังมีอยู่
-                    product = item.product
-                    
-                    # ตรวจสอบสต็อกก่อนตัด
-                    if product.stock >= item.quantity:
-                        product.stock -= item.quantity
-                        product.save(update_fields=['stock'])
-                        print(f"✅ ตัดสต็อก: {product.name} จำนวน {item.quantity} (เหลือ {product.stock})")
-                    else:
-                        # กรณีสต็อกไม่พอ (ไม่ควรเกิดถ้า checkout ตรวจสอบดีแล้ว)
-                        print(f"⚠️ WARNING: สต็อกไม่พอสำหรับ {product.name} (มี {product.stock}, ต้องการ {item.quantity})")
+
+# ================== Idempotency ==================
+class IdempotencyRecord(models.Model):
+    """ผลลัพธ์ของ POST ที่มี idempotency key (ส่งซ้ำด้วย key เดิม = ได้ผลเดิมโดยไม่ทำซ้ำ) ดู shop/idempotency.py"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', verbose_name="ผู้ใช้งาน")
+    key = models.CharField(max_length=64, verbose_name="Idempotency key")
+    endpoint = models.CharField(max_length=100, verbose_name="URL name")
+    request_hash = models.CharField(max_length=64, verbose_name="hash ของ request")
+    # ว่าง = request แรกยังทำงานอยู่
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="HTTP status")
+    location = models.CharField(max_length=500, blank=True, default='', verbose_name="Redirect URL")
+    content_type = models.CharField(max_length=100, blank=True, default='')
+    body = models.BinaryField(blank=True, default=b'')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.endpoint} {self.key} ({self.status_code or 'processing'})"
@@ -0,0 +1,89 @@
+# shop/order_cache.py
+
+import logging
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 💡 Render cache ของหน้าคำสั่งซื้อ (ลูกค้าเปิดดูออเดอร์เก่าซ้ำบ่อยมาก)
+# - order_detail: HTML ส่วนเนื้อหา (order_detail_body.html) ของออเดอร์ที่จบแล้ว (DELIVERED / CANCELLED)
+#   เก็บต่อ order id พร้อม user id เจ้าของและสถานะ เปิดซ้ำ = อ่าน cache อย่างเดียว ไม่ query Order / OrderItem
+#   payment_process ของออเดอร์ที่จบแล้วก็ redirect ได้จาก cache เลย
+# - my_orders: HTML รายการคำสั่งซื้อทั้งหมดของผู้ใช้ (my_orders_summary.html) เก็บต่อ user id
+# - ลบ cache หลัง commit เมื่อออเดอร์ / รายการสินค้าในออเดอร์ถูกแก้ (signals.py, fulfilment.bulk_transition)
+#   ซึ่งสำหรับออเดอร์ที่จบแล้วเกิดแค่ตอน staff แก้ใน Admin
+# ใช้ cache 'shared' (ทุก worker เห็นร่วมกัน) การลบจาก worker หนึ่งจึงมีผลกับทุก worker
+# ----------------------------------------------------------------------
+
+DEFAULTS = {
+    'CACHE_ALIAS': 'shared',
+    'DETAIL_TIMEOUT': 7 * 24 * 60 * 60,
+    'SUMMARY_TIMEOUT': 60 * 60,
+}
+
+FINAL_STATUSES = ('DELIVERED', 'CANCELLED')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'ORDER_RENDER_CACHE', {})}
+
+
+def _cache(config):
+    return caches[config['CACHE_ALIAS']]
+
+
+def detail_key(order_id):
+    return f'order:detail:{order_id}'
+
+
+def summary_key(user_id):
+    return f'order:summary:{user_id}'
+
+
+def get_detail(order_id, user_id, config=None):
+    """คืน {'user_id', 'status', 'html'} ของออเดอร์ที่จบแล้วใน cache (เฉพาะของผู้ใช้คนนี้) หรือ None"""
+    entry = _cache(config or get_config()).get(detail_key(order_id))
+    if entry is None or entry['user_id'] != user_id:
+        return None
+    return entry
+
+
+def set_detail(order, html, config=None):
+    if order.status not in FINAL_STATUSES:
+        return
+    config = config or get_config()
+    entry = {'user_id': order.user_id, 'status': order.status, 'html': str(html)}
+    _cache(config).set(detail_key(order.pk), entry, timeout=config['DETAIL_TIMEOUT'])
+
+
+def get_summary(user_id, config=None):
+    return _cache(config or get_config()).get(summary_key(user_id))
+
+
+def set_summary(user_id, html, config=None):
+    config = config or get_config()
+    _cache(config).set(summary_key(user_id), str(html), timeout=config['SUMMARY_TIMEOUT'])
+
+
+def invalidate(pairs, config=None):
+    """pairs: [(order_id, user_id), ...] ลบ cache ของออเดอร์และรายการของเจ้าของหลัง commit"""
+    config = config or get_config()
+    keys = set()
+    for order_id, user_id in pairs:
+        keys.add(detail_key(order_id))
+        keys.add(summary_key(user_id))
+    if not keys:
+        return
+
+    def delete():
+        _cache(config).delete_many(sorted(keys))
+        logger.info('order render cache invalidated', extra={'event': 'order_cache.invalidated', 'keys': len(keys)})
+    transaction.on_commit(delete)
+
+
+def invalidate_orders(orders, config=None):
+    invalidate([(order.pk, order.user_id) for order in orders], config)
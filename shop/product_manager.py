@@ -0,0 +1,182 @@
+# shop/product_manager.py
+
+import logging
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Q
+
+from . import catalog
+from .inventory import available_stock_expression, reshard
+from .models import Product, product_restocked
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 💡 หน้าจัดการสินค้าของ staff (รองรับ catalog หลักหมื่น SKU)
+# - กรอง/เรียง/แบ่งหน้าที่ฝั่ง DB และดึงเฉพาะคอลัมน์ที่แสดงด้วย values() (ไม่โหลด description / instance ทั้งหมด)
+# - การเรียงทุกแบบมี id ต่อท้ายให้ลำดับคงที่ข้ามหน้า / newest ใช้ -id (primary key) แทน -created_at
+# - แก้สต็อก/ราคาแบบ inline แล้วส่งมาเป็น batch เดียว: ล็อกแถวครั้งเดียว bulk_update ครั้งเดียว
+#   แล้วทำสิ่งที่ Product.save ทำให้เอง (reshard, product_restocked, bump catalog version)
+# - สต็อกที่แสดง/กรอง/เรียง และใช้ตรวจว่ากลับมามีสต็อก คือสต็อกที่ขายได้จริง (available)
+#   สินค้าที่แบ่ง shard ใช้ผลรวมของ shard เพราะ Product.stock อัปเดตแค่ตอน reshard
+# ----------------------------------------------------------------------
+
+PAGE_SIZES = (50, 100, 200)
+MAX_BATCH = 500
+LIST_FIELDS = ('id', 'name', 'price', 'available', 'shard_count', 'is_active', 'image')
+
+SORTS = {
+    'newest': ('-id',),
+    'name': ('name', 'id'),
+    'price_asc': ('price', 'id'),
+    'price_desc': ('-price', '-id'),
+    'stock_asc': ('available', 'id'),
+    'stock_desc': ('-available', '-id'),
+}
+SORT_LABELS = {
+    'newest': 'ใหม่ล่าสุด',
+    'name': 'ชื่อ A-Z',
+    'price_asc': 'ราคาต่ำ-สูง',
+    'price_desc': 'ราคาสูง-ต่ำ',
+    'stock_asc': 'สต็อกน้อย-มาก',
+    'stock_desc': 'สต็อกมาก-น้อย',
+}
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ManagerFilters(namedtuple('ManagerFilters', 'q active stock_min stock_max sort per_page')):
+    """ตัวกรองของหน้าจัดการสินค้า (อ่านจาก query string ค่าที่ไม่ถูกต้องจะถูกละไว้)"""
+    __slots__ = ()
+
+    @classmethod
+    def from_query(cls, params):
+        active = params.get('active', '')
+        sort = params.get('sort', 'newest')
+        per_page = _int_or_none(params.get('per_page'))
+        return cls(
+            q=params.get('q', '').strip(),
+            active=active if active in ('1', '0') else '',
+            stock_min=_int_or_none(params.get('stock_min')),
+            stock_max=_int_or_none(params.get('stock_max')),
+            sort=sort if sort in SORTS else 'newest',
+            per_page=per_page if per_page in PAGE_SIZES else PAGE_SIZES[0],
+        )
+
+    def queryset(self):
+        condition = Q()
+        if self.q:
+            # ค้นด้วยรหัสสินค้าได้ด้วย
+            name_match = Q(name__icontains=self.q)
+            condition &= name_match | Q(pk=int(self.q)) if self.q.isdigit() else name_match
+        if self.active:
+            condition &= Q(is_active=self.active == '1')
+        if self.stock_min is not None:
+            condition &= Q(available__gte=self.stock_min)
+        if self.stock_max is not None:
+            condition &= Q(available__lte=self.stock_max)
+        return (
+            Product.objects.annotate(available=available_stock_expression())
+            .filter(condition).order_by(*SORTS[self.sort]).values(*LIST_FIELDS)
+        )
+
+
+# ================== Inline edits ==================
+EditResult = namedtuple('EditResult', 'product_id ok message')
+
+
+def _parse_change(change):
+    """คืน (product_id, {field: value}) หรือ raise ValueError พร้อมข้อความ"""
+    if not isinstance(change, dict) or _int_or_none(change.get('id')) is None:
+        raise ValueError('ไม่มีรหัสสินค้า')
+    values = {}
+    if 'stock' in change:
+        stock = _int_or_none(change['stock'])
+        if stock is None or stock < 0:
+            raise ValueError('สต็อกต้องเป็นจำนวนเต็มไม่ติดลบ')
+        values['stock'] = stock
+    if 'price' in change:
+        try:
+            price = Decimal(str(change['price'])).quantize(Decimal('0.01'))
+        except (InvalidOperation, ValueError):
+            raise ValueError('ราคาไม่ถูกต้อง')
+        if price < 0 or price >= Decimal('1e8'):
+            raise ValueError('ราคาไม่ถูกต้อง')
+        values['price'] = price
+    if not values:
+        raise ValueError('ไม่มีข้อมูลที่ต้องแก้ไข')
+    return int(change['id']), values
+
+
+def apply_edits(changes):
+    """
+    บันทึกการแก้สต็อก/ราคาหลายสินค้าพร้อมกัน
+
+    - changes: list ของ dict {"id": 1, "stock": 10, "price": "590.00"} (ระบุเฉพาะ field ที่แก้)
+    - ล็อกแถวด้วย select_for_update แล้ว bulk_update ในคำสั่งเดียว
+    - สินค้าที่แบ่ง shard จะกระจายสต็อกใหม่ลง shard (เหมือนแก้จาก Admin)
+    - สินค้าที่สต็อกที่ขายได้เปลี่ยนจาก 0 → มากกว่า 0 จะส่ง product_restocked (แจ้งเตือนผู้ติดตาม)
+
+    คืนค่า list ของ EditResult เรียงตาม changes ที่ส่งเข้ามา
+    """
+    results = []
+    parsed = {}
+    for change in changes:
+        try:
+            product_id, values = _parse_change(change)
+        except ValueError as e:
+            results.append(EditResult(change.get('id') if isinstance(change, dict) else None, False, str(e)))
+            continue
+        # id ซ้ำใน batch เดียวกัน: ใช้ค่าหลังสุด
+        parsed.setdefault(product_id, {}).update(values)
+        results.append(EditResult(product_id, True, ''))
+
+    restocked = []
+    with transaction.atomic():
+        products = (
+            Product.objects.select_for_update().only('id', 'stock', 'price', 'shard_count')
+            .annotate(available=available_stock_expression()).in_bulk(list(parsed))
+        )
+        changed, sharded = [], []
+        for product_id, values in parsed.items():
+            product = products.get(product_id)
+            if product is None:
+                continue
+            # สินค้าที่แบ่ง shard: Product.stock อาจยังเป็นค่าเก่าแม้ shard ขายหมดแล้ว → ใช้ผลรวม shard
+            old_stock = product.available
+            for field, value in values.items():
+                setattr(product, field, value)
+            changed.append(product)
+            if 'stock' in values:
+                if product.is_sharded:
+                    sharded.append(product)
+                if old_stock <= 0 < product.stock:
+                    restocked.append(product)
+
+        Product.objects.bulk_update(changed, ['stock', 'price'], batch_size=MAX_BATCH)
+        for product in sharded:
+            reshard(product, product.shard_count, total=product.stock)
+
+        # bulk_update ไม่ผ่าน Product.save → ส่ง signal / invalidate catalog เอง
+        if restocked:
+            product_restocked.send(sender=Product, products=restocked)
+        if changed:
+            catalog.bump_version_on_commit()
+
+    missing = {product_id for product_id in parsed if product_id not in products}
+    results = [
+        EditResult(row.product_id, False, 'ไม่พบสินค้า') if row.ok and row.product_id in missing else row
+        for row in results
+    ]
+    logger.info('products edited inline', extra={
+        'event': 'products.bulk_edited', 'updated': len(changed), 'restocked': len(restocked),
+        'failed': sum(1 for row in results if not row.ok),
+    })
+    return results
@@ -0,0 +1,183 @@
+# shop/profiling.py
+
+import cProfile
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 💡 Profiling ราย request (เปิดใช้เฉพาะเมื่อสั่ง)
+# - staff เพิ่ม ?__profile=sample (หรือ =cprofile) ท้าย URL หรือส่ง header X-Profile: <signed token>
+#   (token จากหน้า manage/profiles ใช้กับ curl / load test ได้โดยไม่ต้องล็อกอิน)
+# - SAMPLE_RATE > 0 จะสุ่ม profile request ทั่วไปแบบ sampling เองโดยไม่ต้องสั่ง
+# - sample: thread แยกเก็บ stack ของ request thread ทุก INTERVAL วินาที → ไฟล์ .collapsed
+#   (เปิดด้วย speedscope.app หรือ flamegraph.pl ได้)
+#   cprofile: cProfile ทั้ง request → ไฟล์ .prof (เปิดด้วย snakeviz / pstats)
+# - ปิดไว้เป็นค่าเริ่มต้น: ENABLED=False middleware จะถูกถอดออกตั้งแต่ตอน start (MiddlewareNotUsed) ไม่มีต้นทุนเลย
+# ----------------------------------------------------------------------
+
+DEFAULTS = {
+    'ENABLED': False,
+    'DIRECTORY': None,
+    'SAMPLE_RATE': 0.0,
+    'INTERVAL': 0.005,
+    'MAX_FILES': 200,
+    'TOKEN_MAX_AGE': 60 * 60,
+}
+
+QUERY_FLAG = '__profile'
+HEADER = 'HTTP_X_PROFILE'
+MODES = ('sample', 'cprofile')
+_SIGNING_SALT = 'shop.profiling'
+_FILENAME_RE = re.compile(r'^[\w.-]+\.(collapsed|prof)$')
+
+
+def get_config():
+    config = {**DEFAULTS, **getattr(settings, 'REQUEST_PROFILING', {})}
+    config['DIRECTORY'] = config['DIRECTORY'] or os.path.join(tempfile.gettempdir(), 'arttoy-profiles')
+    return config
+
+
+def make_token(mode='sample'):
+    """token สำหรับ header X-Profile (หมดอายุตาม TOKEN_MAX_AGE)"""
+    return signing.TimestampSigner(salt=_SIGNING_SALT).sign(mode)
+
+
+def _mode_from_token(token, max_age):
+    try:
+        mode = signing.TimestampSigner(salt=_SIGNING_SALT).unsign(token, max_age=max_age)
+    except signing.BadSignature:
+        return None
+    return mode if mode in MODES else None
+
+
+class StackSampler:
+    """เก็บ stack ของ thread หนึ่งเป็นระยะ แล้วนับแบบ collapsed stack (frame;frame;frame count)"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_qualname} ({os.path.basename(code.co_filename)})')
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.counts.most_common())
+
+
+def list_profiles(directory=None):
+    """ไฟล์ profile ทั้งหมด เรียงจากใหม่ไปเก่า"""
+    directory = directory or get_config()['DIRECTORY']
+    try:
+        entries = [entry for entry in os.scandir(directory) if _FILENAME_RE.match(entry.name)]
+    except FileNotFoundError:
+        return []
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    return [
+        {'name': entry.name, 'size': entry.stat().st_size, 'modified': entry.stat().st_mtime}
+        for entry in entries
+    ]
+
+
+def profile_path(name, directory=None):
+    """path ของไฟล์ profile จากชื่อ (None ถ้าชื่อไม่ถูกต้อง)"""
+    if not _FILENAME_RE.match(name):
+        return None
+    return os.path.join(directory or get_config()['DIRECTORY'], name)
+
+
+class ProfilingMiddleware:
+    """ต้องอยู่หลัง AuthenticationMiddleware (ตรวจ request.user.is_staff สำหรับ query flag)"""
+
+    def __init__(self, get_response):
+        self.config = get_config()
+        if not self.config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def _requested_mode(self, request):
+        flag = request.GET.get(QUERY_FLAG)
+        if flag is not None and request.user.is_staff:
+            return flag if flag in MODES else 'sample'
+        token = request.META.get(HEADER)
+        if token:
+            return _mode_from_token(token, self.config['TOKEN_MAX_AGE'])
+        if self.config['SAMPLE_RATE'] and random.random() < self.config['SAMPLE_RATE']:
+            return 'sample'
+        return None
+
+    def __call__(self, request):
+        mode = self._requested_mode(request)
+        if mode is None:
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        if mode == 'cprofile':
+            profiler = cProfile.Profile()
+            response = profiler.runcall(self.get_response, request)
+        else:
+            with StackSampler(threading.get_ident(), self.config['INTERVAL']) as sampler:
+                response = self.get_response(request)
+        duration_ms = (time.perf_counter() - started) * 1000
+
+        match = getattr(request, 'resolver_match', None)
+        label = re.sub(r'[^\w-]+', '-', match.view_name if match else request.path).strip('-') or 'root'
+        name = f"{timezone.now():%Y%m%d-%H%M%S}-{label}-{duration_ms:.0f}ms-{getattr(request, 'request_id', '')[:8] or os.getpid()}"
+        try:
+            os.makedirs(self.config['DIRECTORY'], exist_ok=True)
+            if mode == 'cprofile':
+                name += '.prof'
+                profiler.dump_stats(os.path.join(self.config['DIRECTORY'], name))
+            else:
+                name += '.collapsed'
+                with open(os.path.join(self.config['DIRECTORY'], name), 'w', encoding='utf-8') as f:
+                    f.write(sampler.collapsed())
+            self._prune()
+        except OSError:
+            logger.exception('failed to write profile', extra={'event': 'profiling.write_failed', 'path': request.path})
+            return response
+
+        logger.info('request profiled', extra={
+            'event': 'profiling.captured', 'mode': mode, 'file': name, 'path': request.path, 'duration_ms': round(duration_ms, 2),
+        })
+        response['X-Profile-File'] = name
+        return response
+
+    def _prune(self):
+        for profile in list_profiles(self.config['DIRECTORY'])[self.config['MAX_FILES']:]:
+            try:
+                os.remove(os.path.join(self.config['DIRECTORY'], profile['name']))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,64 @@
+# shop/purge.py
+
+import logging
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import CartItem, Product, RestockSubscription
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 💡 เก็บกวาดข้อมูลที่อ้างถึงสินค้าที่ถูก soft delete (รันจาก cron ด้วย purge_deleted_products)
+# การลบสินค้าในหน้าเว็บเป็นแค่ UPDATE แถวเดียว ส่วน CartItem (อาจมีหลายหมื่นแถวสำหรับสินค้าดัง)
+# และการแจ้งเตือนสินค้าเข้าที่ยังไม่ได้ส่ง ถูกลบที่นี่ทีละ BATCH_SIZE แถว ชุดละ transaction สั้นๆ
+# เว้น PAUSE วินาทีระหว่างชุดให้ request อื่นได้เขียน DB (SQLite ล็อกทั้งไฟล์ตอนเขียน)
+# OrderItem ไม่ถูกแตะเลย ประวัติคำสั่งซื้อยังผูกกับสินค้าเดิม
+# ----------------------------------------------------------------------
+
+DEFAULTS = {
+    'BATCH_SIZE': 500,
+    'PAUSE': 0.05,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'PRODUCT_PURGE', {})}
+
+
+def _delete_in_batches(queryset, batch_size, pause):
+    deleted = batches = 0
+    while True:
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted, batches
+        with transaction.atomic():
+            deleted += queryset.model._base_manager.filter(pk__in=ids).delete()[0]
+        batches += 1
+        if pause and len(ids) == batch_size:
+            time.sleep(pause)
+
+
+def purge_deleted_products(config=None):
+    """ลบ CartItem / RestockSubscription ที่ค้างของสินค้าที่ถูกลบ คืน dict สรุปผล"""
+    config = config or get_config()
+    started = time.perf_counter()
+    deleted_products = Product.all_objects.filter(deleted_at__isnull=False).values('pk')
+
+    cart_items, cart_batches = _delete_in_batches(
+        CartItem.all_objects.filter(product__in=deleted_products), config['BATCH_SIZE'], config['PAUSE'],
+    )
+    subscriptions, subscription_batches = _delete_in_batches(
+        RestockSubscription.objects.filter(product__in=deleted_products, notified_at__isnull=True),
+        config['BATCH_SIZE'], config['PAUSE'],
+    )
+
+    stats = {
+        'cart_items': cart_items, 'subscriptions': subscriptions,
+        'batches': cart_batches + subscription_batches,
+        'duration_ms': round((time.perf_counter() - started) * 1000, 2),
+    }
+    logger.info('deleted products purged', extra={'event': 'product.purged', **stats})
+    return stats
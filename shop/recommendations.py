@@ -0,0 +1,169 @@
+# shop/recommendations.py
+
+import logging
+import time
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Max
+from django.utils import timezone
+
+from .models import Order, OrderItem, ProductPairCount, ProductRecommendation, RecommendationWatermark
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 💡 "ลูกค้าที่ซื้อสินค้านี้ ยังซื้อ..." (co-purchase)
+# - นับจำนวนคำสั่งซื้อที่มีสินค้าแต่ละคู่ด้วย sparse matrix (orders × products)ᵀ · (orders × products)
+# - เก็บยอดสะสมไว้ใน ProductPairCount แล้วคำนวณ top-K ใหม่เฉพาะสินค้าที่มีคำสั่งซื้อใหม่
+#   และสินค้าที่เคยซื้อคู่กับสินค้าเหล่านั้น (คะแนนของคู่ขึ้นกับยอดสั่งซื้อของทั้งสองฝั่ง)
+# - คะแนน = cosine: ซื้อคู่กัน / √(ยอดสั่งซื้อ A × ยอดสั่งซื้อ B) เพื่อไม่ให้สินค้าขายดีขึ้นทุกหน้า
+# ทั้งหมดทำในคำสั่ง build_recommendations เท่านั้น หน้าเว็บแค่อ่านตาราง ProductRecommendation
+# (numpy/scipy ถูก import ตอนใช้งาน เพื่อไม่ให้ web worker ต้องโหลด)
+# ----------------------------------------------------------------------
+
+TOP_K = 8
+CHUNK_SIZE = 10000
+# สถานะที่ถือว่าซื้อจริง
+COUNTED_STATUSES = ('CONFIRMED', 'SHIPPED', 'DELIVERED')
+# Order ที่ยัง PENDING ภายในช่วงนี้อาจถูกชำระภายหลัง จึงหยุด watermark ไว้ก่อนถึง Order นั้น
+PENDING_GRACE = timedelta(days=1)
+
+
+def _settled_upto(start):
+    """Order id สูงสุดที่ทุก Order ก่อนหน้าได้ข้อสรุปแล้ว (ชำระ/ยกเลิก/ค้างนานเกิน PENDING_GRACE)"""
+    oldest_open = (
+        Order.objects.filter(pk__gt=start, status='PENDING', created_at__gte=timezone.now() - PENDING_GRACE)
+        .order_by('pk').values_list('pk', flat=True).first()
+    )
+    if oldest_open is not None:
+        return oldest_open - 1
+    return Order.objects.filter(pk__gt=start).aggregate(last=Max('pk'))['last'] or start
+
+
+def co_occurrence(order_ids, product_ids):
+    """
+    รับคู่ (order_id, product_id) แล้วคืน (product_a, product_b, จำนวนคำสั่งซื้อ) เป็น numpy array
+    รวมแนวทแยง (a == b) ซึ่งคือจำนวนคำสั่งซื้อของสินค้านั้น
+    """
+    import numpy as np
+    from scipy import sparse
+
+    _, order_index = np.unique(order_ids, return_inverse=True)
+    products, product_index = np.unique(product_ids, return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(order_index), dtype=np.int32), (order_index, product_index)),
+        shape=(order_index.max() + 1, len(products)),
+    )
+    # สินค้าเดียวกันหลายแถวใน Order เดียวนับเป็น 1
+    matrix.data[:] = 1
+    pairs = (matrix.T @ matrix).tocoo()
+    return products[pairs.row], products[pairs.col], pairs.data
+
+
+def _add_pair_counts(product_a, product_b, counts):
+    touched = set(product_a.tolist())
+    existing = {
+        (a, b): count for a, b, count in ProductPairCount.objects.filter(
+            product_id__in=touched, other_id__in=touched,
+        ).values_list('product_id', 'other_id', 'count')
+    }
+    ProductPairCount.objects.bulk_create(
+        [
+            ProductPairCount(product_id=a, other_id=b, count=existing.get((a, b), 0) + count)
+            for a, b, count in zip(product_a.tolist(), product_b.tolist(), counts.tolist())
+        ],
+        update_conflicts=True, unique_fields=['product', 'other'], update_fields=['count'], batch_size=1000,
+    )
+    return touched
+
+
+def rebuild_top_k(product_ids, top_k=TOP_K):
+    """คำนวณ ProductRecommendation ของสินค้าใน product_ids ใหม่จาก ProductPairCount"""
+    import numpy as np
+
+    rows = list(ProductPairCount.objects.filter(product_id__in=product_ids).values_list('product_id', 'other_id', 'count'))
+    recommendations = []
+    if rows:
+        product, other, count = (np.array(column) for column in zip(*rows))
+        ids = np.unique(np.concatenate([product, other]))
+        freq = np.zeros(len(ids))
+        freq_rows = ProductPairCount.objects.filter(product_id=F('other_id'), product_id__in=ids.tolist()).values_list('product_id', 'count')
+        for pk, total in freq_rows:
+            freq[np.searchsorted(ids, pk)] = total
+
+        mask = product != other
+        product, other, count = product[mask], other[mask], count[mask]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            score = count / np.sqrt(freq[np.searchsorted(ids, product)] * freq[np.searchsorted(ids, other)])
+        score = np.nan_to_num(score)
+
+        # เรียงตาม product แล้วคะแนนมาก→น้อย จากนั้นอันดับ = ตำแหน่งภายในกลุ่มของ product
+        order = np.lexsort((other, -count, -score, product))
+        product, other, score = product[order], other[order], score[order]
+        rank = np.arange(len(product)) - np.searchsorted(product, product, side='left')
+        keep = rank < top_k
+        recommendations = [
+            ProductRecommendation(product_id=a, recommended_id=b, score=s, rank=r)
+            for a, b, s, r in zip(product[keep].tolist(), other[keep].tolist(), score[keep].tolist(), rank[keep].tolist())
+        ]
+
+    ProductRecommendation.objects.filter(product_id__in=product_ids).delete()
+    ProductRecommendation.objects.bulk_create(recommendations, batch_size=1000)
+    return len(recommendations)
+
+
+def build(full=False, chunk_size=CHUNK_SIZE, top_k=TOP_K):
+    """
+    นับ Order ใหม่ตั้งแต่ watermark ล่าสุดเข้า ProductPairCount ทีละช่วง chunk_size แล้วคำนวณ top-K
+    ของสินค้าที่ได้รับผลกระทบ (full=True เริ่มใหม่ทั้งหมด) คืน dict สรุปผล
+    """
+    import numpy as np
+
+    started = time.perf_counter()
+    if full:
+        with transaction.atomic():
+            ProductPairCount.objects.all().delete()
+            ProductRecommendation.objects.all().delete()
+            RecommendationWatermark.objects.update_or_create(pk=1, defaults={'last_order_id': 0})
+
+    watermark = RecommendationWatermark.objects.get_or_create(pk=1)[0]
+    end = _settled_upto(watermark.last_order_id)
+    stats = {'from_order': watermark.last_order_id, 'to_order': end, 'order_items': 0, 'products': 0, 'recommendations': 0}
+
+    low = watermark.last_order_id
+    while low < end:
+        high = min(low + chunk_size, end)
+        rows = list(
+            OrderItem.objects.filter(
+                order_id__gt=low, order_id__lte=high, order__status__in=COUNTED_STATUSES, product__isnull=False,
+            ).values_list('order_id', 'product_id')
+        )
+        with transaction.atomic():
+            if rows:
+                order_ids, product_ids = (np.array(column) for column in zip(*rows))
+                touched = _add_pair_counts(*co_occurrence(order_ids, product_ids))
+                # คะแนนหารด้วยยอดสั่งซื้อของทั้งสองฝั่ง → สินค้าที่เคยซื้อคู่กับสินค้าที่ยอดเปลี่ยน ต้องคำนวณอันดับใหม่ด้วย
+                affected = touched | set(
+                    ProductPairCount.objects.filter(other_id__in=touched).values_list('product_id', flat=True)
+                )
+                stats['order_items'] += len(rows)
+                stats['products'] += len(affected)
+                stats['recommendations'] += rebuild_top_k(affected, top_k)
+            watermark.last_order_id = high
+            watermark.save(update_fields=['last_order_id', 'updated_at'])
+        low = high
+
+    stats['duration_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    logger.info('recommendations built', extra={'event': 'recommendations.built', 'full': full, **stats})
+    return stats
+
+
+def get_recommendations(product_id, snapshot, limit=TOP_K):
+    """สินค้าแนะนำของ product_id (query เดียวผ่าน index (product, rank)) เป็น CatalogItem จาก snapshot"""
+    recommended_ids = (
+        ProductRecommendation.objects.filter(product_id=product_id)
+        .order_by('rank').values_list('recommended_id', flat=True)[:limit]
+    )
+    # สินค้าที่ถูกปิดการขายไม่มีใน snapshot จึงถูกกรองออกเอง
+    return [item for item in map(snapshot.get, recommended_ids) if item is not None]
@@ -0,0 +1,310 @@
+# shop/restock.py
+
+import base64
+import hashlib
+import hmac
+import logging
+import math
+import queue
+import random
+import secrets
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.http import parse_http_date
+
+from .models import LineAccount, Product, RestockSubscription, product_restocked
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 💡 แจ้งเตือน "สินค้ากลับมาแล้ว" ผ่าน LINE multicast
+# - Product.save ส่ง product_restocked เมื่อ stock เปลี่ยน 0 → มากกว่า 0
+#   เราแค่ใส่ product id ลงคิวหลัง commit ส่วนการส่งจริงทำใน background worker thread
+#   (request ของ Admin ไม่ต้องรอส่งหาผู้ติดตามเป็นพันคน)
+# - ส่งทีละ BATCH_SIZE คน (multicast รับได้สูงสุด 500) จำกัดความถี่ด้วย RATE ครั้ง/วินาที
+#   และ retry แบบ exponential backoff (ใช้ X-Line-Retry-Key เดิม LINE จึงไม่ส่งซ้ำ)
+# - ถ้า process ตายหรือ retry ไม่สำเร็จ subscription ยังเป็น notified_at=NULL
+#   คำสั่ง send_restock_notifications (cron) จะส่งให้ในรอบถัดไป
+#   (รวมถึงกรณีสต็อกกลับมาจาก UPDATE ตรง เช่นการยกเลิกออเดอร์ ที่ไม่ผ่าน Product.save)
+# - API_HOST ตั้งให้ชี้ไปที่ stub server ในเครื่องได้สำหรับทดสอบ
+# ⚠️ LINE user ID ต้องมาจาก LINE เท่านั้น ไม่รับจากที่ผู้ใช้พิมพ์ (ไม่งั้นใครก็สั่งให้ร้านส่งข้อความหา ID ใดก็ได้)
+#   ผู้ใช้ได้รหัสยืนยันจากหน้าสินค้า แล้วส่งรหัสนั้นหา LINE bot ของร้าน webhook (line_webhook)
+#   ตรวจ X-Line-Signature ด้วย CHANNEL_SECRET แล้วผูก userId ของผู้ส่งเข้ากับบัญชี (LineAccount)
+#   ถ้าผู้ใช้ unfollow/block bot จะยกเลิกการผูก และ subscription ที่ยังไม่ผูกจะไม่ถูกส่ง
+# ----------------------------------------------------------------------
+
+DEFAULTS = {
+    'ASYNC': True,
+    'CHANNEL_ACCESS_TOKEN': '',
+    'API_HOST': 'https://api.line.me',
+    'BATCH_SIZE': 500,
+    'RATE': 10.0,
+    'MAX_RETRIES': 5,
+    'BACKOFF': 1.0,
+    # Retry-After จาก LINE รอได้ไม่เกินนี้ (วินาที) กันค่าใหญ่มากจน worker ค้าง
+    'MAX_RETRY_AFTER': 30.0,
+    'CHANNEL_SECRET': '',
+    # LINE ID ของ bot (เช่น @arttoy) แสดงในหน้าสินค้าให้ผู้ใช้เพิ่มเพื่อนแล้วส่งรหัส
+    'BOT_BASIC_ID': '',
+    'LINK_CODE_TTL': 900,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'RESTOCK_NOTIFICATIONS', {})}
+
+
+def parse_retry_after(value, limit):
+    """Retry-After (วินาที หรือ HTTP-date) → วินาทีที่ต้องรอ (0..limit) คืน None ถ้าอ่านไม่ได้"""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        try:
+            seconds = parse_http_date(value) - time.time()
+        except ValueError:
+            return None
+    if math.isnan(seconds):
+        return None
+    return min(max(seconds, 0.0), limit)
+
+
+class DeliveryError(Exception):
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self):
+        # network error / 429 / 5xx ลองใหม่ได้ ส่วน 4xx อื่นๆ (token ผิด, request ผิด) ไม่ต้องลอง
+        return self.status is None or self.status == 429 or self.status >= 500
+
+
+class LineMulticastClient:
+    """ส่งข้อความ multicast ผ่าน line-bot-sdk (v3)"""
+
+    def __init__(self, access_token, host):
+        from linebot.v3.messaging import ApiClient, Configuration, MessagingApi
+        self.api = MessagingApi(ApiClient(Configuration(host=host, access_token=access_token)))
+
+    def multicast(self, user_ids, text, retry_key):
+        from linebot.v3.messaging import MulticastRequest, TextMessage
+        from linebot.v3.messaging.exceptions import ApiException
+        try:
+            self.api.multicast(MulticastRequest(to=user_ids, messages=[TextMessage(text=text)]), x_line_retry_key=retry_key)
+        except ApiException as e:
+            if e.status == 409:
+                # retry key นี้ถูกรับไปแล้ว (ครั้งก่อนส่งสำเร็จแต่ response หาย)
+                return
+            headers = e.headers or {}
+            raise DeliveryError(f'LINE API {e.status}: {e.reason}', status=e.status, retry_after=headers.get('Retry-After'))
+        except Exception as e:  # network error จาก urllib3
+            raise DeliveryError(str(e)) from e
+
+
+class RateLimiter:
+    """จำกัดให้เรียกได้ไม่เกิน rate ครั้ง/วินาที (ภายใน process)"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_at = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_at - now
+            self.next_at = max(now, self.next_at) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class RestockNotifier:
+    def __init__(self, config=None, client=None):
+        self.config = config or get_config()
+        self.client = client or LineMulticastClient(self.config['CHANNEL_ACCESS_TOKEN'], self.config['API_HOST'])
+        self.limiter = RateLimiter(self.config['RATE'])
+
+    def _send(self, user_ids, text):
+        retry_key = str(uuid.uuid4())
+        for attempt in range(self.config['MAX_RETRIES'] + 1):
+            self.limiter.wait()
+            try:
+                self.client.multicast(user_ids, text, retry_key)
+                return True
+            except DeliveryError as e:
+                if not e.retryable or attempt == self.config['MAX_RETRIES']:
+                    logger.error('restock multicast failed', extra={
+                        'event': 'restock.multicast_failed', 'status': e.status, 'recipients': len(user_ids), 'error': str(e),
+                    })
+                    return False
+                delay = parse_retry_after(e.retry_after, self.config['MAX_RETRY_AFTER'])
+                if delay is None:
+                    delay = self.config['BACKOFF'] * 2 ** attempt
+                logger.warning('restock multicast retry', extra={
+                    'event': 'restock.multicast_retry', 'status': e.status, 'attempt': attempt + 1, 'delay': delay,
+                })
+                time.sleep(delay * random.uniform(1.0, 1.25))
+        return False
+
+    def notify_product(self, product_id):
+        """ส่งแจ้งเตือนถึงผู้ติดตามสินค้านี้ที่ยังไม่ได้รับ คืนจำนวนคนที่ส่งสำเร็จ"""
+        product = Product.objects.filter(pk=product_id, is_active=True).only('id', 'name', 'stock', 'shard_count').first()
+        if product is None or product.available_stock <= 0:
+            return 0
+
+        text = f'🎉 {product.name} กลับมามีสินค้าแล้ว! รีบสั่งก่อนหมดนะ'
+        pending = RestockSubscription.pending().filter(product_id=product_id).order_by('id')
+        sent = 0
+        after = 0
+        while True:
+            batch = list(pending.filter(id__gt=after).values_list('id', 'line_user_id')[:self.config['BATCH_SIZE']])
+            if not batch:
+                break
+            after = batch[-1][0]
+            if not self._send(list(dict.fromkeys(line_user_id for _, line_user_id in batch)), text):
+                # หยุดไว้ก่อน ที่เหลือจะถูกส่งในรอบ send_restock_notifications ถัดไป
+                break
+            RestockSubscription.objects.filter(id__in=[pk for pk, _ in batch]).update(notified_at=timezone.now())
+            sent += len(batch)
+
+        logger.info('restock notifications sent', extra={'event': 'restock.sent', 'product_id': product_id, 'recipients': sent})
+        return sent
+
+    def drain(self):
+        """ส่งแจ้งเตือนที่ค้างอยู่ทั้งหมดของสินค้าที่มีสต็อกแล้ว คืน {product_id: จำนวนที่ส่ง}"""
+        product_ids = (
+            RestockSubscription.pending().filter(product__is_active=True)
+            .values_list('product_id', flat=True).distinct()
+        )
+        return {pk: self.notify_product(pk) for pk in list(product_ids)}
+
+
+# ================== ผูกบัญชี LINE ==================
+LINK_CODE_ALPHABET = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'  # ไม่มี 0/O 1/I ที่พิมพ์สับสน
+
+
+def _link_code_valid_since(config):
+    return timezone.now() - timedelta(seconds=config['LINK_CODE_TTL'])
+
+
+def current_link_code(user, config=None):
+    """รหัสยืนยันที่ยังไม่หมดอายุของผู้ใช้ (None ถ้าไม่มี)"""
+    config = config or get_config()
+    return (
+        LineAccount.objects.filter(user=user, link_code_created_at__gte=_link_code_valid_since(config))
+        .values_list('link_code', flat=True).first()
+    )
+
+
+def issue_link_code(user, config=None):
+    """ออกรหัสยืนยันให้ผู้ใช้ส่งหา LINE bot (ใช้รหัสเดิมถ้ายังไม่หมดอายุ)"""
+    config = config or get_config()
+    code = current_link_code(user, config)
+    while code is None:
+        candidate = 'ART-' + ''.join(secrets.choice(LINK_CODE_ALPHABET) for _ in range(8))
+        try:
+            with transaction.atomic():
+                LineAccount.objects.update_or_create(
+                    user=user, defaults={'link_code': candidate, 'link_code_created_at': timezone.now()},
+                )
+            code = candidate
+        except IntegrityError:
+            # รหัสชนกับของผู้ใช้อื่น (แทบไม่เกิด) สุ่มใหม่
+            continue
+    return code
+
+
+def verify_signature(body, signature, secret):
+    """ตรวจ X-Line-Signature (base64 ของ HMAC-SHA256 ของ body ด้วย channel secret)"""
+    if not secret or not signature:
+        return False
+    digest = hmac.new(secret.encode(), body, hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest).decode(), signature)
+
+
+def link_account(code, line_user_id, config=None):
+    """ผูก LINE user ID เข้ากับเจ้าของรหัส คืน LineAccount หรือ None ถ้ารหัสผิด/หมดอายุ"""
+    config = config or get_config()
+    account = LineAccount.objects.filter(
+        link_code=code.strip().upper(), link_code_created_at__gte=_link_code_valid_since(config),
+    ).first()
+    if account is None:
+        return None
+    with transaction.atomic():
+        account.line_user_id = line_user_id
+        account.linked_at = timezone.now()
+        account.link_code = None
+        account.link_code_created_at = None
+        account.save()
+        RestockSubscription.objects.filter(user_id=account.user_id).update(line_user_id=line_user_id)
+    logger.info('line account linked', extra={'event': 'restock.line_linked', 'user_id': account.user_id})
+    return account
+
+
+def unlink_account(line_user_id):
+    """ผู้ใช้ unfollow/block bot: หยุดส่งหา ID นี้"""
+    with transaction.atomic():
+        LineAccount.objects.filter(line_user_id=line_user_id).update(line_user_id='', linked_at=None)
+        RestockSubscription.objects.filter(line_user_id=line_user_id).update(line_user_id='')
+
+
+def handle_webhook_events(events, config=None):
+    """รับ event จาก LINE webhook: ข้อความที่เป็นรหัสยืนยัน → ผูกบัญชี / unfollow → ยกเลิกการผูก"""
+    config = config or get_config()
+    for event in events:
+        line_user_id = (event.get('source') or {}).get('userId')
+        if not line_user_id:
+            continue
+        if event.get('type') == 'unfollow':
+            unlink_account(line_user_id)
+        elif event.get('type') == 'message' and (event.get('message') or {}).get('type') == 'text':
+            link_account(event['message'].get('text', ''), line_user_id, config)
+
+
+# ================== Background worker ==================
+_queue = queue.Queue()
+_worker = {'thread': None}
+_worker_lock = threading.Lock()
+
+
+def _run_worker():
+    notifier = None
+    while True:
+        product_id = _queue.get()
+        try:
+            notifier = notifier or RestockNotifier()
+            notifier.notify_product(product_id)
+        except Exception:
+            logger.exception('restock worker failed', extra={'event': 'restock.worker_failed', 'product_id': product_id})
+        finally:
+            close_old_connections()
+            _queue.task_done()
+
+
+def enqueue(product_id):
+    """ใส่สินค้าลงคิวแจ้งเตือน (ส่งทันทีใน thread นี้ถ้า ASYNC=False)"""
+    if not get_config()['ASYNC']:
+        RestockNotifier().notify_product(product_id)
+        return
+    with _worker_lock:
+        if _worker['thread'] is None or not _worker['thread'].is_alive():
+            _worker['thread'] = threading.Thread(target=_run_worker, name='restock-notifier', daemon=True)
+            _worker['thread'].start()
+    _queue.put(product_id)
+
+
+@receiver(product_restocked)
+def queue_restock_notifications(sender, products, **kwargs):
+    for product in products:
+        if RestockSubscription.pending().filter(product_id=product.pk).exists():
+            transaction.on_commit(lambda pk=product.pk: enqueue(pk))
@@ -0,0 +1,142 @@
+# shop/search_index.py
+
+import bisect
+import logging
+import re
+import threading
+import unicodedata
+from collections import namedtuple
+
+from .catalog import get_snapshot
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 💡 Prefix index สำหรับ autocomplete
+# เก็บ (คำที่ normalize แล้ว, product id) เรียงไว้ใน list แล้วค้นหาด้วย bisect
+# - ทุกคำในชื่อสินค้า (แยกด้วยช่องว่าง/เครื่องหมาย) และชื่อเต็ม เป็น key หนึ่งตัว
+#   (ชื่อภาษาไทยมักไม่มีช่องว่าง จึงค้นจากต้นชื่อหรือต้นคำที่คั่นด้วยช่องว่างได้)
+# - สร้างจาก catalog snapshot (ไม่ query DB) และเมื่อ snapshot เปลี่ยน
+#   จะอัปเดตเฉพาะสินค้าที่เปลี่ยน (ถ้าเปลี่ยนเยอะค่อย rebuild ทั้งหมด)
+# ----------------------------------------------------------------------
+
+_SPLIT_RE = re.compile(r'[\s\-_/,.()\[\]]+')
+FULL_REBUILD_RATIO = 0.1
+
+
+def normalize(text):
+    return unicodedata.normalize('NFKC', text or '').casefold().strip()
+
+
+def _keys_for(name):
+    full = normalize(name)
+    keys = {full}
+    keys.update(token for token in _SPLIT_RE.split(full) if token)
+    return keys
+
+
+_IndexState = namedtuple('_IndexState', 'entries keys_by_id names version')
+
+
+def _remove(entries, keys_by_id, names, product_id):
+    for key in keys_by_id.pop(product_id, ()):
+        i = bisect.bisect_left(entries, (key, product_id))
+        if i < len(entries) and entries[i] == (key, product_id):
+            del entries[i]
+    names.pop(product_id, None)
+
+
+def _add(entries, keys_by_id, names, product_id, name):
+    keys = _keys_for(name)
+    keys_by_id[product_id] = keys
+    names[product_id] = name
+    for key in keys:
+        bisect.insort(entries, (key, product_id))
+
+
+class PrefixIndex:
+    """
+    ผู้อ่าน (lookup / suggest) ไม่ต้องถือ lock: ผู้เขียนสร้าง entries / names ชุดใหม่
+    แล้วสลับเข้ามาด้วย assignment เดียว (self.state) ผู้อ่านที่หยิบ state ไปแล้วเห็นชุดเดิมครบถ้วนเสมอ
+    """
+
+    def __init__(self):
+        # entries: [(key, product_id)] เรียงตาม key
+        self.state = _IndexState([], {}, {}, None)
+
+    @property
+    def version(self):
+        return self.state.version
+
+    def rebuild(self, snapshot):
+        entries = []
+        keys_by_id = {}
+        names = {}
+        for item in snapshot.items:
+            keys = _keys_for(item.name)
+            keys_by_id[item.id] = keys
+            names[item.id] = item.name
+            entries.extend((key, item.id) for key in keys)
+        entries.sort()
+        self.state = _IndexState(entries, keys_by_id, names, snapshot.version)
+        logger.info('search index rebuilt', extra={
+            'event': 'search_index.rebuilt', 'version': snapshot.version, 'entries': len(entries),
+        })
+
+    def apply(self, snapshot):
+        """อัปเดตให้ตรงกับ snapshot ใหม่ เฉพาะสินค้าที่เพิ่ม/ลบ/เปลี่ยนชื่อ (แก้บนสำเนาแล้วสลับเข้า)"""
+        state = self.state
+        current = {item.id: item.name for item in snapshot.items}
+        changed = [pk for pk, name in current.items() if state.names.get(pk) != name]
+        removed = [pk for pk in state.names if pk not in current]
+        if state.version is None or len(changed) + len(removed) > max(len(current), 1) * FULL_REBUILD_RATIO:
+            self.rebuild(snapshot)
+            return
+        # คัดลอก list ของ tuple เร็วกว่าเรียงใหม่ทั้งหมด และไม่แตะชุดที่ผู้อ่านกำลังใช้
+        entries, keys_by_id, names = list(state.entries), dict(state.keys_by_id), dict(state.names)
+        for pk in removed + changed:
+            _remove(entries, keys_by_id, names, pk)
+        for pk in changed:
+            _add(entries, keys_by_id, names, pk, current[pk])
+        self.state = _IndexState(entries, keys_by_id, names, snapshot.version)
+
+    def lookup(self, prefix, limit=8, state=None):
+        """คืน list ของ product id ที่ชื่อ (หรือคำในชื่อ) ขึ้นต้นด้วย prefix ไม่เกิน limit รายการ"""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        entries = (state or self.state).entries
+        results = []
+        seen = set()
+        i = bisect.bisect_left(entries, (prefix,))
+        while i < len(entries) and len(results) < limit:
+            key, product_id = entries[i]
+            if not key.startswith(prefix):
+                break
+            if product_id not in seen:
+                seen.add(product_id)
+                results.append(product_id)
+            i += 1
+        return results
+
+
+_index = PrefixIndex()
+_lock = threading.Lock()
+
+
+def get_index():
+    """คืน PrefixIndex ที่ตรงกับ catalog snapshot ปัจจุบัน"""
+    snapshot = get_snapshot()
+    if _index.version != snapshot.version:
+        with _lock:
+            if _index.version != snapshot.version:
+                _index.apply(snapshot)
+    return _index
+
+
+def suggest(prefix, limit=8):
+    """คืน list ของ (product id, ชื่อสินค้า) สำหรับ autocomplete"""
+    index = get_index()
+    # ใช้ state ชุดเดียวกันทั้ง lookup และชื่อ (ไม่ปนกับชุดใหม่ที่อาจสลับเข้ามาระหว่างนั้น)
+    state = index.state
+    return [(pk, state.names[pk]) for pk in index.lookup(prefix, limit, state)]
@@ -1,56 +1,81 @@
 # shop/signals.py 
 
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import Order, Cart
-from django.contrib.auth.models import User
+from .models import Order, OrderItem, Product, order_status_changed
 from django.db import transaction
-from django.core.exceptions import ObjectDoesNotExist
-from django.shortcuts import get_object_or_404 # 💡 เพิ่ม import
+from . import catalog, inventory, order_cache
+import logging
 
-# 💡 Signal สำหรับสร้างตะกร้าสินค้า (Cart) ทันทีที่ User ถูกสร้าง
-@receiver(post_save, sender=User)
-def create_user_cart(sender, instance, created, **kwargs):
-    if created:
-        try:
-            Cart.objects.create(user=instance)
-        except Exception as e:
-            # ควรจัดการข้อผิดพลาดในการสร้างตะกร้าด้วย
-            print(f"Error creating cart for user {instance.username}: {e}")
+logger = logging.getLogger(__name__)
 
+# 💡 Hook สำหรับจัดการสต็อกเมื่อสถานะ Order เปลี่ยนจริง (ดู Order.save / order_status_changed)
+# - PENDING → CONFIRMED: ตัดสต็อก
+# - CONFIRMED/SHIPPED → CANCELLED: คืนสต็อก
+# การแก้ไข field อื่น (เช่น tracking_number) จะไม่เข้ามาที่นี่เลย
+@receiver(order_status_changed, sender=Order)
+def update_product_stock_on_order_transition(sender, transitions, **kwargs):
+    confirmed_ids = {order.id for order, old, new in transitions if new == 'CONFIRMED'}
+    cancelled_ids = {order.id for order, old, new in transitions if new == 'CANCELLED' and old in ('CONFIRMED', 'SHIPPED')}
+    if not confirmed_ids and not cancelled_ids:
+        return
 
-# 💡 Signal สำหรับจัดการสต็อกเมื่อ Order ถูกยืนยัน
+    # ใช้ transaction.atomic เพื่อให้แน่ใจว่าการดำเนินการทั้งหมดสำเร็จ
+    with transaction.atomic():
+        items = list(OrderItem.objects.filter(order_id__in=confirmed_ids | cancelled_ids).values_list('id', 'order_id', 'product_id', 'quantity'))
+        products = Product.all_objects.only('id', 'shard_count').in_bulk({product_id for _, _, product_id, _ in items if product_id})
+        for item_id, order_id, product_id, quantity in items:
+            product = products.get(product_id)
+            if product is None:
+                logger.warning('product not found (deleted)', extra={
+                    'event': 'order.product_missing', 'order_id': order_id, 'order_item_id': item_id,
+                })
+                continue
+
+            if order_id in cancelled_ids:
+                inventory.release(product, quantity, key=order_id)
+                logger.info('stock restored', extra={
+                    'event': 'order.stock_restored', 'order_id': order_id, 'product_id': product_id, 'quantity': quantity,
+                })
+                continue
+
+            # 💡 UPDATE แบบมีเงื่อนไขในคำสั่งเดียว แทนการ SELECT แล้ว save (กัน race condition)
+            # สินค้าที่เปิด sharding จะตัดจาก shard แถวเดียว (ดู shop/inventory.py)
+            if inventory.reserve(product, quantity, key=order_id):
+                logger.info('stock deducted', extra={
+                    'event': 'order.stock_deducted', 'order_id': order_id, 'product_id': product_id, 'quantity': quantity,
+                })
+            else:
+                # กรณีที่สต็อกไม่พอ (ไม่ควรเกิดขึ้นหากมีการตรวจสอบใน views.checkout แล้ว)
+                logger.warning('insufficient stock', extra={
+                    'event': 'order.insufficient_stock', 'order_id': order_id, 'product_id': product_id, 'quantity': quantity,
+                })
+
+
+# 💡 สินค้าเปลี่ยน → เปลี่ยน version ของ catalog (หลัง commit) ให้ทุก worker โหลด snapshot ใหม่
+# การบันทึกเฉพาะ stock (update_fields=['stock']) ไม่ต้อง invalidate ทั้ง catalog แค่ให้อ่านสต็อกใหม่
+@receiver(post_save, sender=Product)
+def invalidate_catalog_on_product_save(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= {'stock'}:
+        catalog.bump_stock_version_on_commit()
+        return
+    catalog.bump_version_on_commit()
+
+
+@receiver(post_delete, sender=Product)
+def invalidate_catalog_on_product_delete(sender, instance, **kwargs):
+    catalog.bump_version_on_commit()
+
+
+# 💡 ออเดอร์ / รายการสินค้าในออเดอร์ถูกแก้ (เช่น staff แก้ใน Admin) → ลบ render cache ของหน้าคำสั่งซื้อ
+# (bulk_update ใน fulfilment.bulk_transition ไม่ผ่าน signal นี้ จึงลบ cache เองที่นั่น)
 @receiver(post_save, sender=Order)
-def update_product_stock_on_order_confirm(sender, instance, created, **kwargs):
-    # ตรวจสอบว่า status field มีการเปลี่ยนแปลงหรือไม่ (อ้างอิงจาก update_fields)
-    # และทำงานเฉพาะเมื่อสถานะเปลี่ยนเป็น CONFIRMED หรือ SHIPPED
-    
-    # ⚠️ [IMPORTANT] เนื่องจากเราใช้ `transaction.atomic` ใน checkout/views 
-    # เราจะให้ signal นี้ทำงานเมื่อสถานะเป็น CONFIRMED เท่านั้น เพื่อตัดสต็อก
-    
-    # post_save ถูกเรียกทั้งตอนสร้าง (created=True) และตอนอัปเดต (created=False)
-    # เราต้องการให้ทำงานตอนอัปเดตสถานะเท่านั้น (created=False)
-    if not created and instance.status == 'CONFIRMED':
-        # ใช้ transaction.atomic เพื่อให้แน่ใจว่าการดำเนินการทั้งหมดสำเร็จ
-        with transaction.atomic():
-            # ดึงรายการสินค้าที่ถูกสั่งซื้อ (related_name='items' ใน OrderItem)
-            for item in instance.items.all():
-                try:
-                    product = get_object_or_404(item.product) # ใช้ get_object_or_404 แทน
-                    
-                    # ตรวจสอบว่าสินค้ายังมีสต็อกพอหรือไม่
-                    if product.stock >= item.quantity:
-                        product.stock -= item.quantity
-                        # อัปเดตเฉพาะ field 'stock' เพื่อประสิทธิภาพ
-                        product.save(update_fields=['stock']) 
-                        print(f"✅ Stock updated: {item.quantity} units of {product.name} deducted.")
-                    else:
-                        # กรณีที่สต็อกไม่พอ (ไม่ควรเกิดขึ้นหากมีการตรวจสอบใน views.checkout แล้ว)
-                        print(f"⚠️ Warning: Product {product.name} (ID: {product.id}) has insufficient stock ({product.stock} available).")
-                        # หากจำเป็น คุณอาจต้องเปลี่ยนสถานะ Order กลับเป็น CANCELLED หรือ HOLD 
-                        # เช่น order.status = 'CANCELLED', order.save() 
-                        
-                except ObjectDoesNotExist:
-                    print(f"Product not found (deleted) for OrderItem ID: {item.id}")
-                except Exception as e:
-                    print(f"Error updating stock for OrderItem ID: {item.id}: {e}")
+@receiver(post_delete, sender=Order)
+def invalidate_order_cache_on_order_change(sender, instance, **kwargs):
+    order_cache.invalidate([(instance.pk, instance.user_id)])
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def invalidate_order_cache_on_item_change(sender, instance, **kwargs):
+    order_cache.invalidate([(instance.order_id, instance.order.user_id)])
@@ -0,0 +1,210 @@
+# shop/slowlog.py
+
+import contextvars
+import glob
+import hashlib
+import json
+import logging
+import re
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 💡 Slow query log
+# ครอบทุก query ของ request ด้วย connection.execute_wrapper ถ้า query ใดช้ากว่า THRESHOLD_MS
+# จะบันทึก SQL, view ที่เรียก และ plan จาก EXPLAIN (QUERY PLAN) ลง logger 'shop.slowlog'
+# (settings ส่งต่อไปยังไฟล์ JSON Lines แบบ rotating) แล้วดูสรุปแยกตาม fingerprint ได้ที่หน้า staff
+# - ปิดไว้เป็นค่าเริ่มต้น เปิดเฉพาะตอนไล่ปัญหา (SLOW_QUERY_LOG=1)
+# - ⚠️ parameters มีข้อมูลลูกค้า (อีเมล, ที่อยู่, session key) จึงไม่บันทึก ยกเว้นตั้ง LOG_PARAMS เอง
+# - EXPLAIN เฉพาะ SELECT (EXPLAIN คำสั่งอื่นเช่น BEGIN IMMEDIATE / UPDATE ใช้ไม่ได้หรือไม่มีประโยชน์)
+# ⚠️ query ที่เกิดหลัง middleware คืน response แล้ว (เช่นระหว่าง StreamingHttpResponse) จะไม่ถูกวัด
+# ----------------------------------------------------------------------
+
+DEFAULTS = {
+    'ENABLED': False,
+    'THRESHOLD_MS': 100.0,
+    'EXPLAIN': True,
+    'FILE': None,
+    'LOG_PARAMS': False,
+    'MAX_PARAM_LENGTH': 200,
+}
+
+# กันไม่ให้ EXPLAIN ที่เรารันเอง ถูกวัด/EXPLAIN ซ้ำอีกรอบ
+_explaining = contextvars.ContextVar('slowlog_explaining', default=False)
+
+_IN_LIST_RE = re.compile(r'\(\s*%s(?:\s*,\s*%s)+\s*\)')
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_SPACE_RE = re.compile(r'\s+')
+_SELECT_RE = re.compile(r'\s*SELECT\b', re.IGNORECASE)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SLOW_QUERY_LOG', {})}
+
+
+def normalize_sql(sql):
+    """ตัดค่าคงที่ / รวม IN (%s, %s, ...) ให้ query รูปแบบเดียวกันได้ fingerprint เดียวกัน"""
+    sql = _IN_LIST_RE.sub('(...)', sql)
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    return _SPACE_RE.sub(' ', sql).strip()
+
+
+def fingerprint(sql):
+    return hashlib.md5(normalize_sql(sql).encode()).hexdigest()[:12]
+
+
+def explain(connection, sql, params):
+    """คืน plan ของ sql เป็น list ของข้อความ (ว่างถ้า EXPLAIN ไม่ได้)"""
+    token = _explaining.set(True)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+            rows = cursor.fetchall()
+    except Exception as e:
+        return [f'EXPLAIN failed: {e}']
+    finally:
+        _explaining.reset(token)
+    if connection.vendor == 'sqlite':
+        # (id, parent, notused, detail)
+        return [row[-1] for row in rows]
+    return [' '.join(str(column) for column in row) for row in rows]
+
+
+class SlowQueryRecorder:
+    """execute_wrapper ของ connection หนึ่งตัวภายใน request หนึ่ง request"""
+
+    def __init__(self, connection, request, config):
+        self.connection = connection
+        self.request = request
+        self.threshold = config['THRESHOLD_MS']
+        self.explain = config['EXPLAIN']
+        self.log_params = config['LOG_PARAMS']
+        self.max_param_length = config['MAX_PARAM_LENGTH']
+
+    def __call__(self, execute, sql, params, many, context):
+        if _explaining.get():
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            if duration_ms >= self.threshold:
+                self.record(sql, params, many, duration_ms)
+
+    def record(self, sql, params, many, duration_ms):
+        match = getattr(self.request, 'resolver_match', None)
+        plan = explain(self.connection, sql, params) if self.explain and not many and _SELECT_RE.match(sql) else []
+        logger.warning('slow query', extra={
+            'event': 'db.slow_query',
+            'duration_ms': round(duration_ms, 2),
+            'fingerprint': fingerprint(sql),
+            'sql': sql,
+            'params': repr(params)[:self.max_param_length] if self.log_params else None,
+            'many': many,
+            'view': match.view_name if match else None,
+            'path': self.request.path,
+            'method': self.request.method,
+            'alias': self.connection.alias,
+            'plan': plan,
+        })
+
+
+class SlowQueryLogMiddleware:
+    """วัดเวลาทุก query ระหว่าง request (ทุก database alias)"""
+
+    def __init__(self, get_response):
+        self.config = get_config()
+        if not self.config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(SlowQueryRecorder(connection, request, self.config)))
+            return self.get_response(request)
+
+
+# ================== Report ==================
+READ_BLOCK_SIZE = 64 * 1024
+
+
+def _reverse_lines(f, block_size=READ_BLOCK_SIZE):
+    """yield บรรทัด (bytes) ของไฟล์ binary จากท้ายไฟล์ขึ้นไป อ่านทีละ block (ไม่โหลดทั้งไฟล์)"""
+    position = f.seek(0, 2)
+    remainder = b''
+    while position > 0:
+        size = min(block_size, position)
+        position -= size
+        f.seek(position)
+        lines = (f.read(size) + remainder).split(b'\n')
+        # บรรทัดแรกของ block อาจยังไม่ครบ → ต่อกับ block ก่อนหน้าในรอบถัดไป
+        remainder = lines.pop(0)
+        yield from reversed(lines)
+    yield remainder
+
+
+def read_records(path=None, limit=50000):
+    """อ่าน slow query ล่าสุดจากไฟล์ log (รวมไฟล์ที่ rotate แล้ว) ไม่เกิน limit รายการ เรียงจากใหม่ไปเก่า"""
+    path = path or get_config()['FILE']
+    if not path:
+        return []
+    records = []
+    # ไฟล์ปัจจุบันก่อน แล้วตามด้วย .1, .2, ... (เก่าขึ้นเรื่อยๆ)
+    backups = sorted(
+        (name for name in glob.glob(f'{glob.escape(path)}.*') if name.rsplit('.', 1)[1].isdigit()),
+        key=lambda name: int(name.rsplit('.', 1)[1]),
+    )
+    for filename in [path, *backups]:
+        try:
+            f = open(filename, 'rb')
+        except FileNotFoundError:
+            continue
+        # 💡 อ่านย้อนจากท้ายไฟล์ทีละ block และหยุดทันทีเมื่อครบ limit
+        # ไฟล์ที่ rotate แล้วซึ่งเก่ากว่าที่ต้องใช้จะไม่ถูกเปิดอ่านเลย
+        with f:
+            for line in _reverse_lines(f):
+                if b'db.slow_query' not in line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('event') == 'db.slow_query':
+                    records.append(record)
+                    if len(records) >= limit:
+                        return records
+    return records
+
+
+def group_by_fingerprint(records):
+    """สรุป slow query ตาม fingerprint เรียงจากเวลารวมมากไปน้อย"""
+    groups = {}
+    for record in records:
+        group = groups.get(record['fingerprint'])
+        if group is None:
+            # records เรียงจากใหม่ไปเก่า ตัวอย่างแรกจึงเป็นตัวล่าสุด
+            group = groups[record['fingerprint']] = {
+                'fingerprint': record['fingerprint'],
+                'normalized_sql': normalize_sql(record['sql']),
+                'example': record,
+                'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'views': set(),
+            }
+        group['count'] += 1
+        group['total_ms'] += record['duration_ms']
+        group['max_ms'] = max(group['max_ms'], record['duration_ms'])
+        if record.get('view'):
+            group['views'].add(record['view'])
+    for group in groups.values():
+        group['avg_ms'] = group['total_ms'] / group['count']
+        group['views'] = sorted(group['views'])
+    return sorted(groups.values(), key=lambda group: group['total_ms'], reverse=True)
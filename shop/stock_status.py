@@ -0,0 +1,71 @@
+# shop/stock_status.py
+
+import logging
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Sum
+
+from .models import Product, StockShard
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 💡 สต็อกสด (live stock) แยกจาก HTML ของ catalog
+# หน้า catalog / product_detail render HTML ที่ไม่ขึ้นกับสต็อก แล้ว cache เป็น fragment ได้นานหลายนาที
+# (key ผูกกับ catalog version) ส่วนสถานะมี/หมดและจำนวนคงเหลือ browser ดึงจาก endpoint นี้ทีหลัง
+# - ขอได้หลาย id ในครั้งเดียว: cache get_many ก่อน ส่วนที่ขาดอ่านจาก DB ด้วย query เดียว (pk__in)
+# - เก็บผลใน cache ต่อ id แค่ TTL วินาที ช่วง drop ที่สต็อกเปลี่ยนทุกวินาที DB จะโดนอ่านไม่เกิน
+#   1 ครั้ง / สินค้า / worker / TTL ไม่ว่าจะมีคนเปิดหน้าพร้อมกันกี่คน
+# ⚠️ ตัวเลขนี้ใช้แสดงผลเท่านั้น add_to_cart / checkout ยังตรวจสต็อกจริงจาก DB เสมอ
+# ----------------------------------------------------------------------
+
+DEFAULTS = {
+    'TTL': 2,
+    'MAX_IDS': 100,
+    'CACHE_ALIAS': 'default',
+    'FRAGMENT_TIMEOUT': 300,
+}
+
+KEY_PREFIX = 'stock:'
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'LIVE_STOCK', {})}
+
+
+def parse_ids(raw, limit):
+    """'1,2,3' → [1, 2, 3] (ข้ามค่าที่ไม่ใช่ตัวเลข ตัดซ้ำ ไม่เกิน limit ตัว)"""
+    ids = dict.fromkeys(int(part) for part in raw.split(',') if part.strip().isdigit())
+    return list(ids)[:limit]
+
+
+def _load(product_ids):
+    """อ่านสต็อกที่ขายได้จาก DB: {id: stock} (สินค้าที่ไม่มี/ปิดการขายได้ 0)"""
+    rows = Product.objects.filter(pk__in=product_ids, is_active=True).values_list('pk', 'stock', 'shard_count')
+    stock = dict.fromkeys(product_ids, 0)
+    sharded = []
+    for pk, value, shard_count in rows:
+        stock[pk] = value
+        if shard_count:
+            sharded.append(pk)
+    if sharded:
+        # สินค้าที่แบ่ง shard: Product.stock เป็นแค่ snapshot ใช้ผลรวมของ shard แทน
+        totals = StockShard.objects.filter(product_id__in=sharded).values_list('product_id').annotate(total=Sum('count')).order_by()
+        stock.update(totals)
+    return stock
+
+
+def get_stock(product_ids, config=None):
+    """คืน {id: stock} ของสินค้าที่ขอ (จาก cache ถ้ายังไม่หมดอายุ)"""
+    config = config or get_config()
+    cache = caches[config['CACHE_ALIAS']]
+    cached = cache.get_many([f'{KEY_PREFIX}{pk}' for pk in product_ids])
+    stock = {pk: cached[f'{KEY_PREFIX}{pk}'] for pk in product_ids if f'{KEY_PREFIX}{pk}' in cached}
+
+    missing = [pk for pk in product_ids if pk not in stock]
+    if missing:
+        loaded = _load(missing)
+        cache.set_many({f'{KEY_PREFIX}{pk}': value for pk, value in loaded.items()}, timeout=config['TTL'])
+        stock.update(loaded)
+    return stock
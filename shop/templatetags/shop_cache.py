@@ -0,0 +1,34 @@
+# shop/templatetags/shop_cache.py
+
+from django.core.cache import InvalidCacheBackendError, caches
+from django.core.cache.utils import make_template_fragment_key
+from django.template import Library
+from django.templatetags.cache import CacheNode, do_cache
+
+from ..caching import SingleFlightCache
+
+register = Library()
+
+
+# 💡 {% load shop_cache %} แล้วใช้ {% cache %} ได้เหมือนของ Django (รูปแบบเดียวกันทุกอย่าง)
+# แต่ตอน fragment หมดอายุจะ rebuild ผ่าน SingleFlightCache (กัน stampede ดู shop/caching.py)
+class SingleFlightCacheNode(CacheNode):
+    def render(self, context):
+        timeout = self.expire_time_var.resolve(context)
+        if timeout is None or self.cache_name:
+            # ไม่มีวันหมดอายุ / ระบุ cache เอง → ใช้พฤติกรรมเดิมของ Django
+            return super().render(context)
+
+        try:
+            fragment_cache = caches['template_fragments']
+        except InvalidCacheBackendError:
+            fragment_cache = caches['default']
+        vary_on = [var.resolve(context) for var in self.vary_on]
+        key = make_template_fragment_key(self.fragment_name, vary_on)
+        return SingleFlightCache(cache=fragment_cache).get_or_build(key, lambda: self.nodelist.render(context), int(timeout))
+
+
+@register.tag('cache')
+def single_flight_cache(parser, token):
+    node = do_cache(parser, token)
+    return SingleFlightCacheNode(node.nodelist, node.expire_time_var, node.fragment_name, node.vary_on, node.cache_name)
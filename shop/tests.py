@@ -1,3 +1,1748 @@
-from django.test import TestCase
+import base64
+import csv
+import datetime
+import hashlib
+import hmac
+import gzip
+import io
+import json
+import logging
+import os
+import pstats
+import tempfile
+import threading
+import time
+import unittest
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed, ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core import signing
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection, transaction
+from django.http import FileResponse, Http404, HttpResponse, QueryDict
+from django.test.utils import CaptureQueriesContext
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+
+from . import caching, catalog, courier, exports, forecasting, inventory, media, order_cache, profiling, purge, recommendations, restock, search_index, slowlog
+from .admission import DEFAULTS as ADMISSION_DEFAULTS, AdmissionController, client_id
+from .cart import GUEST_CART_COOKIE
+from .compression import CompressionMiddleware
+from .db import immediate_atomic
+from .fulfilment import bulk_transition, parse_tracking_csv
+from .log import QueueListenerHandler
+from .product_manager import ManagerFilters, apply_edits
+from .models import (
+    Cart, CartItem, DemandForecast, IdempotencyRecord, LineAccount, Order, OrderItem, Payment, Product, ProductRecommendation, RestockSubscription, StockShard,
+    order_status_changed, product_restocked,
+)
+from .restock import RestockNotifier, parse_retry_after
+
+
+# ================== Order state machine ==================
+class OrderStateMachineTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='buyer')
+        self.product = Product.objects.create(name='Labubu', price=590, stock=10)
+        self.order = Order.objects.create(user=self.user, total_amount=1770, shipping_address='-')
+        OrderItem.objects.create(order=self.order, product=self.product, price=590, quantity=3)
+        self.transitions = []
+
+        def record(sender, transitions, **kwargs):
+            self.transitions.extend((order.pk, old, new) for order, old, new in transitions)
+        order_status_changed.connect(record, sender=Order)
+        self.addCleanup(order_status_changed.disconnect, record, sender=Order)
+
+    def stock(self):
+        return Product.objects.values_list('stock', flat=True).get(pk=self.product.pk)
+
+    def test_transition_rules(self):
+        self.assertTrue(Order.can_transition('PENDING', 'CONFIRMED'))
+        self.assertTrue(Order.can_transition('SHIPPED', 'SHIPPED'))
+        self.assertFalse(Order.can_transition('PENDING', 'SHIPPED'))
+        self.assertFalse(Order.can_transition('DELIVERED', 'CANCELLED'))
+        self.assertFalse(Order.can_transition('CANCELLED', 'PENDING'))
+
+    def test_invalid_transition_is_rejected_without_saving(self):
+        order = Order.objects.get(pk=self.order.pk)
+        order.status = 'DELIVERED'
+        with self.assertRaises(ValidationError):
+            order.save()
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, 'PENDING')
+        self.assertEqual(self.transitions, [])
+
+    def test_signal_fires_only_when_status_changes(self):
+        order = Order.objects.get(pk=self.order.pk)
+        # ค่าสถานะเดิมมาจากตอนโหลด: บันทึก field อื่นเป็น UPDATE คำสั่งเดียว ไม่ SELECT ซ้ำ ไม่ส่ง signal
+        order.tracking_number = 'TH0001'
+        with self.assertNumQueries(1):
+            order.save()
+        self.assertEqual(self.transitions, [])
+
+        order.status = 'CONFIRMED'
+        order.save()
+        order.save()
+        self.assertEqual(self.transitions, [(order.pk, 'PENDING', 'CONFIRMED')])
+
+    def test_payment_deducts_stock_once_and_cancel_restores_it(self):
+        payment = Payment.objects.create(order=self.order, payment_method='card', amount_paid=1770)
+        payment.is_successful = True
+        payment.save()
+        payment.save()
+
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, 'CONFIRMED')
+        self.assertEqual(self.stock(), 7)
+
+        order = Order.objects.get(pk=self.order.pk)
+        order.status = 'CANCELLED'
+        order.save()
+        self.assertEqual(self.stock(), 10)
+        self.assertEqual(self.transitions, [(order.pk, 'PENDING', 'CONFIRMED'), (order.pk, 'CONFIRMED', 'CANCELLED')])
+
+
+# ================== Bulk fulfilment ==================
+@override_settings(ADMISSION_CONTROL={'ENABLED': False})
+class BulkFulfilmentTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(username='staff', password='pw-123456', is_staff=True)
+        self.confirmed = [
+            Order.objects.create(user=self.staff, total_amount=590, shipping_address='-', status='CONFIRMED')
+            for _ in range(3)
+        ]
+        self.pending = Order.objects.create(user=self.staff, total_amount=590, shipping_address='-')
+        self.dispatches = []
+
+        def record(sender, transitions, **kwargs):
+            self.dispatches.append([(order.pk, old, new) for order, old, new in transitions])
+        order_status_changed.connect(record, sender=Order)
+        self.addCleanup(order_status_changed.disconnect, record, sender=Order)
+
+    def test_mixed_batch_updates_valid_rows_and_dispatches_once(self):
+        ids = [order.pk for order in self.confirmed]
+        results = bulk_transition([*ids, self.pending.pk, 999999, ids[0]], 'SHIPPED')
+
+        # ผลลัพธ์ตามลำดับที่ส่งเข้าไป (id ซ้ำถูกตัด) / แถวที่ผิดไม่ทำให้ทั้ง batch ล้ม
+        self.assertEqual([(row.order_id, row.ok) for row in results], [
+            (ids[0], True), (ids[1], True), (ids[2], True), (self.pending.pk, False), (999999, False),
+        ])
+        self.assertEqual(
+            dict(Order.objects.values_list('pk', 'status')),
+            {**{pk: 'SHIPPED' for pk in ids}, self.pending.pk: 'PENDING'},
+        )
+        self.assertEqual(self.dispatches, [[(pk, 'CONFIRMED', 'SHIPPED') for pk in ids]])
+
+    def test_invalid_status_changes_nothing(self):
+        results = bulk_transition([self.pending.pk], 'LOST')
+        self.assertFalse(results[0].ok)
+        self.assertEqual(self.dispatches, [])
+
+    def test_parse_tracking_csv(self):
+        data = 'order_id,tracking_number\n#12,TH001\nabc,TH002\n13,\n\n14\n15, TH003 \n'.encode()
+        pairs, errors = parse_tracking_csv(io.BytesIO(b'\xef\xbb\xbf' + data))
+
+        self.assertEqual(pairs, {12: 'TH001', 15: 'TH003'})
+        self.assertEqual([(row.order_id, row.ok) for row in errors], [('แถว 3', False), (13, False), ('แถว 6', False)])
+
+    def test_parse_tracking_csv_accepts_thai_excel_encoding(self):
+        pairs, errors = parse_tracking_csv(io.BytesIO('รหัส,เลขพัสดุ\n7,TH007\n'.encode('cp874')))
+        self.assertEqual((pairs, errors), ({7: 'TH007'}, []))
+
+        pairs, errors = parse_tracking_csv(io.BytesIO(b'7,TH\xdb\xff\n'))
+        self.assertEqual(pairs, {})
+        self.assertFalse(errors[0].ok)
+
+    def test_manage_orders_page_posts_bulk_update_and_csv_import(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('shop:manage_orders'))
+        self.assertContains(response, reverse('shop:bulk_update_orders'))
+        self.assertContains(response, reverse('shop:import_tracking_csv'))
+        self.assertContains(response, 'name="order_ids"', count=4)
+
+        response = self.client.post(reverse('shop:bulk_update_orders'), {
+            'order_ids': [self.confirmed[0].pk, self.pending.pk], 'status': 'SHIPPED',
+        })
+        self.assertEqual((response.context['success_count'], response.context['failed_count']), (1, 1))
+
+        upload = SimpleUploadedFile('tracking.csv', f'{self.confirmed[1].pk},KE123\n'.encode('cp874'))
+        response = self.client.post(reverse('shop:import_tracking_csv'), {'csv_file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Order.objects.get(pk=self.confirmed[1].pk).tracking_number, 'KE123')
+
+
+# ================== Order render cache ==================
+# 💡 ใช้ cache 'default' (locmem) แทน 'shared' เพราะ id ของออเดอร์ใน test DB ซ้ำกันได้ทุกรอบที่รันเทสต์
+@override_settings(ADMISSION_CONTROL={'ENABLED': False}, ORDER_RENDER_CACHE={'CACHE_ALIAS': 'default'})
+class OrderRenderCacheTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.owner = User.objects.create_user(username='owner', password='pw-123456')
+        self.other = User.objects.create_user(username='other', password='pw-123456')
+        self.product = Product.objects.create(name='Labubu', price=590, stock=10)
+        self.delivered = self.create_order('DELIVERED', 'บ้านเลขที่ 99 ถนนลับ')
+        self.shipped = self.create_order('SHIPPED', 'บ้านเลขที่ 12')
+
+    def create_order(self, status, address):
+        order = Order.objects.create(user=self.owner, total_amount=590, shipping_address=address, status=status)
+        OrderItem.objects.create(order=order, product=self.product, price=590, quantity=1)
+        return order
+
+    def get(self, user, name, pk=None):
+        self.client.force_login(user)
+        return self.client.get(reverse(f'shop:{name}', args=[pk] if pk else []))
+
+    def test_cached_body_is_never_served_to_another_user(self):
+        self.assertContains(self.get(self.owner, 'order_detail', self.delivered.pk), 'บ้านเลขที่ 99 ถนนลับ')
+        self.assertEqual(order_cache.get_detail(self.delivered.pk, self.owner.id)['status'], 'DELIVERED')
+
+        self.assertIsNone(order_cache.get_detail(self.delivered.pk, self.other.id))
+        for name in ('order_detail', 'payment_process'):
+            with self.subTest(view=name):
+                response = self.get(self.other, name, self.delivered.pk)
+                self.assertEqual(response.status_code, 404)
+                self.assertNotContains(response, 'ถนนลับ', status_code=404)
+        self.assertNotContains(self.get(self.other, 'my_orders'), f'คำสั่งซื้อ #{self.delivered.pk}')
+
+    def test_only_final_orders_are_cached(self):
+        self.assertContains(self.get(self.owner, 'order_detail', self.shipped.pk), 'status-badge status-shipped')
+        self.assertIsNone(order_cache.get_detail(self.shipped.pk, self.owner.id))
+
+        self.get(self.owner, 'order_detail', self.delivered.pk)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertContains(self.client.get(reverse('shop:order_detail', args=[self.delivered.pk])), 'status-badge status-delivered')
+        self.assertFalse([q['sql'] for q in queries if 'shop_order' in q['sql']])
+
+    def test_admin_edits_invalidate_detail_and_summary(self):
+        self.get(self.owner, 'order_detail', self.delivered.pk)
+        self.get(self.owner, 'my_orders')
+
+        self.delivered.tracking_number = 'TH0001'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.delivered.save()
+        self.assertIsNone(order_cache.get_summary(self.owner.id))
+        self.assertContains(self.get(self.owner, 'order_detail', self.delivered.pk), 'TH0001')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            OrderItem.objects.filter(order=self.delivered).get().delete()
+        self.assertIsNone(order_cache.get_detail(self.delivered.pk, self.owner.id))
+        self.assertNotContains(self.get(self.owner, 'order_detail', self.delivered.pk), 'Labubu')
+
+    def test_bulk_transition_invalidates_summary_and_detail(self):
+        self.assertContains(self.get(self.owner, 'my_orders'), 'status-badge status-shipped')
+        self.assertIsNotNone(order_cache.get_summary(self.owner.id))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_transition([self.shipped.pk], 'DELIVERED')
+        self.assertIsNone(order_cache.get_summary(self.owner.id))
+        self.assertNotContains(self.get(self.owner, 'my_orders'), 'status-badge status-shipped')
+        self.assertContains(self.get(self.owner, 'order_detail', self.shipped.pk), 'status-badge status-delivered')
+
+
+# ================== Catalog snapshot ==================
+@override_settings(CATALOG_VERSION_CHECK_INTERVAL=0)
+class CatalogSnapshotTests(TestCase):
+    def setUp(self):
+        catalog._state.update(snapshot=None, checked_at=0.0)
+        self.addCleanup(catalog._state.update, snapshot=None, checked_at=0.0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.limited = Product.objects.create(name='Limited', price=1290, stock=2)
+            self.regular = Product.objects.create(name='Regular', price=390, stock=50)
+
+    def test_sale_refreshes_stock_without_rebuilding(self):
+        snapshot = catalog.get_snapshot()
+        self.assertEqual(snapshot.get(self.limited.pk).available_stock, 2)
+        with self.assertNumQueries(0):
+            self.assertIs(catalog.get_snapshot(), snapshot)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(inventory.reserve(self.limited, 2))
+        with self.assertNumQueries(1):
+            refreshed = catalog.get_snapshot()
+
+        # version เดิม (HTML ที่ cache ไว้ยังใช้ได้) แต่สินค้าที่ขายหมดไม่แสดงว่ามีสต็อกอีก
+        self.assertEqual(refreshed.version, snapshot.version)
+        self.assertFalse(refreshed.get(self.limited.pk).is_in_stock())
+        self.assertIs(refreshed.get(self.regular.pk), snapshot.get(self.regular.pk))
+
+    def test_product_save_rebuilds_snapshot(self):
+        snapshot = catalog.get_snapshot()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.regular.price = 450
+            self.regular.save()
+        rebuilt = catalog.get_snapshot()
+
+        self.assertNotEqual(rebuilt.version, snapshot.version)
+        self.assertEqual(rebuilt.get(self.regular.pk).price, 450)
+        # bulk UPDATE ที่ไม่ bump version → snapshot ยังเป็นค่าเดิมจนกว่าจะมีการ invalidate
+        Product.objects.filter(pk=self.regular.pk).update(name='Renamed')
+        self.assertEqual(catalog.get_snapshot().get(self.regular.pk).name, 'Regular')
+
+    def test_db_cart_reads_products_from_snapshot(self):
+        user = User.objects.create(username='buyer')
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.create(cart=cart, product=self.limited, quantity=1)
+        CartItem.objects.create(cart=cart, product=self.regular, quantity=3)
+        catalog.get_snapshot()
+
+        # query แค่ CartItem ไม่ว่าในตะกร้าจะมีกี่รายการ
+        with self.assertNumQueries(1):
+            items = cart.get_items()
+        self.assertEqual([(item.product.name, item.subtotal()) for item in items], [('Limited', 1290), ('Regular', 1170)])
+        self.assertEqual(cart.total_price, Decimal('2460.00'))
+
+
+# ================== Search autocomplete ==================
+def make_snapshot(names, version='v1'):
+    """CatalogSnapshot จาก {id: ชื่อ} (ไม่ใช้ DB)"""
+    now = timezone.now()
+    return catalog.CatalogSnapshot(version, tuple(
+        catalog.CatalogItem(pk, name, '', Decimal('100'), 1, None, now) for pk, name in names.items()
+    ))
+
+
+class PrefixIndexTests(SimpleTestCase):
+    NAMES = {
+        1: 'Labubu Classic', 2: 'The Monsters Labubu', 3: 'Labrador Plush',
+        4: 'ลาบูบู้ ซีรีส์ใหม่', 5: 'Ｌａｂｕｂｕ Mini', 6: 'Molly',
+    }
+
+    def setUp(self):
+        self.index = search_index.PrefixIndex()
+        self.index.rebuild(make_snapshot(self.NAMES))
+
+    def test_prefix_lookup_matches_any_word_and_normalises_case_width_and_thai(self):
+        self.assertEqual(self.index.lookup('MONST'), [2])
+        self.assertEqual(self.index.lookup('labubu cl'), [1])
+        self.assertEqual(self.index.lookup('ลาบู'), [4])
+        self.assertEqual(self.index.lookup('ซีรีส์'), [4])
+        self.assertEqual(self.index.lookup('labubu m'), [5])
+        self.assertEqual(self.index.lookup('  '), [])
+        self.assertEqual(self.index.lookup('zzz'), [])
+
+    def test_results_are_ranked_by_matching_key_then_id_without_duplicates(self):
+        # key ที่ตรงเรียงตามตัวอักษร: labrador < labubu (1, 2, 5) < labubu classic / labubu mini (ซ้ำ → ข้าม)
+        self.assertEqual(self.index.lookup('lab'), [3, 1, 2, 5])
+        self.assertEqual(self.index.lookup('lab', limit=2), [3, 1])
+        self.assertEqual(self.index.lookup('labu'), [1, 2, 5])
+
+    def test_incremental_apply_matches_full_rebuild(self):
+        names = {pk: f'Stable {pk}' for pk in range(100, 200)}
+        self.index.rebuild(make_snapshot({**self.NAMES, **names}))
+        changed = {**self.NAMES, **names, 1: 'Crybaby Classic', 7: 'Hirono'}
+        del changed[3]
+
+        self.index.apply(make_snapshot(changed, version='v2'))
+        rebuilt = search_index.PrefixIndex()
+        rebuilt.rebuild(make_snapshot(changed, version='v2'))
+
+        self.assertEqual(self.index.state, rebuilt.state)
+        self.assertEqual(self.index.lookup('lab'), [2, 5])
+        self.assertEqual(self.index.lookup('cry'), [1])
+
+    def test_readers_see_a_complete_index_during_concurrent_rebuilds(self):
+        stable = {pk: f'Stable {pk}' for pk in range(100, 400)}
+        snapshots = [make_snapshot({**stable, 1: name}, version=name) for name in ('Alpha', 'Omega')]
+        self.index.rebuild(snapshots[0])
+        expected = self.index.lookup('stable', limit=1000)
+        stop = threading.Event()
+        errors = []
+
+        def reader():
+            while not stop.is_set():
+                state = self.index.state
+                found = self.index.lookup('stable', limit=1000, state=state)
+                toggled = self.index.lookup('alpha', state=state) + self.index.lookup('omega', state=state)
+                if found != expected or toggled != [1]:
+                    errors.append((len(found), toggled))
+
+        threads = [threading.Thread(target=reader) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for i in range(200):
+            # สลับทั้งแบบอัปเดตบางส่วน (apply) และ rebuild ทั้งหมด
+            snapshot = snapshots[(i + 1) % 2]
+            if i % 2:
+                self.index.apply(snapshot)
+            else:
+                self.index.rebuild(snapshot)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+
+
+# ================== Recommendations ==================
+class RecommendationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='buyer')
+        self.products = {
+            name: Product.objects.create(name=name, price=100, stock=10) for name in 'ABCDE'
+        }
+
+    def order(self, names, status='CONFIRMED'):
+        order = Order.objects.create(user=self.user, total_amount=100, shipping_address='-', status=status)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=self.products[name], price=100, quantity=1) for name in names
+        ])
+        return order
+
+    def recommendations(self):
+        names = {product.pk: name for name, product in self.products.items()}
+        result = {}
+        for product_id, recommended_id, score in ProductRecommendation.objects.order_by('product', 'rank').values_list(
+            'product_id', 'recommended_id', 'score',
+        ):
+            result.setdefault(names[product_id], []).append((names[recommended_id], round(score, 4)))
+        return result
+
+    def test_co_occurrence_counts_each_order_once(self):
+        product_a, product_b, counts = recommendations.co_occurrence([1, 1, 1, 2, 2], [10, 20, 10, 20, 30])
+
+        self.assertEqual(
+            {(a, b): count for a, b, count in zip(product_a.tolist(), product_b.tolist(), counts.tolist())},
+            {(10, 10): 1, (10, 20): 1, (20, 10): 1, (20, 20): 2, (20, 30): 1, (30, 20): 1, (30, 30): 1},
+        )
+
+    def test_ranking_is_normalised_by_popularity_and_built_incrementally(self):
+        # ยอดสั่งซื้อ A=4 B=3 C=6 D=1 E=44 / ซื้อคู่กัน AB=3 AC=2 BC=1 CE=4
+        for names in ('AAB', 'AB', 'AC', 'ABC', 'D', *['CE'] * 4, *['E'] * 40):
+            self.order(names)
+        self.order('AD', status='CANCELLED')
+        pending = self.order('AD', status='PENDING')
+
+        stats = recommendations.build()
+
+        # E ซื้อคู่กับ C บ่อยกว่า A แต่ E ขายดีกับทุกคน → cosine ให้ A มาก่อน (2/√(6·4) > 4/√(6·44))
+        self.assertEqual(self.recommendations(), {
+            'A': [('B', 0.866), ('C', 0.4082)],
+            'B': [('A', 0.866), ('C', 0.2357)],
+            'C': [('A', 0.4082), ('E', 0.2462), ('B', 0.2357)],
+            'E': [('C', 0.2462)],
+        })
+        # Order ที่ยัง PENDING อาจถูกชำระทีหลัง → watermark หยุดก่อนถึง
+        self.assertEqual(stats['to_order'], pending.pk - 1)
+        self.assertEqual(recommendations.build()['order_items'], 0)
+
+        pending.status = 'CONFIRMED'
+        pending.save(update_fields=['status'])
+        recommendations.build()
+        incremental = self.recommendations()
+        # A=5 D=2 AD=1 → D เข้ามาเป็นอันดับสามของ A และคะแนนของคู่อื่นของ A ลดลงตามยอดสั่งซื้อของ A
+        self.assertEqual(incremental['A'], [('B', 0.7746), ('C', 0.3651), ('D', 0.3162)])
+        self.assertEqual(incremental['D'], [('A', 0.3162)])
+        # B ไม่มีคำสั่งซื้อใหม่ แต่คะแนนคู่ B→A ต้องคำนวณใหม่ตามยอดของ A ด้วย
+        self.assertEqual(incremental['B'][0], ('A', 0.7746))
+
+        recommendations.build(full=True)
+        self.assertEqual(self.recommendations(), incremental)
+
+
+# ================== Demand forecast ==================
+class DemandForecastTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='buyer')
+        self.product = Product.objects.create(name='Labubu', price=590, stock=30)
+        self.idle = Product.objects.create(name='Molly', price=3500, stock=5)
+        self.today = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def sell(self, created_at, quantity, status='CONFIRMED'):
+        order = Order.objects.create(user=self.user, total_amount=0, shipping_address='-', status=status)
+        OrderItem.objects.create(order=order, product=self.product, price=590, quantity=quantity)
+        Order.objects.filter(pk=order.pk).update(created_at=created_at)
+
+    def test_ewma_weights_favour_recent_days_and_sum_to_one(self):
+        self.assertEqual(forecasting.ewma_weights(3, 0.5).tolist(), [1 / 7, 2 / 7, 4 / 7])
+
+    def test_today_partial_day_is_excluded(self):
+        # 7 ชิ้น/วัน ทุกวันที่จบแล้วตลอดช่วง (เมื่อวานขายสองรอบ รวมรอบก่อนเที่ยงคืนพอดี)
+        for day in range(2, forecasting.HISTORY_DAYS + 1):
+            self.sell(self.today - datetime.timedelta(days=day, hours=-12), 7)
+        self.sell(self.today - datetime.timedelta(hours=12), 5)
+        self.sell(self.today - datetime.timedelta(seconds=1), 2)
+        # วันนี้ (ยังไม่ครบวัน) / ออเดอร์ที่ยกเลิก / เก่ากว่าช่วงที่คำนวณ ไม่นับ
+        self.sell(self.today + datetime.timedelta(seconds=1), 100)
+        self.sell(self.today - datetime.timedelta(hours=12), 50, status='CANCELLED')
+        self.sell(self.today - datetime.timedelta(days=forecasting.HISTORY_DAYS, seconds=1), 50)
+
+        self.assertEqual(forecasting.build()['low_stock'], 1)
+
+        forecast = DemandForecast.objects.get(product=self.product)
+        self.assertAlmostEqual(forecast.moving_average, 7)
+        self.assertAlmostEqual(forecast.forecast_daily, 7)
+        self.assertEqual(forecast.days_of_cover, round(30 / 7, 2))
+        self.assertTrue(forecast.is_low_stock)
+        idle = DemandForecast.objects.get(product=self.idle)
+        self.assertEqual((idle.forecast_daily, idle.days_of_cover, idle.is_low_stock), (0, None, False))
+
+
+# ================== Sharded stock ==================
+class ShardedStockTests(TestCase):
+    def test_product_created_sharded_can_be_reserved_and_released(self):
+        product = Product.objects.create(name='Hot drop', price=890, stock=10, shard_count=4)
+
+        self.assertEqual(
+            sorted(StockShard.objects.filter(product=product).values_list('count', flat=True)), [2, 2, 3, 3],
+        )
+        self.assertTrue(inventory.reserve(product, 3, key=1))
+        self.assertEqual(Product.objects.get(pk=product.pk).available_stock, 7)
+
+        # catalog snapshot แสดงสต็อกที่ขายได้จริง (ผลรวม shard) ไม่ใช่ Product.stock ที่อัปเดตแค่ตอน reshard
+        self.assertEqual(catalog._build('test').get(product.pk).available_stock, 7)
+
+        inventory.release(product, 3, key=1)
+        self.assertEqual(Product.objects.get(pk=product.pk).available_stock, 10)
+        # จองเกินที่มี (รวมทุก shard) ไม่สำเร็จ และไม่ตัดสต็อก
+        self.assertFalse(inventory.reserve(product, 11))
+        self.assertEqual(Product.objects.get(pk=product.pk).available_stock, 10)
+
+
+# ================== Facet counts ==================
+@override_settings(ADMISSION_CONTROL={'ENABLED': False})
+class FacetCountTests(TestCase):
+    def setUp(self):
+        # ผลนับ cache ตาม version ซึ่งไม่เปลี่ยนระหว่าง test (on_commit ไม่ทำงานใน TestCase)
+        caches['default'].clear()
+        Product.objects.create(name='Labubu Classic', price=450, stock=5)
+        Product.objects.create(name='Labubu Sold out', price=790, stock=0)
+        Product.objects.create(name='Labubu Sharded', price=890, stock=4, shard_count=2)
+        Product.objects.create(name='Molly', price=3500, stock=3)
+
+    def test_search_counts_follow_the_search_results(self):
+        response = self.client.get(reverse('shop:search_results'), {'q': 'Labubu'})
+
+        counts = response.context['facet_counts']
+        self.assertEqual(counts['total'], 3)
+        self.assertEqual(counts['price'], {'under-500': 1, '500-1000': 2, '1000-3000': 0, '3000-up': 0})
+        self.assertEqual((counts['in_stock'], counts['out_of_stock']), (2, 1))
+
+    def test_grid_cache_key_ignores_unknown_query_parameters(self):
+        Product.objects.bulk_create([Product(name=f'Labubu #{i}', price=450, stock=1) for i in range(12)])
+        url = reverse('shop:search_results')
+
+        keys = {
+            self.client.get(url, {'q': query, 'price': '500-1000', 'x': junk}).context['grid_key']
+            for query, junk in (('Labubu', '1'), ('  Labubu ', '2'), ('Labubu', str(time.time())))
+        }
+        self.assertEqual(keys, {'q=Labubu&price=500-1000&page=1'})
+
+        response = self.client.get(url, {'q': 'Labubu', 'utm_source': 'spam', 'page': '99'})
+        self.assertEqual(response.context['grid_key'], 'q=Labubu&page=2')
+        self.assertContains(response, 'href="?q=Labubu&page=1"')
+        self.assertNotContains(response, 'utm_source')
+
+    @override_settings(CATALOG_VERSION_CHECK_INTERVAL=0)
+    def test_home_counts_match_the_in_stock_filter_and_are_cached(self):
+        url = reverse('shop:index')
+        counts = self.client.get(url).context['facet_counts']
+        self.assertEqual((counts['in_stock'], counts['out_of_stock']), (3, 1))
+
+        # ครั้งถัดไปใช้ผลนับจาก cache (ไม่ aggregate ใหม่)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertFalse([query for query in queries if 'COUNT(' in query['sql']])
+
+        # ขายหมด (stock version เปลี่ยน) → ตัวนับหน้าแรกกับตัวกรอง "มีสินค้า" เห็นตรงกัน
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(inventory.reserve(Product.objects.get(name='Labubu Sharded'), 4))
+        counts = self.client.get(url).context['facet_counts']
+        filtered = self.client.get(url, {'in_stock': '1'}).context['page_obj']
+        self.assertEqual(counts['in_stock'], len(filtered.object_list))
+        self.assertEqual(counts['in_stock'], 2)
+
+    def test_counts_use_sellable_stock_and_other_facet_filters(self):
+        sharded = Product.objects.get(name='Labubu Sharded')
+        self.assertTrue(inventory.reserve(sharded, 4))
+
+        response = self.client.get(reverse('shop:search_results'), {'q': 'Labubu', 'in_stock': '1'})
+
+        # Product.stock ของสินค้าที่แบ่ง shard ยังเป็น 4 แต่ขายได้ 0 → ไม่นับ/ไม่แสดงเป็น "มีสินค้า"
+        self.assertEqual([p.name for p in response.context['page_obj']], ['Labubu Classic'])
+        counts = response.context['facet_counts']
+        self.assertEqual(counts['in_stock'], 1)
+        # ช่วงราคานับเฉพาะสินค้าที่ผ่านตัวกรอง "มีสินค้า" / ตัวนับ "มีสินค้า" ไม่ขึ้นกับตัวเอง
+        self.assertEqual(counts['price']['500-1000'], 0)
+        self.assertEqual(counts['out_of_stock'], 2)
+
+
+# ================== Product feed ==================
+@override_settings(ADMISSION_CONTROL={'ENABLED': False})
+class ProductFeedTests(TestCase):
+    def setUp(self):
+        # digest ถูก cache ตาม version ใน shared cache (on_commit ไม่ทำงานใน TestCase จึงต้องเริ่ม version ใหม่เอง)
+        catalog.bump_version()
+        catalog.bump_stock_version()
+
+    def test_etag_changes_when_availability_changes(self):
+        product = Product.objects.create(name='Hot drop', price=890, stock=2, shard_count=2)
+        url = reverse('shop:product_feed', args=['jsonl'])
+
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertEqual(json.loads(b''.join(response.streaming_content))['availability'], 'in_stock')
+        # conditional GET ที่ไม่มีอะไรเปลี่ยนใช้ digest จาก cache (ไม่ query สินค้าเลย)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # ตัดสต็อกจนหมด (ไม่ bump catalog version) → ต้องไม่ได้ 304 กับ feed ที่ availability เก่า
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(inventory.reserve(product, 2))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(json.loads(b''.join(response.streaming_content))['availability'], 'out_of_stock')
+
+    def test_export_command_writes_to_command_stdout(self):
+        Product.objects.create(name='Molly', price=3500, stock=3)
+        stdout = io.StringIO()
+
+        call_command('export_product_feed', format='jsonl', base_url='https://shop.example.com/', stdout=stdout)
+
+        record = json.loads(stdout.getvalue())
+        self.assertEqual((record['title'], record['availability']), ('Molly', 'in_stock'))
+        self.assertTrue(record['link'].startswith('https://shop.example.com/product/'))
+
+
+# ================== Queued logging ==================
+class PipeHandler(logging.Handler):
+    """เขียน message ลง file descriptor ตรงๆ (ใช้ได้ทั้งใน process ปัจจุบันและ process ที่ fork ออกไป)"""
+
+    def __init__(self, fd):
+        super().__init__()
+        self.fd = fd
+
+    def emit(self, record):
+        os.write(self.fd, f'{os.getpid()}:{record.getMessage()}\n'.encode())
+
+
+class QueueListenerHandlerTests(SimpleTestCase):
+    def setUp(self):
+        self.read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, self.read_fd)
+        self.addCleanup(os.close, write_fd)
+        self.handler = QueueListenerHandler([PipeHandler(write_fd)])
+        self.addCleanup(self.handler.close)
+
+    def emit(self, message):
+        self.handler.handle(logging.LogRecord('shop', logging.INFO, __file__, 0, message, (), None))
+
+    def read_lines(self):
+        return os.read(self.read_fd, 4096).decode().splitlines()
+
+    def test_listener_starts_on_first_emit(self):
+        # dictConfig สร้าง handler ใน master ของ gunicorn --preload → ยังไม่มี thread จนกว่าจะ log จริง
+        self.assertIsNone(self.handler._listener)
+
+        self.emit('first')
+        self.handler.close()
+        self.assertEqual(self.read_lines(), [f'{os.getpid()}:first'])
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'ต้องใช้ os.fork')
+    def test_forked_worker_restarts_listener_with_its_own_queue(self):
+        self.emit('master')
+        parent_queue = self.handler.queue
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                self.emit('worker')
+                self.emit(f'new queue: {self.handler.queue is not parent_queue}')
+                self.handler.close()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        self.handler.close()
+
+        # record ของ worker ถูกเขียนโดย listener ของ worker เอง (ไม่ค้างในคิวที่ไม่มีใครอ่าน)
+        self.assertEqual(sorted(self.read_lines()), sorted([f'{os.getpid()}:master', f'{pid}:worker', f'{pid}:new queue: True']))
+
+
+# ================== Slow query log ==================
+class SlowQueryLogReaderTests(SimpleTestCase):
+    def write_log(self, path, numbers):
+        with open(path, 'w', encoding='utf-8') as f:
+            for number in numbers:
+                f.write(json.dumps({'event': 'db.slow_query', 'n': number, 'sql': 'SELECT "ไทย"'}, ensure_ascii=False) + '\n')
+                f.write(json.dumps({'event': 'other'}) + '\n')
+
+    def test_reverse_lines_handles_lines_split_across_blocks(self):
+        data = b''.join(b'line-%d\n' % n for n in range(50))
+        self.assertEqual(
+            list(slowlog._reverse_lines(io.BytesIO(data), block_size=7)),
+            [b''] + [b'line-%d' % n for n in reversed(range(50))],
+        )
+
+    def test_reads_newest_first_across_rotated_files_up_to_limit(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'slow.log')
+        self.write_log(path, range(20, 30))
+        self.write_log(path + '.1', range(10, 20))
+        self.write_log(path + '.2', range(0, 10))
+
+        self.assertEqual([r['n'] for r in slowlog.read_records(path, limit=15)], list(range(29, 14, -1)))
+        self.assertEqual(len(slowlog.read_records(path)), 30)
+
+
+class SlowQueryRecorderTests(TestCase):
+    def record(self, **config):
+        recorder = slowlog.SlowQueryRecorder(connection, RequestFactory().get('/'), {**slowlog.DEFAULTS, 'THRESHOLD_MS': 0, **config})
+        with self.assertLogs('shop.slowlog', 'WARNING') as logs:
+            with connection.execute_wrapper(recorder):
+                list(User.objects.filter(username='secret@example.com'))
+                User.objects.filter(username='secret@example.com').update(first_name='x')
+        return {record.sql.split()[0]: record for record in logs.records}
+
+    def test_disabled_by_default(self):
+        with override_settings(SLOW_QUERY_LOG={}):
+            with self.assertRaises(MiddlewareNotUsed):
+                slowlog.SlowQueryLogMiddleware(lambda request: HttpResponse())
+
+    def test_params_are_omitted_and_only_selects_are_explained(self):
+        records = self.record()
+
+        self.assertIsNone(records['SELECT'].params)
+        self.assertTrue(records['SELECT'].plan)
+        self.assertEqual(records['UPDATE'].plan, [])
+        self.assertIn('secret@example.com', self.record(LOG_PARAMS=True)['SELECT'].params)
+
+
+# ================== Request profiling ==================
+class ProfilingMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.staff = User(username='staff', is_staff=True)
+
+    def middleware(self, **config):
+        def slow_view(request):
+            time.sleep(0.05)
+            return HttpResponse('ok')
+        with override_settings(REQUEST_PROFILING={'ENABLED': True, 'DIRECTORY': self.directory, 'INTERVAL': 0.002, **config}):
+            return profiling.ProfilingMiddleware(slow_view)
+
+    def get(self, middleware, user=None, query=None, **headers):
+        request = RequestFactory().get('/', query or {}, **headers)
+        request.user = user or AnonymousUser()
+        return middleware(request).get('X-Profile-File')
+
+    def test_disabled_by_default(self):
+        with override_settings(REQUEST_PROFILING={}):
+            with self.assertRaises(MiddlewareNotUsed):
+                profiling.ProfilingMiddleware(lambda request: HttpResponse())
+
+    def test_query_flag_is_staff_only_and_selects_mode(self):
+        middleware = self.middleware()
+
+        self.assertIsNone(self.get(middleware, query={'__profile': 'cprofile'}))
+        name = self.get(middleware, self.staff, {'__profile': 'cprofile'})
+        self.assertTrue(name.endswith('.prof'))
+        self.assertIn('slow_view', str(pstats.Stats(os.path.join(self.directory, name)).stats))
+        # ค่าที่ไม่รู้จักได้ sampling
+        name = self.get(middleware, self.staff, {'__profile': 'flamegraph'})
+        self.assertTrue(name.endswith('.collapsed'))
+        with open(os.path.join(self.directory, name), encoding='utf-8') as f:
+            self.assertIn('slow_view', f.read())
+
+    def test_header_token_is_signed_and_expires(self):
+        middleware = self.middleware()
+        signer = signing.TimestampSigner(salt=profiling._SIGNING_SALT)
+        expired = signing.Signer.sign(signer, f'cprofile{signer.sep}{signing.b62_encode(int(time.time()) - 7200)}')
+
+        self.assertTrue(self.get(middleware, HTTP_X_PROFILE=profiling.make_token('cprofile')).endswith('.prof'))
+        self.assertIsNone(self.get(middleware, HTTP_X_PROFILE=profiling.make_token('cprofile') + 'x'))
+        self.assertIsNone(self.get(middleware, HTTP_X_PROFILE=expired))
+        self.assertIsNone(self.get(middleware, HTTP_X_PROFILE=profiling.make_token('unknown-mode')))
+
+    def test_sample_rate_profiles_without_a_request(self):
+        self.assertTrue(self.get(self.middleware(SAMPLE_RATE=1.0)).endswith('.collapsed'))
+        self.assertIsNone(self.get(self.middleware()))
+
+    def test_old_profiles_are_pruned_to_max_files(self):
+        for i in range(5):
+            path = os.path.join(self.directory, f'old-{i}.collapsed')
+            open(path, 'w').close()
+            os.utime(path, (1000 + i, 1000 + i))
+        open(os.path.join(self.directory, 'notes.txt'), 'w').close()
+
+        name = self.get(self.middleware(MAX_FILES=3), self.staff, {'__profile': 'sample'})
+
+        self.assertEqual(sorted(os.listdir(self.directory)), sorted([name, 'notes.txt', 'old-3.collapsed', 'old-4.collapsed']))
+
+
+# ================== Response compression ==================
+class CompressionMiddlewareTests(SimpleTestCase):
+    SVG = b'<svg xmlns="http://www.w3.org/2000/svg">' + b'<circle r="1"/>' * 200 + b'</svg>'
+
+    def respond(self, response):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def test_generated_svg_is_compressed(self):
+        response = self.respond(HttpResponse(self.SVG, content_type='image/svg+xml'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), self.SVG)
+
+    def test_file_responses_are_sent_untouched(self):
+        response = self.respond(FileResponse(io.BytesIO(self.SVG), content_type='image/svg+xml'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(response.streaming_content), self.SVG)
+
+        ranged = HttpResponse(self.SVG, content_type='image/svg+xml')
+        ranged['Accept-Ranges'] = 'bytes'
+        self.assertEqual(self.respond(ranged).content, self.SVG)
+
+
+# ================== Media serving ==================
+class MediaServeTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        override = override_settings(MEDIA_ROOT=self.root)
+        override.enable()
+        self.addCleanup(override.disable)
+        os.makedirs(os.path.join(self.root, 'products'))
+        self.write('products/labubu.png', b'0123456789')
+
+    def write(self, name, data):
+        with open(os.path.join(self.root, name), 'wb') as f:
+            f.write(data)
+
+    def serve(self, path='products/labubu.png', method='get', config=None, **headers):
+        request = getattr(RequestFactory(), method)('/media/' + path, **headers)
+        response = media.serve(request, path, config={**media.DEFAULTS, **(config or {})})
+        self.addCleanup(response.close)
+        return response
+
+    def body(self, response):
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_parse_range(self):
+        cases = {
+            'bytes=0-3': (0, 3), 'bytes=4-': (4, 9), 'bytes=-3': (7, 9), 'bytes=-50': (0, 9), 'bytes=8-50': (8, 9),
+            'bytes=10-': False, 'bytes=5-2': False, 'bytes=-0': False,
+            'bytes=0-1,4-5': None, 'bytes=-': None, 'items=0-1': None,
+        }
+        for header, expected in cases.items():
+            with self.subTest(header=header):
+                self.assertEqual(media._parse_range(header, 10), expected)
+
+    def test_range_requests(self):
+        response = self.serve(HTTP_RANGE='bytes=2-4')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.body(response), b'234')
+        self.assertEqual((response['Content-Range'], response['Content-Length']), ('bytes 2-4/10', '3'))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+        response = self.serve(HTTP_RANGE='bytes=20-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */10'))
+
+    def test_if_range_falls_back_to_full_file_when_stale(self):
+        etag = self.serve()['ETag']
+        mtime = os.stat(os.path.join(self.root, 'products/labubu.png')).st_mtime
+
+        self.assertEqual(self.serve(HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE=etag).status_code, 206)
+        self.assertEqual(self.serve(HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE=http_date(mtime + 60)).status_code, 206)
+        for stale in ('"old-etag"', http_date(mtime - 60)):
+            with self.subTest(if_range=stale):
+                response = self.serve(HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE=stale)
+                self.assertEqual((response.status_code, self.body(response)), (200, b'0123456789'))
+
+    def test_revalidation_returns_304_with_validators(self):
+        response = self.serve()
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+
+        for headers in ({'HTTP_IF_NONE_MATCH': response['ETag']}, {'HTTP_IF_MODIFIED_SINCE': response['Last-Modified']}):
+            with self.subTest(headers=headers):
+                revalidated = self.serve(**headers)
+                self.assertEqual(revalidated.status_code, 304)
+                self.assertEqual(revalidated['ETag'], response['ETag'])
+                self.assertEqual(revalidated['Cache-Control'], response['Cache-Control'])
+        self.assertEqual(self.serve(method='head').status_code, 200)
+        self.assertEqual(self.serve(method='post').status_code, 405)
+
+    def test_offload_headers(self):
+        self.write('products/ลาบูบู้ 1.png', b'x')
+
+        response = self.serve('products/ลาบูบู้ 1.png', config={'OFFLOAD': 'X-Accel-Redirect'})
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/products/%E0%B8%A5%E0%B8%B2%E0%B8%9A%E0%B8%B9%E0%B8%9A%E0%B8%B9%E0%B9%89%201.png')
+        self.assertEqual((response.content, response['Content-Type']), (b'', 'image/png'))
+
+        response = self.serve(config={'OFFLOAD': 'x-sendfile'})
+        self.assertEqual(response['X-Sendfile'], os.path.join(self.root, 'products', 'labubu.png'))
+        self.assertEqual(self.serve(config={'OFFLOAD': 'x-sendfile'}, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_missing_files_and_paths_outside_media_root_are_404(self):
+        for path in ('products/missing.png', 'products', '../etc/passwd', 'products/labubu.png/x'):
+            with self.subTest(path=path):
+                with self.assertRaises(Http404):
+                    self.serve(path)
+
+    def test_hashed_uploads_are_deduplicated_and_immutable(self):
+        storage = media.ContentHashStorage(location=self.root)
+
+        name = storage.save('products/Molly.PNG', io.BytesIO(b'image-bytes'))
+        self.assertEqual(storage.save('products/Molly.PNG', io.BytesIO(b'image-bytes')), name)
+        self.assertNotEqual(storage.save('products/Molly.PNG', io.BytesIO(b'other-bytes')), name)
+
+        self.assertRegex(name, r'^products/Molly\.[0-9a-f]{12}\.png$')
+        self.assertEqual(len(os.listdir(os.path.join(self.root, 'products'))), 3)
+        self.assertEqual(self.serve(name)['Cache-Control'], 'public, max-age=31536000, immutable')
+
+
+# ================== Product manager ==================
+class ProductManagerTests(TestCase):
+    def setUp(self):
+        self.plain = Product.objects.create(name='Plain', price=390, stock=0)
+        self.sharded = Product.objects.create(name='Sharded', price=890, stock=4, shard_count=2)
+        self.restocked = []
+
+        def record(sender, products, **kwargs):
+            self.restocked.extend(product.pk for product in products)
+        product_restocked.connect(record)
+        self.addCleanup(product_restocked.disconnect, record)
+
+    def test_filters_and_sorts_use_sellable_stock(self):
+        StockShard.objects.filter(product=self.sharded).update(count=0)
+
+        rows = list(ManagerFilters.from_query(QueryDict('sort=stock_asc')).queryset())
+        self.assertEqual([(row['id'], row['available']) for row in rows], [(self.plain.pk, 0), (self.sharded.pk, 0)])
+        self.assertEqual(list(ManagerFilters.from_query(QueryDict('stock_min=1')).queryset()), [])
+
+    def test_apply_edits_mixed_batch(self):
+        results = apply_edits([
+            {'id': self.plain.pk, 'price': '450'},
+            {'id': self.plain.pk, 'stock': 6},
+            {'id': self.sharded.pk, 'stock': -1},
+            {'id': 999999, 'stock': 1},
+            {'price': '10'},
+            {'id': self.sharded.pk, 'price': 'abc'},
+        ])
+
+        self.assertEqual([row.ok for row in results], [True, True, False, False, False, False])
+        self.assertEqual(results[3].message, 'ไม่พบสินค้า')
+        plain = Product.objects.get(pk=self.plain.pk)
+        self.assertEqual((plain.price, plain.stock), (Decimal('450.00'), 6))
+        self.assertEqual(self.restocked, [self.plain.pk])
+
+    def test_sold_out_sharded_product_restock_reshards_and_notifies(self):
+        # ขายหมดทีละ shard (ไม่ผ่าน rebalance) → Product.stock ยังเป็น 4 แต่ขายได้ 0 → เติมเป็น 10 = กลับมามีสต็อก
+        StockShard.objects.filter(product=self.sharded).update(count=0)
+        self.assertEqual(Product.objects.get(pk=self.sharded.pk).stock, 4)
+
+        self.assertTrue(apply_edits([{'id': self.sharded.pk, 'stock': 10}])[0].ok)
+
+        self.assertEqual(Product.objects.get(pk=self.sharded.pk).available_stock, 10)
+        self.assertEqual(
+            sorted(StockShard.objects.filter(product=self.sharded).values_list('count', flat=True)), [5, 5],
+        )
+        self.assertEqual(self.restocked, [self.sharded.pk])
+
+
+# ================== Guest cart ==================
+@override_settings(ADMISSION_CONTROL={'ENABLED': False})
+class GuestCartTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='pw-123456')
+        self.limited = Product.objects.create(name='Limited', price=1290, stock=2)
+        self.regular = Product.objects.create(name='Regular', price=390, stock=50)
+
+    def test_guest_cart_lives_in_cookie_and_merges_at_login(self):
+        client = Client()
+        for product in (self.limited, self.limited, self.regular):
+            client.post(reverse('shop:add_to_cart', args=[product.pk]))
+        # guest ไม่เขียน DB เลย
+        self.assertFalse(Cart.objects.exists())
+        self.assertIn(GUEST_CART_COOKIE, client.cookies)
+
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.limited, quantity=1)
+        response = client.post(reverse('shop:login'), {'username': 'buyer', 'password': 'pw-123456'})
+
+        self.assertEqual(response.status_code, 302)
+        # จำนวนรวมกับของเดิม แต่ไม่เกินสต็อกที่มี / cookie ถูกล้าง
+        self.assertEqual(
+            dict(CartItem.objects.filter(cart=cart).values_list('product_id', 'quantity')),
+            {self.limited.pk: 2, self.regular.pk: 1},
+        )
+        self.assertEqual(response.cookies[GUEST_CART_COOKIE]['max-age'], 0)
+
+    def test_logged_in_user_cart_is_created_on_first_add(self):
+        client = Client()
+        client.force_login(self.user)
+        client.get(reverse('shop:view_cart'))
+        self.assertFalse(Cart.objects.filter(user=self.user).exists())
+
+        client.post(reverse('shop:add_to_cart', args=[self.regular.pk]))
+        self.assertEqual(Cart.objects.get(user=self.user).total_items, 1)
+
+    def test_out_of_stock_add_does_not_create_cart(self):
+        Product.objects.filter(pk=self.limited.pk).update(stock=0)
+        self.client.force_login(self.user)
+
+        response = self.client.post(reverse('shop:add_to_cart', args=[self.limited.pk]))
+        self.assertRedirects(response, reverse('shop:product_detail', args=[self.limited.pk]), fetch_redirect_response=False)
+        self.assertFalse(Cart.objects.filter(user=self.user).exists())
+
+    def test_remove_deletes_only_that_item_of_own_cart(self):
+        other = Cart.objects.create(user=User.objects.create_user(username='other', password='pw-123456'))
+        foreign = CartItem.objects.create(cart=other, product=self.regular, quantity=1)
+        cart = Cart.objects.create(user=self.user)
+        kept = CartItem.objects.create(cart=cart, product=self.regular, quantity=1)
+        removed = CartItem.objects.create(cart=cart, product=self.limited, quantity=1)
+        self.client.force_login(self.user)
+
+        self.assertEqual(self.client.get(reverse('shop:remove_from_cart', args=[removed.pk])).status_code, 405)
+        self.client.post(reverse('shop:remove_from_cart', args=[removed.pk]))
+        self.client.post(reverse('shop:remove_from_cart', args=[foreign.pk]))
+        self.assertEqual(set(CartItem.objects.values_list('pk', flat=True)), {kept.pk, foreign.pk})
+
+    @override_settings(CATALOG_VERSION_CHECK_INTERVAL=0)
+    def test_guest_remove_by_product_id(self):
+        catalog.bump_version()  # on_commit ไม่ทำงานใน TestCase → ให้ snapshot เห็นสินค้าของเทสต์นี้
+        for product in (self.limited, self.regular):
+            self.client.post(reverse('shop:add_to_cart', args=[product.pk]))
+
+        response = self.client.post(reverse('shop:remove_from_cart', args=[self.limited.pk]), follow=True)
+        self.assertContains(response, 'ลบ &quot;Limited&quot; ออกจากตะกร้าแล้ว')
+        self.assertEqual([item.product.id for item in response.context['cart_items']], [self.regular.pk])
+
+    def test_navbar_badge_counts_cart_once_per_page(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.regular, quantity=3)
+        self.client.force_login(self.user)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('shop:profile'))
+        self.assertContains(response, '<span class="cart-badge">3</span>')
+        self.assertEqual(len([q for q in queries if 'SUM("shop_cartitem"."quantity")' in q['sql']]), 1)
+
+
+# ================== Admission control ==================
+class AdmissionControlTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = LocMemCache(f'admission-test-{time.time()}', {})
+        # ปล่อยเข้าได้ 1 คนต่อการเติม token (เติมเองด้วย refill) / ผู้ใช้ไม่ติด rate limit
+        self.config = {
+            **ADMISSION_DEFAULTS, 'USER_RATE': 1000.0, 'USER_BURST': 1000,
+            'GLOBAL_RATE': 0.001, 'GLOBAL_BURST': 1, 'ADMIT_REQUESTS': 2, 'QUEUE_MAX': 2,
+        }
+        self.controller = AdmissionController(self.config, cache=self.cache)
+
+    def refill(self):
+        self.cache.delete('admission:global')
+
+    def test_pass_runs_out_and_client_must_queue_again(self):
+        self.assertEqual(self.controller.check('a')[0], AdmissionController.ADMIT)
+        self.assertEqual(self.controller.check('a')[0], AdmissionController.ADMIT)
+
+        # pass ใช้ครบแล้ว: ไม่มี pass ค้าง (ติดลบ) และต้องต่อคิวใหม่ทุกครั้ง ไม่ได้เข้าฟรี
+        for _ in range(5):
+            decision, _, position = self.controller.check('a')
+            self.assertEqual((decision, position), (AdmissionController.QUEUE, 1))
+        self.assertFalse(self.controller.has_pass('a'))
+        self.assertIsNone(self.cache.get('admission:pass:a'))
+        self.assertEqual(self.controller.queue_length(), 1)
+
+    def test_queue_is_served_in_order_and_sheds_when_full(self):
+        self.assertEqual(self.controller.check('a')[0], AdmissionController.ADMIT)
+        self.assertEqual(self.controller.check('b')[2], 1)
+        self.assertEqual(self.controller.check('c')[2], 2)
+        self.assertEqual(self.controller.check('d')[0], AdmissionController.SHED)
+
+        self.refill()
+        self.assertEqual(self.controller.poll('c')[0], AdmissionController.QUEUE)
+        self.assertEqual(self.controller.poll('b')[0], AdmissionController.ADMIT)
+        self.assertEqual(self.controller.poll('c')[2], 1)
+        self.refill()
+        self.assertEqual(self.controller.check('c')[0], AdmissionController.ADMIT)
+        self.assertEqual(self.controller.queue_length(), 0)
+
+    def test_poll_without_ticket_joins_the_queue(self):
+        self.controller.check('a')
+        decision, _, position = self.controller.poll('b')
+
+        self.assertEqual((decision, position), (AdmissionController.QUEUE, 1))
+        self.assertEqual(self.cache.get('admission:ticket:b'), 1)
+
+    def test_concurrent_polls_never_advance_past_the_tail(self):
+        controller = AdmissionController({**self.config, 'GLOBAL_RATE': 1000.0, 'GLOBAL_BURST': 1000}, cache=self.cache)
+        self.cache.set(controller._counter('tail'), 3)
+        take = controller.global_bucket.take
+
+        def slow_take(tokens=1):
+            time.sleep(0.01)  # ขยายช่วงระหว่างอ่าน serving กับ incr ให้ race เกิดได้ถ้าไม่ล็อก
+            return take(tokens)
+        controller.global_bucket.take = slow_take
+
+        barrier = threading.Barrier(8)
+
+        def poll():
+            barrier.wait()
+            controller._advance()
+        threads = [threading.Thread(target=poll) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.cache.get(controller._counter('serving')), 3)
+
+    def test_ticket_outlives_the_longest_wait(self):
+        config = {**self.config, 'GLOBAL_RATE': 10.0, 'QUEUE_MAX': 5000}
+        controller = AdmissionController(config, cache=self.cache)
+        self.assertGreater(controller.ticket_ttl(config['QUEUE_MAX']), config['QUEUE_MAX'] / config['GLOBAL_RATE'])
+
+    def test_client_id_ignores_forwarded_for_unless_proxy_is_trusted(self):
+        request = RequestFactory().get('/', REMOTE_ADDR='10.0.0.2', HTTP_X_FORWARDED_FOR='1.1.1.1, 203.0.113.7')
+        request.user = AnonymousUser()
+
+        self.assertEqual(client_id(request, {'TRUSTED_PROXY_DEPTH': 0}), 'ip10.0.0.2')
+        # nginx 1 ชั้นต่อ IP จริงไว้ท้าย / ค่าแรก (1.1.1.1) client ปลอมใส่มาเองได้
+        self.assertEqual(client_id(request, {'TRUSTED_PROXY_DEPTH': 1}), 'ip203.0.113.7')
+        self.assertEqual(client_id(request, {'TRUSTED_PROXY_DEPTH': 3}), 'ip10.0.0.2')
+
+
+# ================== Product soft delete ==================
+@override_settings(ADMISSION_CONTROL={'ENABLED': False})
+class ProductSoftDeleteTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='pw-123456')
+        self.product = Product.objects.create(name='Retired figure', price=1590, stock=5)
+        self.other = Product.objects.create(name='Still on sale', price=390, stock=5)
+        self.cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=2)
+        CartItem.objects.create(cart=self.cart, product=self.other, quantity=1)
+        self.order = Order.objects.create(user=self.user, total_amount=1590, shipping_address='-')
+        OrderItem.objects.create(order=self.order, product=self.product, price=1590, quantity=1)
+
+    def test_soft_delete_hides_product_and_its_cart_rows(self):
+        # bump catalog version หลัง commit → หน้าสินค้าที่อ่านจาก snapshot ไม่เห็นสินค้านี้อีก
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(Product.objects.filter(pk=self.product.pk).soft_delete(), 1)
+
+        self.assertFalse(Product.objects.filter(pk=self.product.pk).exists())
+        deleted = Product.all_objects.get(pk=self.product.pk)
+        self.assertIsNotNone(deleted.deleted_at)
+        self.assertFalse(deleted.is_active)
+        # แถวในตะกร้ายังอยู่ (รอ purge) แต่ตะกร้า/ยอดรวมไม่เห็นแล้ว
+        self.assertEqual(CartItem.all_objects.filter(cart=self.cart).count(), 2)
+        self.assertEqual([item.product.id for item in self.cart.get_items()], [self.other.pk])
+        self.assertEqual((self.cart.total_items, self.cart.total_price), (1, 390))
+        self.assertEqual(self.client.get(reverse('shop:product_detail', args=[self.product.pk])).status_code, 404)
+
+    def test_order_history_still_resolves_deleted_product(self):
+        Product.objects.filter(pk=self.product.pk).soft_delete()
+
+        item = OrderItem.objects.get(order=self.order)
+        self.assertEqual(item.product_id, self.product.pk)
+        self.assertEqual(item.product.name, 'Retired figure')
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('shop:order_detail', args=[self.order.pk]))
+        self.assertContains(response, 'Retired figure')
+
+    def test_purge_deletes_references_in_batches(self):
+        for i in range(6):
+            cart = Cart.objects.create(user=User.objects.create(username=f'fan{i}'))
+            CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+        RestockSubscription.objects.create(product=self.product, user=self.user, line_user_id='U1')
+        notified = RestockSubscription.objects.create(
+            product=self.product, user=User.objects.get(username='fan0'), line_user_id='U2', notified_at=timezone.now(),
+        )
+        Product.objects.filter(pk=self.product.pk).soft_delete()
+
+        stats = purge.purge_deleted_products({'BATCH_SIZE': 3, 'PAUSE': 0})
+
+        # 7 แถวในตะกร้า → 3 ชุด (3, 3, 1) + การแจ้งเตือนที่ยังไม่ส่ง 1 ชุด
+        self.assertEqual((stats['cart_items'], stats['subscriptions'], stats['batches']), (7, 1, 4))
+        self.assertFalse(CartItem.all_objects.filter(product=self.product).exists())
+        self.assertEqual(list(CartItem.all_objects.values_list('product_id', flat=True)), [self.other.pk])
+        self.assertEqual(list(RestockSubscription.objects.values_list('pk', flat=True)), [notified.pk])
+        # ประวัติคำสั่งซื้อไม่ถูกแตะ
+        self.assertEqual(OrderItem.objects.get(order=self.order).product_id, self.product.pk)
+        self.assertEqual(purge.purge_deleted_products({'BATCH_SIZE': 3, 'PAUSE': 0})['batches'], 0)
+
+
+# ================== Restock notifications ==================
+class StubLineServer:
+    """LINE Messaging API ปลอม: บันทึก multicast ที่ได้รับ และตอบตาม responses ที่กำหนดไว้ทีละครั้ง"""
+
+    def __init__(self, responses=()):
+        self.calls = []
+        self.responses = list(responses)
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                stub.calls.append({'path': self.path, 'to': body['to'], 'retry_key': self.headers.get('X-Line-Retry-Key')})
+                status = stub.responses.pop(0) if stub.responses else 200
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                if status == 429:
+                    self.send_header('Retry-After', '0')
+                self.end_headers()
+                self.wfile.write(b'{}' if status == 200 else b'{"message": "stub error"}')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class RestockNotificationTests(TestCase):
+    def setUp(self):
+        self.stub = StubLineServer()
+        self.addCleanup(self.stub.close)
+        self.product = Product.objects.create(name='Labubu', description='', price=590, stock=0)
+        users = User.objects.bulk_create([User(username=f'fan{i}') for i in range(1200)])
+        RestockSubscription.objects.bulk_create([
+            RestockSubscription(product=self.product, user=user, line_user_id=f'U{i:032x}') for i, user in enumerate(users)
+        ])
+
+    def config(self):
+        return {
+            'ASYNC': False, 'API_HOST': self.stub.url, 'CHANNEL_ACCESS_TOKEN': 'test',
+            'BATCH_SIZE': 500, 'RATE': 1000, 'MAX_RETRIES': 2, 'BACKOFF': 0,
+        }
+
+    def test_restock_fans_out_in_batches_with_retry(self):
+        self.stub.responses = [429]
+        with override_settings(RESTOCK_NOTIFICATIONS=self.config()):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.product.stock = 10
+                self.product.save()
+
+        self.assertEqual([len(call['to']) for call in self.stub.calls], [500, 500, 500, 200])
+        self.assertTrue(all(call['path'] == '/v2/bot/message/multicast' for call in self.stub.calls))
+        # retry ใช้ retry key เดิม
+        self.assertEqual(self.stub.calls[0]['retry_key'], self.stub.calls[1]['retry_key'])
+        self.assertFalse(RestockSubscription.objects.filter(notified_at__isnull=True).exists())
+
+    def test_failed_batch_stays_pending_for_drain(self):
+        self.stub.responses = [400]
+        Product.objects.filter(pk=self.product.pk).update(stock=3)
+        notifier = RestockNotifier(config=self.config())
+
+        self.assertEqual(notifier.notify_product(self.product.pk), 0)
+        self.assertEqual(RestockSubscription.objects.filter(notified_at__isnull=True).count(), 1200)
+
+        self.assertEqual(notifier.drain(), {self.product.pk: 1200})
+        self.assertEqual(notifier.notify_product(self.product.pk), 0)
+
+    def test_retry_after_is_parsed_safely_and_clamped(self):
+        self.assertEqual(parse_retry_after('3', 30), 3.0)
+        self.assertEqual(parse_retry_after('86400', 30), 30)
+        self.assertEqual(parse_retry_after('-5', 30), 0.0)
+        self.assertAlmostEqual(parse_retry_after(http_date(time.time() + 10), 30), 10, delta=2)
+        self.assertEqual(parse_retry_after(http_date(time.time() + 3600), 30), 30)
+        self.assertIsNone(parse_retry_after('soon', 30))
+        self.assertIsNone(parse_retry_after('nan', 30))
+
+    def test_unlinked_subscriptions_are_not_sent(self):
+        RestockSubscription.objects.filter(user__username__in=['fan0', 'fan1']).update(line_user_id='')
+        Product.objects.filter(pk=self.product.pk).update(stock=3)
+
+        self.assertEqual(RestockNotifier(config=self.config()).notify_product(self.product.pk), 1198)
+        self.assertEqual(sum(len(call['to']) for call in self.stub.calls), 1198)
+
+
+@override_settings(ADMISSION_CONTROL={'ENABLED': False}, RESTOCK_NOTIFICATIONS={'CHANNEL_SECRET': 'secret', 'ASYNC': False})
+class LineAccountLinkTests(TestCase):
+    LINE_ID = 'U' + 'a' * 32
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='fan', password='pw')
+        self.product = Product.objects.create(name='Labubu', description='', price=590, stock=0)
+        self.client.force_login(self.user)
+
+    def post_webhook(self, events, secret='secret'):
+        body = json.dumps({'events': events}).encode()
+        signature = base64.b64encode(hmac.new(secret.encode(), body, hashlib.sha256).digest()).decode()
+        return Client().post(reverse('shop:line_webhook'), body, content_type='application/json', HTTP_X_LINE_SIGNATURE=signature)
+
+    def message(self, text, line_user_id=LINE_ID):
+        return {'type': 'message', 'source': {'userId': line_user_id}, 'message': {'type': 'text', 'text': text}}
+
+    def test_posted_line_user_id_is_ignored_until_linked_via_bot(self):
+        self.client.post(reverse('shop:subscribe_restock', args=[self.product.pk]), {'line_user_id': 'U' + 'b' * 32})
+
+        subscription = RestockSubscription.objects.get(user=self.user)
+        self.assertEqual(subscription.line_user_id, '')
+        self.assertFalse(RestockSubscription.pending().exists())
+        code = LineAccount.objects.get(user=self.user).link_code
+        self.assertContains(self.client.get(reverse('shop:product_detail', args=[self.product.pk])), code)
+
+        self.assertEqual(self.post_webhook([self.message(code.lower())]).status_code, 200)
+        subscription.refresh_from_db()
+        self.assertEqual(subscription.line_user_id, self.LINE_ID)
+        self.assertIsNone(LineAccount.objects.get(user=self.user).link_code)
+
+        # ผูกแล้ว สมัครสินค้าอื่นได้ทันทีโดยไม่ต้องยืนยันใหม่
+        other = Product.objects.create(name='Molly', description='', price=3500, stock=0)
+        self.client.post(reverse('shop:subscribe_restock', args=[other.pk]))
+        self.assertEqual(RestockSubscription.objects.get(product=other).line_user_id, self.LINE_ID)
+
+    def test_webhook_rejects_bad_signature_and_expired_code(self):
+        code = restock.issue_link_code(self.user)
+        RestockSubscription.objects.create(product=self.product, user=self.user)
+
+        self.assertEqual(self.post_webhook([self.message(code)], secret='wrong').status_code, 403)
+        LineAccount.objects.filter(user=self.user).update(link_code_created_at=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual(self.post_webhook([self.message(code)]).status_code, 200)
+        self.assertEqual(LineAccount.objects.get(user=self.user).line_user_id, '')
+        self.assertFalse(RestockSubscription.pending().exists())
+
+    def test_unfollow_unlinks_account(self):
+        restock.link_account(restock.issue_link_code(self.user), self.LINE_ID)
+        RestockSubscription.objects.create(product=self.product, user=self.user, line_user_id=self.LINE_ID)
+
+        self.post_webhook([{'type': 'unfollow', 'source': {'userId': self.LINE_ID}}])
+
+        self.assertEqual(LineAccount.objects.get(user=self.user).line_user_id, '')
+        self.assertFalse(RestockSubscription.pending().exists())
+
+
+# ================== Stampede-safe cache ==================
+class SingleFlightCacheTests(SimpleTestCase):
+    THREADS = 20
+
+    def setUp(self):
+        caching.reset_metrics()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.backends = {
+            'locmem': LocMemCache('single-flight-test', {}),
+            'filebased': FileBasedCache(directory.name, {}),
+        }
+
+    def run_concurrently(self, cache, builder, timeout=60):
+        """เรียก get_or_build พร้อมกันจากหลาย thread (ปล่อยพร้อมกันด้วย Barrier) คืนผลของทุก thread"""
+        single_flight = caching.SingleFlightCache(config={'POLL_INTERVAL': 0.005}, cache=cache)
+        barrier = threading.Barrier(self.THREADS)
+        results = []
+
+        def worker():
+            barrier.wait()
+            results.append(single_flight.get_or_build('hot-page', builder, timeout))
+
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def slow_builder(self, calls, value, ready):
+        """builder ที่ไม่คืนค่าจนกว่า ready() เป็นจริง (thread อื่นทุกตัวเห็น lock แล้ว) → ไม่มี thread มาช้ากว่าการ build"""
+        def build():
+            calls.append(value)
+            deadline = time.monotonic() + 10
+            while not ready() and time.monotonic() < deadline:
+                time.sleep(0.005)
+            return value
+        return build
+
+    def watch_readers(self, cache):
+        """set ของ thread ที่อ่าน key 'hot-page' (ใช้ดูว่าทุก thread รอค่าจากผู้ build อยู่แล้ว)"""
+        readers = set()
+        original_get = cache.get
+
+        def get(key, *args, **kwargs):
+            if key == 'hot-page':
+                readers.add(threading.get_ident())
+            return original_get(key, *args, **kwargs)
+        cache.get = get
+        return readers
+
+    def test_cold_key_is_built_once(self):
+        for name, cache in self.backends.items():
+            with self.subTest(backend=name):
+                caching.reset_metrics()
+                calls = []
+                readers = self.watch_readers(cache)
+                builder_threads = []
+
+                def ready():
+                    # thread อื่นอ่าน key ระหว่างรอ (poll) หลังจาก builder ถือ lock แล้ว
+                    return len(readers - set(builder_threads)) >= self.THREADS - 1
+
+                build = self.slow_builder(calls, 'rendered', ready)
+
+                def builder():
+                    builder_threads.append(threading.get_ident())
+                    readers.clear()
+                    return build()
+
+                results = self.run_concurrently(cache, builder)
+
+                self.assertEqual(calls, ['rendered'])
+                self.assertEqual(results, ['rendered'] * self.THREADS)
+                self.assertEqual(caching.metrics(), {'miss': 1, 'coalesced': self.THREADS - 1})
+
+    def test_expired_key_serves_stale_during_single_rebuild(self):
+        for name, cache in self.backends.items():
+            with self.subTest(backend=name):
+                caching.reset_metrics()
+                cache.set('hot-page', caching.Entry('old', time.time() - 1, 0.0), timeout=60)
+                calls = []
+                ready = lambda: caching.metrics().get('stale', 0) >= self.THREADS - 1
+                results = self.run_concurrently(cache, self.slow_builder(calls, 'new', ready))
+
+                self.assertEqual(calls, ['new'])
+                self.assertEqual(sorted(results), ['new'] + ['old'] * (self.THREADS - 1))
+                self.assertEqual(caching.metrics(), {'refresh': 1, 'stale': self.THREADS - 1})
+
+    def test_failed_rebuild_falls_back_to_stale_value(self):
+        cache = self.backends['locmem']
+        cache.set('hot-page', caching.Entry('old', time.time() - 1, 0.0), timeout=60)
+
+        def broken():
+            raise RuntimeError('db down')
+
+        with self.assertLogs('shop.caching', 'ERROR'):
+            value = caching.SingleFlightCache(cache=cache).get_or_build('hot-page', broken, 60)
+        self.assertEqual(value, 'old')
+        self.assertIsNone(cache.get('hot-page:lock'))
+
+
+# ================== Courier tracking ==================
+class FakeCourierServer:
+    """tracking API ปลอม: GET /track/<tracking_number> ตอบ {"status": ...} จาก parcels
+    เลขพัสดุใน flaky จะตอบ 503 ครั้งแรกก่อน / เลขที่ไม่มีใน parcels ตอบ 404
+    broken: {เลขพัสดุ: body (bytes) ที่ตอบแทน} / body เป็น None = ตอบ body ไม่ครบตาม Content-Length"""
+
+    def __init__(self, parcels, flaky=(), broken=None, retry_after='0'):
+        self.parcels = parcels
+        self.flaky = set(flaky)
+        self.broken = broken or {}
+        self.retry_after = retry_after
+        self.requests = 0
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                tracking_number = self.path.rsplit('/', 1)[-1]
+                with stub.lock:
+                    stub.requests += 1
+                    stub.active += 1
+                    stub.max_active = max(stub.max_active, stub.active)
+                    failing = tracking_number in stub.flaky
+                    stub.flaky.discard(tracking_number)
+                time.sleep(0.002)
+                # นับว่าเสร็จก่อนตอบ (client อาจยิง request ถัดไปทันทีที่ได้ response)
+                with stub.lock:
+                    stub.active -= 1
+                if failing:
+                    self.reply(503, {'message': 'busy'}, retry_after=stub.retry_after)
+                elif tracking_number in stub.broken:
+                    self.reply_raw(stub.broken[tracking_number])
+                elif tracking_number in stub.parcels:
+                    self.reply(200, {'tracking_number': tracking_number, 'status': stub.parcels[tracking_number]})
+                else:
+                    self.reply(404, {'message': 'not found'})
+
+            def reply(self, status, body, retry_after=None):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                if retry_after is not None:
+                    self.send_header('Retry-After', retry_after)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def reply_raw(self, payload):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)) if payload is not None else '100')
+                self.end_headers()
+                if payload is None:
+                    self.wfile.write(b'{"status": "deliv')
+                    self.close_connection = True
+                else:
+                    self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            request_queue_size = 256
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class CourierSyncTests(TestCase):
+    PARCELS = 2000
+    CONCURRENCY = 50
+
+    def setUp(self):
+        user = User.objects.create(username='buyer')
+        self.orders = Order.objects.bulk_create([
+            Order(user=user, total_amount=590, shipping_address='-', status='SHIPPED', tracking_number=f'TH{i:08d}')
+            for i in range(self.PARCELS)
+        ])
+        parcels = {
+            f'TH{i:08d}': 'Delivered' if i % 3 == 0 else 'in_transit'
+            for i in range(self.PARCELS) if i % 100 != 99
+        }
+        self.server = FakeCourierServer(parcels, flaky=[f'TH{i:08d}' for i in range(0, self.PARCELS, 40)])
+        self.addCleanup(self.server.close)
+
+    def config(self):
+        return {
+            'COURIERS': [{'NAME': 'fake', 'PATTERN': r'^TH', 'URL': self.server.url + '/track/{tracking_number}'}],
+            'CONCURRENCY': self.CONCURRENCY, 'TIMEOUT': 10.0, 'MAX_RETRIES': 2, 'BACKOFF': 0,
+        }
+
+    def test_delivered_parcels_are_transitioned_in_bulk(self):
+        started = time.monotonic()
+        stats = courier.sync(self.config())
+        elapsed = time.monotonic() - started
+
+        delivered = {i for i in range(self.PARCELS) if i % 3 == 0 and i % 100 != 99}
+        self.assertEqual(stats['parcels'], self.PARCELS)
+        self.assertEqual(stats['delivered'], len(delivered))
+        self.assertEqual(stats['unknown'], self.PARCELS // 100)
+        self.assertEqual(stats['errors'], 0)
+        self.assertEqual(
+            set(Order.objects.filter(status='DELIVERED').values_list('tracking_number', flat=True)),
+            {f'TH{i:08d}' for i in delivered},
+        )
+        # 503 ครั้งแรกถูก retry / ไม่เกิน concurrency ที่กำหนด / พันกว่าพัสดุจบในไม่กี่วินาที
+        self.assertEqual(self.server.requests, self.PARCELS + self.PARCELS // 40)
+        self.assertLessEqual(self.server.max_active, self.CONCURRENCY)
+        self.assertLess(elapsed, 30)
+
+    def test_parcels_without_matching_courier_are_skipped(self):
+        config = self.config()
+        config['COURIERS'][0]['PATTERN'] = r'^KE'
+        stats = courier.sync(config, limit=10)
+
+        self.assertEqual(stats['no_courier'], 10)
+        self.assertEqual(self.server.requests, 0)
+        self.assertFalse(Order.objects.filter(status='DELIVERED').exists())
+
+    def test_courier_without_pattern_is_rejected(self):
+        config = self.config()
+        del config['COURIERS'][0]['PATTERN']
+        with self.assertRaises(ImproperlyConfigured):
+            courier.sync(config, limit=10)
+        self.assertEqual(self.server.requests, 0)
+
+
+class CourierResponseErrorTests(TestCase):
+    def test_malformed_responses_fail_only_their_parcel(self):
+        user = User.objects.create(username='buyer')
+        Order.objects.bulk_create([
+            Order(user=user, total_amount=590, shipping_address='-', status='SHIPPED', tracking_number=number)
+            for number in ('TH-OK', 'TH-HTML', 'TH-LIST', 'TH-CUT', 'TH-BUSY')
+        ])
+        server = FakeCourierServer(
+            {'TH-OK': 'delivered', 'TH-BUSY': 'delivered'}, flaky=['TH-BUSY'], retry_after='3600',
+            broken={'TH-HTML': b'<html>oops</html>', 'TH-LIST': b'["delivered"]', 'TH-CUT': None},
+        )
+        self.addCleanup(server.close)
+        config = {
+            'COURIERS': [{'NAME': 'fake', 'PATTERN': r'^TH', 'URL': server.url + '/track/{tracking_number}'}],
+            'MAX_RETRIES': 1, 'BACKOFF': 0, 'MAX_RETRY_AFTER': 0.05,
+        }
+
+        started = time.monotonic()
+        with self.assertLogs('shop.courier', 'WARNING'):
+            stats = courier.sync(config)
+
+        # Retry-After: 3600 ถูกจำกัดไว้ที่ MAX_RETRY_AFTER / body เสียได้ 'error' เฉพาะพัสดุนั้น
+        self.assertLess(time.monotonic() - started, 10)
+        self.assertEqual((stats['delivered'], stats['errors']), (2, 3))
+        self.assertEqual(
+            set(Order.objects.filter(status='DELIVERED').values_list('tracking_number', flat=True)), {'TH-OK', 'TH-BUSY'},
+        )
+
+
+@override_settings(ADMISSION_CONTROL={'ENABLED': False})
+class IdempotencyKeyTests(TransactionTestCase):
+    DUPLICATES = 8
+
+    def setUp(self):
+        self.user = User.objects.create(username='buyer')
+        self.product = Product.objects.create(name='Labubu', price=590, stock=10)
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=2)
+
+    def post_concurrently(self, url, data):
+        """ส่ง POST เดียวกันพร้อมกันหลาย thread (เหมือนดับเบิลคลิก / มือถือ retry) คืน list ของ response"""
+        clients = []
+        for _ in range(self.DUPLICATES):
+            client = Client()
+            client.force_login(self.user)
+            clients.append(client)
+        barrier = threading.Barrier(self.DUPLICATES)
+        responses = [None] * self.DUPLICATES
+
+        def submit(index):
+            try:
+                barrier.wait()
+                responses[index] = clients[index].post(url, data)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=submit, args=(i,)) for i in range(self.DUPLICATES)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return responses
+
+    def test_concurrent_duplicate_checkouts_create_one_order(self):
+        responses = self.post_concurrently(reverse('shop:checkout'), {'shipping_address': 'Bangkok', 'idempotency_key': 'checkout-key-1'})
+
+        order = Order.objects.get(user=self.user)
+        self.assertEqual(order.items.count(), 1)
+        self.assertEqual({response.status_code for response in responses}, {302})
+        self.assertEqual({response['Location'] for response in responses}, {reverse('shop:payment_process', args=[order.id])})
+        self.assertEqual(sum(response.has_header('Idempotent-Replayed') for response in responses), self.DUPLICATES - 1)
+
+        # ส่งซ้ำภายหลัง (ตะกร้าว่างแล้ว) ยังได้ผลลัพธ์เดิม ไม่ถูกส่งกลับหน้าแรก
+        client = Client()
+        client.force_login(self.user)
+        response = client.post(reverse('shop:checkout'), {'shipping_address': 'Bangkok', 'idempotency_key': 'checkout-key-1'})
+        self.assertEqual(response['Location'], reverse('shop:payment_process', args=[order.id]))
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_concurrent_duplicate_payments_confirm_once(self):
+        order = Order.objects.create(user=self.user, total_amount=1180, shipping_address='-')
+        order.items.create(product=self.product, price=590, quantity=2)
+
+        responses = self.post_concurrently(reverse('shop:payment_process', args=[order.id]), {'idempotency_key': 'payment-key-1'})
+
+        order.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertEqual(order.status, 'CONFIRMED')
+        self.assertEqual(Payment.objects.filter(order=order, is_successful=True).count(), 1)
+        self.assertEqual(self.product.stock, 8)
+        self.assertEqual({response['Location'] for response in responses}, {reverse('shop:order_detail', args=[order.id])})
+        self.assertEqual(IdempotencyRecord.objects.get(key='payment-key-1').status_code, 302)
+
+    def test_only_checkout_block_takes_the_write_lock_at_begin(self):
+        with CaptureQueriesContext(connection) as queries:
+            with immediate_atomic():
+                Product.objects.count()
+            with transaction.atomic():
+                Product.objects.count()
+        begins = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('BEGIN')]
+        self.assertEqual(begins, ['BEGIN IMMEDIATE', 'BEGIN'])
+        self.assertIsNone(connection.transaction_mode)
+
+    def test_concurrent_checkouts_of_different_users_all_succeed(self):
+        users = [self.user] + [User.objects.create(username=f'fan{i}') for i in range(self.DUPLICATES - 1)]
+        for user in users[1:]:
+            CartItem.objects.create(cart=Cart.objects.create(user=user), product=self.product, quantity=1)
+        barrier = threading.Barrier(len(users))
+        responses = [None] * len(users)
+
+        def submit(index):
+            try:
+                client = Client()
+                client.force_login(users[index])
+                barrier.wait()
+                responses[index] = client.post(reverse('shop:checkout'), {'idempotency_key': f'checkout-user-{index}'})
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=submit, args=(i,)) for i in range(len(users))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # อ่านยอดตะกร้าแล้วเขียนพร้อมกัน: ทุก checkout รอ lock ตามคิว ไม่มีใครได้ "database is locked"
+        self.assertEqual(Order.objects.count(), len(users))
+        self.assertEqual(
+            {response['Location'].split('/')[1] for response in responses}, {reverse('shop:payment_process', args=[1]).split('/')[1]},
+        )
+
+    def test_key_reused_for_a_different_request_is_rejected(self):
+        client = Client()
+        client.force_login(self.user)
+        client.post(reverse('shop:checkout'), {'shipping_address': 'Bangkok', 'idempotency_key': 'checkout-key-2'})
+
+        response = client.post(reverse('shop:checkout'), {'shipping_address': 'Chiang Mai', 'idempotency_key': 'checkout-key-2'})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+
+# ================== Sales export ==================
+class SalesExportTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='=buyer')
+        product = Product.objects.create(name='Labubu', price=590, stock=10)
+        self.orders = []
+        for i in range(5):
+            order = Order.objects.create(user=user, total_amount=1180, shipping_address='-')
+            OrderItem.objects.create(order=order, product=product, price=590, quantity=1)
+            OrderItem.objects.create(order=order, product=None, price=590, quantity=1)
+            self.orders.append(order)
+        Payment.objects.create(order=self.orders[0], payment_method='card', is_successful=True, amount_paid=1180)
+        self.empty = Order.objects.create(user=user, total_amount=0, shipping_address='-')
+        # ออเดอร์นอกช่วงวันที่ต้องไม่ถูกส่งออก
+        old = Order.objects.create(user=user, total_amount=590, shipping_address='-')
+        Order.objects.filter(pk=old.pk).update(created_at=old.created_at - datetime.timedelta(days=30))
+        today = timezone.localdate()
+        self.start, self.end = exports.parse_date_range((today - datetime.timedelta(days=1)).isoformat(), today.isoformat())
+
+    def export(self, fmt, chunk_size):
+        chunks = list(exports.generate(fmt, self.start, self.end, chunk_size=chunk_size))
+        return chunks, ''.join(chunks)
+
+    def test_csv_has_one_row_per_item_across_chunks(self):
+        chunks, text = self.export('csv', chunk_size=2)
+        rows = list(csv.DictReader(io.StringIO(text.lstrip('\ufeff'))))
+
+        # header + ออเดอร์ 6 รายการ ทีละ 2 = 3 chunk
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(len(rows), 5 * 2 + 1)
+        self.assertEqual([int(row['order_id']) for row in rows[:2]], [self.orders[0].pk] * 2)
+        self.assertEqual(rows[0]['payment_method'], 'card')
+        self.assertEqual(rows[0]['line_total'], '590.00')
+        self.assertEqual(rows[1]['product_name'], '')
+        self.assertEqual(rows[-1]['order_id'], str(self.empty.pk))
+        self.assertEqual(rows[-1]['item_id'], '')
+        # username ที่ขึ้นต้นด้วย = ต้องไม่กลายเป็นสูตรใน Excel
+        self.assertEqual(rows[0]['customer'], "'=buyer")
+
+    def test_jsonl_queries_stay_constant_per_chunk(self):
+        with self.assertNumQueries(1 + 2 * 3):
+            chunks, text = self.export('jsonl', chunk_size=2)
+        records = [json.loads(line) for line in text.splitlines()]
+
+        self.assertEqual(len(records), 5 * 2 + 1)
+        self.assertEqual(records[0]['customer'], '=buyer')
+        self.assertIs(records[0]['payment_successful'], True)
+        self.assertIsNone(records[2]['payment_method'])
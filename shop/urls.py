@@ -12,7 +12,12 @@ urlpatterns = [
     # ----------------------------------------------------------------------
     path('', views.index, name='index'), 
     path('search/', views.search_results, name='search_results'), 
+    path('search/autocomplete/', views.search_autocomplete, name='search_autocomplete'),
+    path('api/stock/', views.stock_levels, name='stock_levels'),
     path('product/<int:pk>/', views.product_detail, name='product_detail'), 
+    path('product/<int:product_id>/notify_restock/', views.subscribe_restock, name='subscribe_restock'),
+    path('feed/products.<str:fmt>', views.product_feed, name='product_feed'),
+    path('line/webhook/', views.line_webhook, name='line_webhook'),
 
     # ----------------------------------------------------------------------
     # 2. CART & CHECKOUT FLOW
@@ -22,6 +27,8 @@ urlpatterns = [
     path('cart/remove/<int:item_id>/', views.remove_from_cart, name='remove_from_cart'), 
     path('cart/update_quantity/<int:product_id>/', views.update_cart_quantity, name='update_cart_quantity'),
     path('checkout/', views.checkout, name='checkout'), 
+    path('waiting-room/', views.waiting_room, name='waiting_room'),
+    path('waiting-room/status/', views.waiting_room_status, name='waiting_room_status'),
     path('payment_process/<int:order_id>/', views.payment_process, name='payment_process'), 
     path('my_orders/', views.my_orders, name='my_orders'),
     path('order/<int:pk>/', views.order_detail, name='order_detail'),
@@ -67,10 +74,16 @@ urlpatterns = [
     path('admin_dashboard/', views.admin_dashboard, name='admin_dashboard'),
     
     path('manage/products/', views.manage_products, name='manage_products'),
+    path('manage/products/update/', views.manage_products_update, name='manage_products_update'),
     path('manage/product/add/', views.add_product, name='add_product'),
     path('manage/product/edit/<int:pk>/', views.edit_product, name='edit_product'),
     path('manage/product/delete/<int:pk>/', views.delete_product, name='delete_product'),
     
     path('manage/orders/', views.manage_orders, name='manage_orders'),
     path('manage/order/update_status/<int:pk>/', views.update_order_status, name='update_order_status'), 
+    path('manage/orders/bulk_update/', views.bulk_update_orders, name='bulk_update_orders'),
+    path('manage/orders/import_tracking/', views.import_tracking_csv, name='import_tracking_csv'),
+    path('manage/slow_queries/', views.slow_query_report, name='slow_query_report'),
+    path('manage/profiles/', views.profile_list, name='profile_list'),
+    path('manage/profiles/<str:name>', views.profile_download, name='profile_download'),
 ]
\ No newline at end of file
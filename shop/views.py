@@ -1,21 +1,48 @@
 # shop/views.py
 
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required, user_passes_test 
 from django.db.models import Sum, F 
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib import messages
-from django.db.models import Q 
+from django.db.models import Q, Prefetch
 from django.db import transaction 
 from django.core.paginator import Paginator, EmptyPage
 from django.contrib.auth.models import User
-from django.http import JsonResponse, HttpRequest, HttpResponse
-from django.views.decorators.http import require_POST 
+from django.http import JsonResponse, HttpRequest, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, Http404, StreamingHttpResponse, FileResponse
+from django.views.decorators.http import require_POST, condition
+from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth import views as auth_views 
 from django import forms # ต้อง import forms เพื่อใช้ ModelForm 
-
-from .models import Product, Cart, CartItem, Order, OrderItem, Payment
+import json
+import logging
+import os
+import re
+import time
+from decimal import Decimal
+
+from .models import Product, Cart, CartItem, Order, OrderItem, Payment, RestockSubscription, LineAccount
 from .forms import UserProfileForm 
+from .fulfilment import bulk_transition, parse_tracking_csv
+from .cart import get_cart
+from . import catalog, search_index
+from .facets import Filters, facet_context
+from .product_manager import ManagerFilters, SORT_LABELS, PAGE_SIZES, MAX_BATCH, apply_edits
+from . import feeds
+from .recommendations import get_recommendations
+from .forecasting import low_stock_alerts
+from . import slowlog, profiling, stock_status, caching
+from .admission import AdmissionController, client_id
+from .db import immediate_atomic
+from .idempotency import idempotent, new_key
+from . import order_cache
+from . import restock
+from django.utils.http import url_has_allowed_host_and_scheme, urlencode
+
+logger = logging.getLogger(__name__)
 
 # ----------------------------------------------------------------------
 # 💡 ฟอร์มชั่วคราวสำหรับจัดการสินค้า (เนื่องจาก forms.py ของคุณไม่มี ProductForm)
@@ -60,7 +87,7 @@ def register(request):
         form = UserCreationForm(request.POST)
         if form.is_valid():
             user = form.save()
-            # 💡 signal จะสร้าง Cart ให้ user อัตโนมัติ
+            # 💡 Cart จะถูกสร้างตอนเพิ่มสินค้าครั้งแรก (ดู shop/cart.py)
             messages.success(request, 'สมัครสมาชิกสำเร็จ! กรุณาเข้าสู่ระบบ')
             return redirect('shop:login')
         else:
@@ -107,7 +134,13 @@ def logout_done_page(request):
 
 def index(request):
     """แสดงรายการสินค้าทั้งหมด"""
-    products = Product.objects.filter(is_active=True).order_by('-created_at')
+    snapshot = catalog.get_snapshot()
+    filters = Filters.from_query(request.GET)
+    if filters.is_default:
+        # 💡 อ่านจาก catalog snapshot ในหน่วยความจำ (ไม่ query DB)
+        products = snapshot.items
+    else:
+        products = filters.apply(Product.objects.filter(is_active=True))
     
     # Pagination
     paginator = Paginator(products, 12) # 12 สินค้าต่อหน้า
@@ -121,12 +154,40 @@ def index(request):
     
     context = {
         'page_obj': page_obj,
+        **facet_context(filters, snapshot),
+        **_fragment_cache_context(snapshot),
+        **_grid_context(filters, page_obj, snapshot),
     }
     return render(request, 'shop/index.html', context)
 
+SEARCH_QUERY_MAX_LENGTH = 100
+
+def _fragment_cache_context(snapshot):
+    """key/timeout สำหรับ {% cache %} ของ HTML ที่ไม่ขึ้นกับสต็อก (เปลี่ยน version = cache ใหม่)"""
+    return {
+        'catalog_version': snapshot.version,
+        'fragment_timeout': stock_status.get_config()['FRAGMENT_TIMEOUT'],
+    }
+
+def _grid_context(filters, page_obj, snapshot, query=None):
+    """
+    query string ที่ normalise แล้วของตาราง/ลิงก์แบ่งหน้าสินค้า (ใช้เป็น key ของ {% cache %})
+    ⚠️ ห้ามใช้ request.get_full_path เป็น key: ?x=<สุ่ม> จะสร้าง cache entry ใหม่ไม่จำกัด (เบียด cache อื่นออกได้)
+    """
+    items = ([('q', query)] if query else []) + filters.query_items()
+    key = items + [('page', page_obj.number)]
+    if filters.in_stock:
+        # สินค้าที่อยู่ในตาราง "มีสินค้า" ขึ้นกับสต็อก → cache ใหม่เมื่อสต็อกเปลี่ยน (เหมือนตัวนับ facet)
+        key.append(('stock', snapshot.stock_version))
+    return {
+        'grid_params': urlencode(items),
+        'grid_key': urlencode(key),
+    }
+
 def search_results(request):
     """แสดงผลการค้นหาสินค้า"""
-    query = request.GET.get('q')
+    # 💡 ช่องว่างซ้ำ/ยาวเกินถูกตัดก่อน (คำค้นเดียวกัน = cache entry เดียวกัน)
+    query = ' '.join(request.GET.get('q', '').split())[:SEARCH_QUERY_MAX_LENGTH]
     products = Product.objects.filter(is_active=True)
     
     if query:
@@ -134,6 +195,9 @@ def search_results(request):
         products = products.filter(
             Q(name__icontains=query) | Q(description__icontains=query)
         ).distinct()
+    filters = Filters.from_query(request.GET)
+    matches = products
+    products = filters.apply(matches)
 
     # Pagination
     paginator = Paginator(products, 12)
@@ -145,30 +209,129 @@ def search_results(request):
     
     page_obj = paginator.get_page(page_number)
     
+    snapshot = catalog.get_snapshot()
     context = {
         'query': query,
         'page_obj': page_obj,
+        **facet_context(filters, snapshot, queryset=matches, query=query),
+        **_fragment_cache_context(snapshot),
+        **_grid_context(filters, page_obj, snapshot, query),
     }
     return render(request, 'shop/search_results.html', context)
 
+def search_autocomplete(request):
+    """คำแนะนำชื่อสินค้าขณะพิมพ์ (JSON) จาก prefix index ในหน่วยความจำ"""
+    query = request.GET.get('q', '')[:100]
+    try:
+        limit = min(max(int(request.GET.get('limit', 8)), 1), 20)
+    except ValueError:
+        limit = 8
+
+    results = [
+        {'id': pk, 'name': name, 'url': reverse('shop:product_detail', args=[pk])}
+        for pk, name in search_index.suggest(query, limit)
+    ]
+    return JsonResponse({'query': query, 'results': results})
+
 def product_detail(request, pk):
     """แสดงรายละเอียดสินค้า"""
-    product = get_object_or_404(Product, pk=pk, is_active=True)
+    snapshot = catalog.get_snapshot()
+    product = snapshot.get(pk)
+    if product is None:
+        raise Http404('ไม่พบสินค้า')
     
     context = {
         'product': product,
+        # 💡 คำนวณล่วงหน้าด้วย build_recommendations (ที่นี่แค่อ่าน 1 query)
+        # ส่งเป็น callable: template เรียกเฉพาะตอน fragment cache ไม่มี (cache hit ไม่ query เลย)
+        'recommendations': lambda: get_recommendations(pk, snapshot, limit=4),
+        **_fragment_cache_context(snapshot),
     }
+    # สถานะสต็อกจริงมาจาก stock_status ฝั่ง browser จึงเตรียมฟอร์มแจ้งเตือนไว้เสมอ (snapshot อาจไม่ล่าสุด)
+    if request.user.is_authenticated:
+        # ฟอร์มแจ้งเตือนเมื่อสินค้าเข้า: ถ้ายังไม่ได้ผูกบัญชี LINE แสดงรหัสยืนยันที่ต้องส่งหา bot
+        subscription = RestockSubscription.objects.filter(user=request.user, product_id=pk, notified_at__isnull=True).first()
+        context['restock_subscription'] = subscription
+        if subscription is not None and not subscription.line_user_id:
+            context['line_link_code'] = restock.current_link_code(request.user)
+            context['line_bot_id'] = restock.get_config()['BOT_BASIC_ID']
     return render(request, 'shop/product_detail.html', context)
 
+def stock_levels(request):
+    """สต็อกสดของหลายสินค้าในครั้งเดียว (?ids=1,2,3) ให้หน้า catalog ที่ cache ไว้ เติมสถานะมี/หมดเอง"""
+    config = stock_status.get_config()
+    product_ids = stock_status.parse_ids(request.GET.get('ids', ''), config['MAX_IDS'])
+    stock = stock_status.get_stock(product_ids, config) if product_ids else {}
+    response = JsonResponse({
+        'ttl': config['TTL'],
+        'products': {pk: {'stock': max(value, 0), 'in_stock': value > 0} for pk, value in stock.items()},
+    })
+    response['Cache-Control'] = f"public, max-age={config['TTL']}"
+    return response
+
+def _feed_generation(request):
+    # คำนวณครั้งเดียวต่อ request (ใช้ทั้งใน ETag และ key ของ chunk cache)
+    if not hasattr(request, '_feed_generation'):
+        request._feed_generation = feeds.feed_generation()
+    return request._feed_generation
+
+@condition(etag_func=lambda request, fmt: feeds.feed_etag(fmt, _feed_generation(request)) if fmt in feeds.FORMATS else None)
+def product_feed(request, fmt):
+    """Product feed สำหรับ marketplace (stream ทีละ chunk / ตอบ 304 ถ้าทั้ง catalog และ availability ไม่เปลี่ยน)"""
+    if fmt not in feeds.FORMATS:
+        raise Http404('ไม่รองรับรูปแบบ feed นี้')
+
+    base_url = request.build_absolute_uri('/').rstrip('/')
+    response = StreamingHttpResponse(
+        feeds.generate(fmt, base_url, generation=_feed_generation(request)),
+        content_type=feeds.FORMATS[fmt].content_type,
+    )
+    response['Content-Disposition'] = f'inline; filename="products.{fmt}"'
+    response['Cache-Control'] = 'public, max-age=300'
+    return response
+
+@login_required
+@require_POST
+def subscribe_restock(request, product_id):
+    """ขอรับแจ้งเตือนผ่าน LINE เมื่อสินค้ากลับมามีสต็อก (ส่งหา LINE ID ที่ยืนยันผ่าน bot แล้วเท่านั้น)"""
+    product = get_object_or_404(Product, pk=product_id, is_active=True)
+    line_user_id = (
+        LineAccount.objects.filter(user=request.user).values_list('line_user_id', flat=True).first() or ''
+    )
+    RestockSubscription.objects.update_or_create(
+        product=product, user=request.user,
+        defaults={'line_user_id': line_user_id, 'notified_at': None},
+    )
+    if line_user_id:
+        messages.success(request, f'เราจะแจ้งเตือนทาง LINE เมื่อ {product.name} กลับมามีสินค้า')
+    else:
+        # subscription รอไว้ก่อน จะส่งได้เมื่อผู้ใช้ส่งรหัสหา bot (webhook เติม line_user_id ให้)
+        code = restock.issue_link_code(request.user)
+        messages.info(request, f'ส่งรหัส {code} หา LINE ของร้านเพื่อยืนยันบัญชี แล้วเราจะแจ้งเตือนเมื่อ {product.name} กลับมามีสินค้า')
+    return redirect('shop:product_detail', pk=product.pk)
+
+@csrf_exempt
+@require_POST
+def line_webhook(request):
+    """Webhook ของ LINE bot: ผูกบัญชีเมื่อผู้ใช้ส่งรหัสยืนยัน / ยกเลิกการผูกเมื่อ unfollow"""
+    config = restock.get_config()
+    if not restock.verify_signature(request.body, request.headers.get('X-Line-Signature', ''), config['CHANNEL_SECRET']):
+        return HttpResponseForbidden()
+    try:
+        events = json.loads(request.body)['events']
+    except (ValueError, KeyError, TypeError):
+        return HttpResponseBadRequest()
+    restock.handle_webhook_events(events, config)
+    return HttpResponse()
+
 # ----------------------------------------------------------------------
 # 3. CART FLOW
 # ----------------------------------------------------------------------
 
-@login_required
 def view_cart(request):
-    """แสดงตะกร้าสินค้า"""
-    cart = get_object_or_404(Cart, user=request.user)
-    cart_items = cart.cartitem_set.all().select_related('product')
+    """แสดงตะกร้าสินค้า (ทั้งผู้ใช้ที่ล็อกอินและ guest)"""
+    cart = get_cart(request)
+    cart_items = cart.get_items() if cart is not None else []
     
     context = {
         'cart': cart,
@@ -176,55 +339,55 @@ def view_cart(request):
     }
     return render(request, 'shop/view_cart.html', context)
 
-@login_required
 @require_POST
 def add_to_cart(request, product_id):
-    """เพิ่มสินค้าลงในตะกร้า"""
+    """เพิ่มสินค้าลงในตะกร้า (Cart ใน DB ถูกสร้างตอนนี้ถ้ายังไม่มี / guest เก็บใน cookie)"""
     product = get_object_or_404(Product, pk=product_id, is_active=True)
-    cart = get_object_or_404(Cart, user=request.user)
     quantity = 1 # เพิ่มทีละ 1 ชิ้น
     
-    if product.stock < quantity:
+    if product.available_stock < quantity:
         messages.error(request, f'สินค้า "{product.name}" มีสต็อกไม่เพียงพอ')
         return redirect('shop:product_detail', pk=product_id)
 
-    cart_item, created = CartItem.objects.get_or_create(
-        cart=cart,
-        product=product,
-        defaults={'quantity': quantity}
-    )
+    # 💡 ตรวจสต็อกให้ผ่านก่อน แล้วค่อยสร้าง Cart ใน DB (เพิ่มไม่สำเร็จ = ไม่มีแถว Cart ว่างค้าง)
+    cart = get_cart(request)
+    current_quantity = cart.get_quantity(product.id) if cart is not None else 0
+    new_quantity = current_quantity + quantity
+
+    # ตรวจสอบสต็อกอีกครั้ง
+    if current_quantity and product.available_stock < new_quantity:
+        messages.error(request, f'ไม่สามารถเพิ่ม "{product.name}" ได้ สต็อกมีเพียง {product.available_stock} ชิ้น')
+        return redirect('shop:view_cart')
+
+    if cart is None:
+        cart = get_cart(request, create=True)
+    try:
+        cart.set_quantity(product, new_quantity)
+    except ValueError as e:
+        messages.error(request, str(e))
+        return redirect('shop:view_cart')
 
-    if not created:
+    if current_quantity:
         # ถ้ามีอยู่แล้วให้เพิ่มจำนวน
-        new_quantity = cart_item.quantity + quantity
-        # ตรวจสอบสต็อกอีกครั้ง
-        if product.stock >= new_quantity:
-            cart_item.quantity = new_quantity
-            cart_item.save()
-            messages.success(request, f'เพิ่ม "{product.name}" ลงในตะกร้าแล้ว ({new_quantity} ชิ้น)')
-        else:
-            messages.error(request, f'ไม่สามารถเพิ่ม "{product.name}" ได้ สต็อกมีเพียง {product.stock} ชิ้น')
+        messages.success(request, f'เพิ่ม "{product.name}" ลงในตะกร้าแล้ว ({new_quantity} ชิ้น)')
     else:
         messages.success(request, f'เพิ่ม "{product.name}" ลงในตะกร้าแล้ว')
     
     return redirect('shop:view_cart')
 
-@login_required
+@require_POST
 def remove_from_cart(request, item_id):
-    """ลบรายการสินค้าออกจากตะกร้า"""
-    if request.method not in ['POST', 'GET']:
-        messages.error(request, 'คำขอไม่ถูกต้อง')
+    """ลบรายการสินค้าออกจากตะกร้า (item_id ของตะกร้า guest คือ product id)"""
+    cart = get_cart(request)
+    if cart is None:
         return redirect('shop:view_cart')
-    
-    cart = get_object_or_404(Cart, user=request.user)
-    cart_item = get_object_or_404(CartItem, pk=item_id, cart=cart)
-    product_name = cart_item.product.name
-    
-    cart_item.delete()
-    messages.warning(request, f'ลบ "{product_name}" ออกจากตะกร้าแล้ว')
+
+    # 💡 ลบเฉพาะรายการนั้นด้วย pk (ไม่โหลดทั้งตะกร้ามาวนหา)
+    item = cart.remove(item_id)
+    if item is not None:
+        messages.warning(request, f'ลบ "{item.product.name}" ออกจากตะกร้าแล้ว')
     return redirect('shop:view_cart')
 
-@login_required
 @require_POST
 def update_cart_quantity(request, product_id):
     """อัปเดตจำนวนสินค้าในตะกร้า (สำหรับ AJAX)"""
@@ -238,17 +401,17 @@ def update_cart_quantity(request, product_id):
         return JsonResponse({'success': False, 'message': 'จำนวนสินค้าไม่ถูกต้อง'}, status=400)
 
     try:
-        cart = Cart.objects.get(user=request.user)
+        cart = get_cart(request)
         product = Product.objects.get(pk=product_id)
-        cart_item = CartItem.objects.get(cart=cart, product=product)
+        if cart is None or not cart.get_quantity(product.id):
+            raise CartItem.DoesNotExist
 
-        if new_quantity > product.stock:
-            return JsonResponse({'success': False, 'message': f'สต็อกมีเพียง {product.stock} ชิ้น'}, status=400)
+        if new_quantity > product.available_stock:
+            return JsonResponse({'success': False, 'message': f'สต็อกมีเพียง {product.available_stock} ชิ้น'}, status=400)
         
-        cart_item.quantity = new_quantity
-        cart_item.save()
+        cart.set_quantity(product, new_quantity)
         
-        subtotal = float(cart_item.subtotal())
+        subtotal = float(new_quantity * product.price)
         total_price = float(cart.total_price)
 
         return JsonResponse({
@@ -258,34 +421,64 @@ def update_cart_quantity(request, product_id):
             'total_items': cart.total_items
         })
 
-    except (Cart.DoesNotExist, Product.DoesNotExist, CartItem.DoesNotExist):
+    except (Product.DoesNotExist, CartItem.DoesNotExist):
         return JsonResponse({'success': False, 'message': 'รายการสินค้าในตะกร้าไม่พบ'}, status=404)
     except Exception as e:
         return JsonResponse({'success': False, 'message': str(e)}, status=500)
 
+def waiting_room(request):
+    """หน้ารอคิวช่วง drop (AdmissionControlMiddleware ส่งผู้ใช้มาที่นี่เมื่อระบบเต็ม)"""
+    next_url = request.GET.get('next', '')
+    if not url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}, require_https=request.is_secure()):
+        next_url = reverse('shop:view_cart')
+
+    controller = AdmissionController()
+    decision, retry_after, position = controller.poll(client_id(request))
+    context = {
+        'next_url': next_url,
+        'position': position,
+        'admitted': decision == AdmissionController.ADMIT,
+        'poll_interval': controller.config['POLL_INTERVAL'],
+    }
+    return render(request, 'shop/waiting_room.html', context)
+
+def waiting_room_status(request):
+    """สถานะคิว (JSON) ให้หน้า waiting room poll"""
+    decision, retry_after, position = AdmissionController().poll(client_id(request))
+    return JsonResponse({
+        'admitted': decision == AdmissionController.ADMIT,
+        'position': position,
+        'retry_after': retry_after,
+    })
+
 # ----------------------------------------------------------------------
 # 4. CHECKOUT & ORDER FLOW
 # ----------------------------------------------------------------------
 
 @login_required
+@idempotent
 def checkout(request):
     """หน้าสำหรับดำเนินการสั่งซื้อ"""
-    cart = get_object_or_404(Cart, user=request.user)
-    cart_items = cart.cartitem_set.all().select_related('product')
+    cart = get_cart(request)
+    cart_items = cart.cartitem_set.all().select_related('product') if cart is not None else CartItem.objects.none()
 
     if not cart_items:
         messages.warning(request, 'ตะกร้าสินค้าว่างเปล่า ไม่สามารถดำเนินการสั่งซื้อได้')
         return redirect('shop:index')
+    # ยอดจากราคาปัจจุบันใน DB (ไม่ใช้ cart.total_price ที่อ่านจาก catalog snapshot)
+    total_amount = sum((item.subtotal() for item in cart_items), Decimal('0.00'))
 
     if request.method == 'POST':
         # ในโปรเจกต์จริงควรมีฟอร์มสำหรับที่อยู่จัดส่ง
         # 💡 กระบวนการสร้าง Order:
+        started = time.perf_counter()
         try:
-            with transaction.atomic():
+            # 💡 อ่านยอดตะกร้าก่อนเขียน → จอง write lock ตั้งแต่ต้น ให้ checkout ที่มาพร้อมกันรอคิวแทน error (ดู shop/db.py)
+            with immediate_atomic():
                 # 1. สร้าง Order
                 order = Order.objects.create(
                     user=request.user,
-                    total_amount=cart.total_price,
+                    total_amount=total_amount,
                     # status เป็น PENDING (รอการชำระเงิน)
                     # จำลองข้อมูลที่อยู่จัดส่ง
                     shipping_address="123 ถนนตัวอย่าง, เขตสมมติ, จังหวัดสมมติ, 10000"
@@ -293,9 +486,9 @@ def checkout(request):
 
                 # 2. ย้าย CartItem ไปเป็น OrderItem
                 for item in cart_items:
-                    if item.product.stock < item.quantity:
+                    if item.product.available_stock < item.quantity:
                         # Rollback ทั้งหมดหากสต็อกไม่พอ
-                        messages.error(request, f'สินค้า "{item.product.name}" มีสต็อกไม่เพียงพอ ({item.product.stock} ชิ้น)')
+                        messages.error(request, f'สินค้า "{item.product.name}" มีสต็อกไม่เพียงพอ ({item.product.available_stock} ชิ้น)')
                         raise Exception("Insufficient stock")
 
                     OrderItem.objects.create(
@@ -306,28 +499,47 @@ def checkout(request):
                     )
 
                 # 3. ลบสินค้าออกจาก Cart
+                item_count = len(cart_items)
                 cart_items.delete()
-                
+
+                logger.info('order created', extra={
+                    'event': 'checkout.order_created', 'order_id': order.id, 'user_id': request.user.id,
+                    'item_count': item_count, 'total_amount': order.total_amount,
+                    'duration_ms': round((time.perf_counter() - started) * 1000, 2),
+                })
                 messages.success(request, f'สร้างคำสั่งซื้อ #{order.id} สำเร็จ! กรุณาชำระเงิน')
                 return redirect('shop:payment_process', order_id=order.id)
 
         except Exception as e:
             # ข้อผิดพลาดอื่นๆ เช่น สต็อกไม่พอ
-            print(f"Checkout Error: {e}")
+            logger.warning('checkout failed', extra={
+                'event': 'checkout.failed', 'user_id': request.user.id, 'error': str(e),
+                'duration_ms': round((time.perf_counter() - started) * 1000, 2),
+            })
             messages.error(request, 'เกิดข้อผิดพลาดในการสร้างคำสั่งซื้อ กรุณาลองใหม่อีกครั้ง')
             return redirect('shop:view_cart')
 
     context = {
         'cart': cart,
         'cart_items': cart_items,
+        'total_amount': total_amount,
         # ข้อมูลที่อยู่/ค่าจัดส่ง (ถ้ามี)
+        # 💡 key ใหม่ทุกครั้งที่แสดงฟอร์ม กดส่งซ้ำ = ได้ผลลัพธ์เดิม (ดู shop/idempotency.py)
+        'idempotency_key': new_key(),
     }
     return render(request, 'shop/checkout.html', context)
 
 
 @login_required
+@idempotent
 def payment_process(request, order_id):
     """หน้าจำลองการชำระเงิน"""
+    # 💡 ออเดอร์ที่จบแล้วและอยู่ใน render cache → redirect ได้เลยโดยไม่ query
+    cached = order_cache.get_detail(order_id, request.user.id)
+    if cached is not None:
+        messages.info(request, f'คำสั่งซื้อ #{order_id} ได้ชำระเงินแล้วและอยู่ในสถานะ "{dict(Order.STATUS_CHOICES)[cached["status"]]}"')
+        return redirect('shop:order_detail', pk=order_id)
+
     order = get_object_or_404(Order, pk=order_id, user=request.user)
     
     # ถ้า Order ถูกชำระเงินแล้ว ให้แสดงผลลัพธ์
@@ -346,14 +558,13 @@ def payment_process(request, order_id):
     if request.method == 'POST':
         # 💡 กระบวนการจำลองการยืนยันชำระเงิน
         if not payment.is_successful:
-            # อัปเดต Payment และ Order
+            # อัปเดต Payment (Payment.save จะเปลี่ยน Order เป็น CONFIRMED ให้)
+            # 💡 ใช้ order instance เดียวกัน เพื่อไม่ต้องโหลด Order ซ้ำ และสถานะที่จำไว้ตรงกัน
+            payment.order = order
             payment.is_successful = True
             payment.save()
-
-            order.status = 'CONFIRMED' # เปลี่ยนสถานะเป็น CONFIRMED 
-            order.save()
             
-            # 💡 Signal จะทำงานที่นี่เพื่อตัดสต็อก
+            # 💡 hook order_status_changed จะทำงานที่นี่เพื่อตัดสต็อก (ครั้งเดียวต่อ transition)
             messages.success(request, f'การชำระเงินสำหรับคำสั่งซื้อ #{order.id} สำเร็จแล้ว! คำสั่งซื้อถูกยืนยันแล้ว')
             return redirect('shop:order_detail', pk=order.id)
         else:
@@ -364,6 +575,7 @@ def payment_process(request, order_id):
     context = {
         'order': order,
         'payment': payment,
+        'idempotency_key': new_key(),
     }
     return render(request, 'shop/payment_process.html', context)
 
@@ -371,10 +583,18 @@ def payment_process(request, order_id):
 @login_required
 def my_orders(request):
     """แสดงรายการคำสั่งซื้อทั้งหมดของผู้ใช้งาน"""
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
-    
+    # 💡 HTML ของรายการถูก cache ต่อผู้ใช้ (ลบเมื่อออเดอร์ของผู้ใช้เปลี่ยน ดู shop/order_cache.py)
+    orders_html = order_cache.get_summary(request.user.id)
+    if orders_html is None:
+        orders = (
+            Order.objects.filter(user=request.user).order_by('-created_at')
+            .prefetch_related(Prefetch('items', queryset=OrderItem.objects.select_related('product')))
+        )
+        orders_html = render_to_string('shop/my_orders_summary.html', {'orders': orders})
+        order_cache.set_summary(request.user.id, orders_html)
+
     context = {
-        'orders': orders,
+        'orders_html': mark_safe(orders_html),
     }
     return render(request, 'shop/my_orders.html', context)
 
@@ -382,12 +602,22 @@ def my_orders(request):
 @login_required
 def order_detail(request, pk):
     """แสดงรายละเอียดคำสั่งซื้อ"""
-    # จำกัดให้ผู้ใช้ดูได้เฉพาะออเดอร์ของตัวเองเท่านั้น
-    order = get_object_or_404(Order, pk=pk, user=request.user)
-    
+    # 💡 ออเดอร์ที่จบแล้ว (DELIVERED / CANCELLED) ใช้ HTML จาก render cache ไม่ query เลย
+    cached = order_cache.get_detail(pk, request.user.id)
+    if cached is not None:
+        order_body = cached['html']
+    else:
+        # จำกัดให้ผู้ใช้ดูได้เฉพาะออเดอร์ของตัวเองเท่านั้น
+        order = get_object_or_404(Order.objects.select_related('user'), pk=pk, user=request.user)
+        order_body = render_to_string('shop/order_detail_body.html', {
+            'order': order,
+            'order_items': order.items.all().select_related('product'),
+        })
+        order_cache.set_detail(order, order_body)
+
     context = {
-        'order': order,
-        'order_items': order.items.all().select_related('product'),
+        'order_id': pk,
+        'order_body': mark_safe(order_body),
     }
     return render(request, 'shop/order_detail.html', context)
 
@@ -414,6 +644,10 @@ def admin_dashboard(request: HttpRequest) -> HttpResponse:
         'total_orders': total_orders,
         'pending_orders': pending_orders,
         'recent_orders': recent_orders,
+        # 💡 สินค้าที่ต้องเติมสต็อก (คำนวณทุกคืนด้วย forecast_demand)
+        'low_stock_alerts': low_stock_alerts(),
+        # ตัวนับของ cache กัน stampede (เฉพาะ worker ที่ตอบ request นี้)
+        'cache_metrics': sorted(caching.metrics().items()),
     }
     return render(request, 'shop/admin_dashboard.html', context) 
 
@@ -421,14 +655,42 @@ def admin_dashboard(request: HttpRequest) -> HttpResponse:
 @login_required
 @user_passes_test(lambda user: user.is_staff)
 def manage_products(request):
-    """หน้าจัดการรายการสินค้าทั้งหมด"""
-    products = Product.objects.all().order_by('-created_at')
-    
+    """หน้าจัดการรายการสินค้าทั้งหมด (กรอง/เรียง/แบ่งหน้าที่ฝั่ง DB ดู shop/product_manager.py)"""
+    filters = ManagerFilters.from_query(request.GET)
+    paginator = Paginator(filters.queryset(), filters.per_page)
+    page_obj = paginator.get_page(request.GET.get('page'))
+
     context = {
-        'products': products
+        'products': page_obj,
+        'page_range': paginator.get_elided_page_range(page_obj.number, on_each_side=2, on_ends=1),
+        'filters': filters,
+        'sort_labels': SORT_LABELS,
+        'page_sizes': PAGE_SIZES,
+        'max_batch': MAX_BATCH,
     }
     return render(request, 'shop/manage_products.html', context)
 
+@login_required
+@user_passes_test(lambda user: user.is_staff)
+@require_POST
+def manage_products_update(request):
+    """บันทึกการแก้สต็อก/ราคาแบบ inline (JSON: {"changes": [{"id": 1, "stock": 10, "price": "590.00"}, ...]})"""
+    try:
+        changes = json.loads(request.body)['changes']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'success': False, 'message': 'ข้อมูลไม่ถูกต้อง'}, status=400)
+    if not isinstance(changes, list) or not changes:
+        return JsonResponse({'success': False, 'message': 'ไม่มีรายการที่ต้องแก้ไข'}, status=400)
+    if len(changes) > MAX_BATCH:
+        return JsonResponse({'success': False, 'message': f'แก้ไขได้ครั้งละไม่เกิน {MAX_BATCH} รายการ'}, status=400)
+
+    results = apply_edits(changes)
+    return JsonResponse({
+        'success': all(row.ok for row in results),
+        'updated': sum(1 for row in results if row.ok),
+        'results': [row._asdict() for row in results],
+    })
+
 @login_required
 @user_passes_test(lambda user: user.is_staff)
 def add_product(request):
@@ -481,8 +743,9 @@ def delete_product(request, pk):
     
     if request.method == 'POST':
         # ในการใช้งานจริง ควรมีการยืนยันก่อนลบ (เช่น ใช้ Modal)
-        product.delete()
-        messages.warning(request, f'ลบสินค้า "{product_name}" ออกจากระบบแล้ว')
+        # 💡 soft delete: UPDATE แถวเดียว ไม่ cascade ไปตะกร้า/ประวัติคำสั่งซื้อ (ดู shop/purge.py)
+        Product.objects.filter(pk=product.pk).soft_delete()
+        messages.warning(request, f'ลบสินค้า "{product_name}" ออกจากร้านแล้ว (ประวัติคำสั่งซื้อยังอยู่ครบ)')
         return redirect('shop:manage_products')
         
     # หากเข้าถึงด้วย GET (ไม่ควรเกิดขึ้น)
@@ -493,9 +756,14 @@ def delete_product(request, pk):
 @login_required
 @user_passes_test(lambda user: user.is_staff)
 def manage_orders(request):
-    """หน้าจัดการรายการคำสั่งซื้อทั้งหมดสำหรับ Admin"""
+    """หน้าจัดการรายการคำสั่งซื้อทั้งหมดสำหรับ Admin (เลือกหลายออเดอร์เพื่อเปลี่ยนสถานะ / นำเข้า tracking จาก CSV)"""
     # ดึงออเดอร์ทั้งหมดและเรียงตามวันที่สร้างล่าสุด
-    orders = Order.objects.select_related('user').order_by('-created_at')
+    orders = Order.objects.select_related('user').order_by('-created_at', '-id')
+    status = request.GET.get('status', '')
+    if status in dict(Order.STATUS_CHOICES):
+        orders = orders.filter(status=status)
+    else:
+        status = ''
     
     # Pagination
     paginator = Paginator(orders, 20)
@@ -504,6 +772,8 @@ def manage_orders(request):
 
     context = {
         'orders': page_obj,
+        'status': status,
+        'status_choices': Order.STATUS_CHOICES,
     }
     return render(request, 'shop/manage_orders.html', context)
 
@@ -521,6 +791,10 @@ def update_order_status(request, pk):
         valid_statuses = [choice[0] for choice in Order.STATUS_CHOICES]
 
         if new_status and new_status in valid_statuses:
+            if not Order.can_transition(order.status, new_status):
+                messages.error(request, f'ไม่สามารถเปลี่ยนสถานะคำสั่งซื้อ #{order.id} จาก "{order.get_status_display()}" เป็น "{dict(Order.STATUS_CHOICES)[new_status]}" ได้')
+                return redirect('shop:manage_orders')
+
             with transaction.atomic():
                 order.status = new_status
                 
@@ -534,3 +808,83 @@ def update_order_status(request, pk):
             
     # ไม่ว่าจะสำเร็จหรือไม่ ให้ redirect กลับไปที่หน้าจัดการออเดอร์
     return redirect('shop:manage_orders')
+
+
+@login_required
+@user_passes_test(lambda user: user.is_staff)
+@require_POST
+def bulk_update_orders(request):
+    """อัปเดตสถานะหลายออเดอร์พร้อมกัน (เลือกจากหน้าจัดการออเดอร์)"""
+    order_ids = [int(pk) for pk in request.POST.getlist('order_ids') if pk.isdigit()]
+    new_status = request.POST.get('status')
+
+    if not order_ids:
+        messages.error(request, 'กรุณาเลือกคำสั่งซื้ออย่างน้อย 1 รายการ')
+        return redirect('shop:manage_orders')
+
+    results = bulk_transition(order_ids, new_status)
+    return _render_bulk_results(request, results)
+
+
+@login_required
+@user_passes_test(lambda user: user.is_staff)
+@require_POST
+def import_tracking_csv(request):
+    """อัปโหลดไฟล์ CSV (order_id, tracking_number) จากบริษัทขนส่ง แล้วเปลี่ยนสถานะเป็น SHIPPED"""
+    uploaded = request.FILES.get('csv_file')
+    if not uploaded:
+        messages.error(request, 'กรุณาเลือกไฟล์ CSV')
+        return redirect('shop:manage_orders')
+
+    pairs, errors = parse_tracking_csv(uploaded)
+    results = errors + bulk_transition(list(pairs), tracking_numbers=pairs)
+    return _render_bulk_results(request, results)
+
+
+def _render_bulk_results(request, results):
+    success_count = sum(1 for row in results if row.ok)
+    context = {
+        'results': results,
+        'success_count': success_count,
+        'failed_count': len(results) - success_count,
+    }
+    return render(request, 'shop/bulk_order_results.html', context)
+
+
+@login_required
+@user_passes_test(lambda user: user.is_staff)
+def slow_query_report(request):
+    """สรุป slow query จากไฟล์ log แยกตาม fingerprint (ใช้หา index ที่ขาด)"""
+    config = slowlog.get_config()
+    records = slowlog.read_records(config['FILE'])
+    context = {
+        'groups': slowlog.group_by_fingerprint(records)[:100],
+        'record_count': len(records),
+        'threshold_ms': config['THRESHOLD_MS'],
+        'enabled': config['ENABLED'],
+    }
+    return render(request, 'shop/slow_queries.html', context)
+
+
+@login_required
+@user_passes_test(lambda user: user.is_staff)
+def profile_list(request):
+    """รายการไฟล์ profile ของ request และ token สำหรับ header X-Profile"""
+    config = profiling.get_config()
+    context = {
+        'profiles': profiling.list_profiles(config['DIRECTORY']),
+        'directory': config['DIRECTORY'],
+        'sample_rate': config['SAMPLE_RATE'],
+        'token': profiling.make_token('sample'),
+        'token_max_age_minutes': config['TOKEN_MAX_AGE'] // 60,
+        'enabled': config['ENABLED'],
+    }
+    return render(request, 'shop/profiles.html', context)
+
+@login_required
+@user_passes_test(lambda user: user.is_staff)
+def profile_download(request, name):
+    path = profiling.profile_path(name)
+    if path is None or not os.path.exists(path):
+        raise Http404('ไม่พบไฟล์ profile')
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=name)